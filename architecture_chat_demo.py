@@ -9,14 +9,27 @@ The script interacts with a foundation model on Amazon Bedrock to provide inform
 and user input.
 """
 
-import boto3
+import argparse
+import contextvars
+import json
 import logging
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as ToolTimeoutError, wait as wait_for_futures
 from enum import Enum
 from dotenv import load_dotenv
 
 import util.demo_print_utils as output
-import audit_info_tool, best_practices_tool, joy_count_tool
+from util import aws_clients, diagram_analysis, diagram_diff, drawio_parser
+from util.conversation_history import HistoryManager
+from util.image_preprocessing import load_image
+from util.model_router import extract_features, load_router
+from util.resilience import ResilientInvoker
+from util.session_store import SessionStore
+from util.tool_registry import create_default_registry
+from util.tool_results import ToolResultCache
+from util.tracing import ConsoleExporter, current_span, get_tracer, payload_bytes, token_attributes
+from util.turn_budget import TurnBudget
 
 logging.basicConfig(level=logging.INFO, format="%(message)s")
 
@@ -30,9 +43,31 @@ class SupportedModels(Enum):
     CLAUDE_SONNET = "anthropic.claude-3-sonnet-20240229-v1:0"
     CLAUDE_SONNET_35 = "anthropic.claude-3-5-sonnet-20240620-v1:0"
     CLAUDE_HAIKU = "anthropic.claude-3-haiku-20240307-v1:0"
+    CLAUDE_HAIKU_35 = "anthropic.claude-3-5-haiku-20241022-v1:0"
+    # Claude 3.7 Sonnet is only available through a cross-region inference profile
+    CLAUDE_SONNET_37 = "us.anthropic.claude-3-7-sonnet-20250219-v1:0"
+    NOVA_PRO = "amazon.nova-pro-v1:0"
     COHERE_COMMAND_R = "cohere.command-r-v1:0"
     COHERE_COMMAND_R_PLUS = "cohere.command-r-plus-v1:0"
 
+# Models that support prompt caching with cache points in the Converse API, see:
+# https://docs.aws.amazon.com/bedrock/latest/userguide/prompt-caching.html
+PROMPT_CACHING_MODELS = {
+    SupportedModels.CLAUDE_HAIKU_35.value,
+    SupportedModels.CLAUDE_SONNET_37.value,
+    SupportedModels.NOVA_PRO.value,
+}
+
+# Models that accept images. A turn whose request contains the diagram image is only sent to these models.
+VISION_MODELS = {
+    SupportedModels.CLAUDE_OPUS.value,
+    SupportedModels.CLAUDE_SONNET.value,
+    SupportedModels.CLAUDE_SONNET_35.value,
+    SupportedModels.CLAUDE_HAIKU.value,
+    SupportedModels.CLAUDE_SONNET_37.value,
+    SupportedModels.NOVA_PRO.value,
+}
+
 # Supported image formats
 image_formats = {
     "png": "png",
@@ -40,9 +75,32 @@ image_formats = {
     "jpeg": "jpeg"
 }
 
+# Supported diagram formats that are sent as text instead of an image
+diagram_formats = {
+    "drawio": drawio_parser.load_drawio
+}
+
+# Diagrams are downscaled to the model's effective resolution and re-encoded before they're sent.
+# The results are cached by the diagram's content hash, so later sessions skip the preprocessing.
+# With IMAGE_TILING=true, very large diagrams are also split into full-resolution tiles.
+IMAGE_CACHE_DIR = os.getenv('IMAGE_CACHE_DIR', '.cache/images')
+IMAGE_TILING = os.getenv('IMAGE_TILING', 'false').lower() == 'true'
+
 # Set the model ID
 MODEL_ID = SupportedModels.CLAUDE_SONNET_35.value
 
+# Each turn is routed to a model by the rules of the routing policy, e.g. simple lookups to a Haiku model.
+# Turns that no rule matches use the policy's default model, or MODEL_ID. Set MODEL_ROUTING_POLICY to an
+# empty value to send all turns to MODEL_ID.
+MODEL_ROUTING_POLICY = os.getenv('MODEL_ROUTING_POLICY', 'model_routing_policy.json')
+
+# Every request repeats the same prefix: the tool specifications, the system prompt, and the diagram.
+# With prompt caching, cache points after the system prompt and after the diagram let the model reuse
+# that prefix across tool rounds and follow-up questions instead of processing it again.
+# Caching applies if MODEL_ID is in PROMPT_CACHING_MODELS and the installed boto3 supports cache points.
+PROMPT_CACHING = os.getenv('PROMPT_CACHING', 'true').lower() == 'true'
+CACHE_POINT = {"cachePoint": {"type": "default"}}
+
 SYSTEM_PROMPT = """
 You are an AWS Solutions Architect who can answer questions about an architecture diagram. You have access to three tools:
 
@@ -68,36 +126,196 @@ Best_Practices tool.
 - Complete the entire process until you have all required data before sending the complete response.
 """
 
-# The maximum number of recursive calls allowed in the run function.
-# This helps prevent infinite loops and potential performance issues.
-MAX_RECURSIONS = 5
+# Stream the model's response with the ConverseStream API, printing text as it arrives.
+# Set STREAMING=false in the .env file to use the blocking Converse API instead.
+STREAMING = os.getenv('STREAMING', 'true').lower() == 'true'
+
+# The conversation history sent to the model is compacted to stay within this estimated number of tokens.
+# After the first turn, the diagram is replaced by a text description that's generated in the background,
+# and tool results of earlier turns are shortened. Beyond the budget, the oldest turns are summarized.
+HISTORY_TOKEN_BUDGET = int(os.getenv('HISTORY_TOKEN_BUDGET', '30000'))
+
+# The model's analysis of each diagram image, its services, connections, data flow, and notes, is stored in
+# DIAGRAM_ANALYSIS_DIR by the diagram's content hash and the model ID. A new session on a diagram that has
+# already been analyzed sends the analysis as text instead of the image. Set DIAGRAM_ANALYSIS_DIR to an empty
+# value to turn off the store. With PREWARM_DIAGRAM_ANALYSES=true, the app analyzes all diagrams in the demo/
+# directory in the background when it starts.
+DIAGRAM_ANALYSIS_DIR = os.getenv('DIAGRAM_ANALYSIS_DIR', '.cache/analyses')
+PREWARM_DIAGRAM_ANALYSES = os.getenv('PREWARM_DIAGRAM_ANALYSES', 'false').lower() == 'true'
+
+# The answers of each review are recorded in the analysis store as findings. A review of a diagram's revision
+# sends the changes since the previous revision, and the last REVISION_FINDINGS findings of the previous
+# revision, instead of the whole diagram. Each finding is shortened to FINDING_MAX_CHARACTERS characters.
+REVISION_FINDINGS = int(os.getenv('REVISION_FINDINGS', '10'))
+FINDING_MAX_CHARACTERS = 2000
+
+# Conversations are saved to SESSION_DIR after each turn, so they can be resumed after the app stops, with
+# python architecture_chat_demo.py --resume <session ID>. Images are stored once and referenced from the turns.
+# On resume, the first turn and the last RESUME_TURNS turns are loaded; older turns are only loaded as the
+# snippets that summarize them. Set SESSION_DIR to an empty value to turn off saving.
+SESSION_DIR = os.getenv('SESSION_DIR', '.cache/sessions')
+RESUME_TURNS = int(os.getenv('RESUME_TURNS', '10'))
+
+# Budgets for a single user turn. The maximum number of tool rounds prevents infinite tool use loops,
+# the time and token limits (counted from the usage field of each response) cap latency and cost.
+# When a budget is exhausted, the turn ends early with the answer the model has given so far.
+MAX_TOOL_ROUNDS = int(os.getenv('MAX_TOOL_ROUNDS', '5'))
+MAX_TURN_SECONDS = float(os.getenv('MAX_TURN_SECONDS', '300'))
+MAX_TURN_INPUT_TOKENS = int(os.getenv('MAX_TURN_INPUT_TOKENS', '200000'))
+MAX_TURN_OUTPUT_TOKENS = int(os.getenv('MAX_TURN_OUTPUT_TOKENS', '16000'))
+
+# Tool calls requested in the same model response run concurrently on a bounded thread pool.
+# A tool that doesn't respond within the timeout returns an error result to the model instead.
+MAX_TOOL_WORKERS = int(os.getenv('MAX_TOOL_WORKERS', '4'))
+TOOL_TIMEOUT_SECONDS = float(os.getenv('TOOL_TIMEOUT_SECONDS', '30'))
+
+# Tool results are reused within a session while they're fresh, see create_default_registry for the time each
+# tool's results stay fresh. The results of PREFETCH_TOOLS, a comma-separated list of tool names, are fetched
+# speculatively when the diagram is selected, with the system name inferred from the diagram's file name.
+# Set TOOL_RESULT_CACHE=false to invoke the tools for every call.
+TOOL_RESULT_CACHE = os.getenv('TOOL_RESULT_CACHE', 'true').lower() == 'true'
+PREFETCH_TOOLS = [
+    name.strip() for name in os.getenv('PREFETCH_TOOLS', 'Audit_Info_Tool,Joy_Count_Tool').split(',') if name.strip()
+]
+
+# Calls to Amazon Bedrock that are throttled, time out, or fail transiently are retried with jittered exponential
+# backoff, up to BEDROCK_MAX_ATTEMPTS per model. Calls are paced by a limiter per model that adapts to throttling.
+# If a model stays unavailable, the call falls back to the next model in MODEL_FALLBACKS, a comma-separated
+# list of SupportedModels names. With HEDGE_AFTER_SECONDS, a blocking call that hasn't returned after this time
+# is sent a second time, and the first response is used.
+BEDROCK_MAX_ATTEMPTS = int(os.getenv('BEDROCK_MAX_ATTEMPTS', '4'))
+MODEL_FALLBACKS = [
+    SupportedModels[name.strip()].value
+    for name in os.getenv('MODEL_FALLBACKS', 'CLAUDE_SONNET,CLAUDE_HAIKU').split(',')
+    if name.strip()
+]
+HEDGE_AFTER_SECONDS = float(os.getenv('HEDGE_AFTER_SECONDS', '0')) or None
+
+# The metrics of a user turn that are reported, see ArchitectureChatDemo.get_turn_metrics
+TURN_METRICS = (
+    "time_to_first_token_ms",
+    "total_latency_ms",
+    "input_tokens",
+    "output_tokens",
+    "cache_read_input_tokens",
+    "cache_write_input_tokens",
+    "model_id",
+    "routing_rule",
+    "tool_rounds",
+    "stop_reason",
+    "exhausted_budget",
+)
 
 class ArchitectureChatDemo:
     """
     Demonstrates how to chat with your architecture using the Amazon Bedrock Converse API.
     """
 
-    def __init__(self):
-        # Prepare the system prompt
-        self.system_prompt = [{"text": SYSTEM_PROMPT}]
+    def __init__(self, streaming=STREAMING, quiet=False, output_sink=None):
+        """
+        :param streaming: Whether to use the ConverseStream API.
+        :param quiet: Whether to run without printing the conversation, e.g. in the batch runner.
+        :param output_sink: An object with the functions of util.demo_print_utils that receives the conversation
+            instead of the console, e.g. to forward it to a client of the chat server.
+        """
+        # Use the ConverseStream API if streaming is enabled
+        self.streaming = streaming
 
-        # Prepare the tool configuration with the tool's specification
-        self.tool_config = {"tools": [audit_info_tool.get_tool_spec(), joy_count_tool.get_tool_spec(), best_practices_tool.get_tool_spec()]}
+        # Print the conversation to the console, unless the session runs without one
+        if output_sink is not None:
+            self.output = output_sink
+        else:
+            self.output = output.QuietOutput() if quiet else output
+
+        # Latency metrics of the current user turn, see _start_turn_metrics
+        self.turn_metrics = None
+
+        # Records spans of the turns, model calls, and tool invocations for the exporters in TRACE_EXPORTERS
+        self.tracer = get_tracer()
 
-        # Create a Bedrock Runtime client in the specified AWS Region.
-        self.bedrock_runtime_client = boto3.client(
-            "bedrock-runtime", region_name=AWS_REGION
+        # Thread pool to run the tool calls of a model response concurrently
+        self.tool_executor = ThreadPoolExecutor(max_workers=MAX_TOOL_WORKERS, thread_name_prefix="tool")
+
+        # Thread pool for work that runs alongside the conversation, like analyzing the diagram
+        self.background_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="background")
+
+        # Stored analyses of the diagrams, shared by all sessions; None if the store is turned off
+        self.analysis_store = diagram_analysis.get_store(DIAGRAM_ANALYSIS_DIR) if DIAGRAM_ANALYSIS_DIR else None
+
+        # The hash of the conversation's diagram, whose findings are recorded after each turn
+        self.diagram_hash = None
+
+        # Saves the turns of the conversation, see start_session and resume_session; None until a session starts
+        self.session_store = SessionStore(SESSION_DIR) if SESSION_DIR else None
+        self.session = None
+
+        # Compacts the conversation history before it's sent to the model
+        self.history = HistoryManager(token_budget=HISTORY_TOKEN_BUDGET)
+
+        # Get the shared Bedrock Runtime client in the specified AWS Region.
+        # The model invoker retries the calls, so the client doesn't retry them as well.
+        self.bedrock_runtime_client = aws_clients.get_client("bedrock-runtime", AWS_REGION, max_attempts=1)
+
+        # Retries, paces, hedges, and falls back to other models when calling Amazon Bedrock
+        self.model_invoker = ResilientInvoker(
+            [MODEL_ID] + MODEL_FALLBACKS, max_attempts=BEDROCK_MAX_ATTEMPTS, hedge_after_seconds=HEDGE_AFTER_SECONDS
         )
 
-    def run(self):
+        # Picks the model of each turn; None if all turns use MODEL_ID
+        self.model_router = load_router(
+            MODEL_ROUTING_POLICY, {model.name: model.value for model in SupportedModels}, VISION_MODELS, MODEL_ID
+        )
+
+        # The routing decision of the current user turn, see _route_turn
+        self.turn_route = None
+
+        # Mark the end of the cacheable prefixes with cache points, if the models and SDK support them
+        self.prompt_caching = PROMPT_CACHING and self._prompt_caching_available()
+
+        # Prepare the system prompt. The tool configuration precedes the system prompt in the
+        # model's input, so the cache point after the system prompt covers the tools as well.
+        self.system_prompt = [{"text": SYSTEM_PROMPT}] + self._cache_points()
+
+        # Register the tools; each tool's dependencies are only imported when it's first invoked
+        self.tool_registry = create_default_registry()
+
+        # Prepare the tool configuration with the tool's specification
+        self.tool_config = self.tool_registry.get_tool_config()
+
+        # Reuses the tool results of this session; None if every call invokes the tool
+        self.tool_results = ToolResultCache(self.tool_registry) if TOOL_RESULT_CACHE else None
+
+    def run(self, session_id=None):
         """
         Starts the conversation with the user and handles the interaction with Bedrock.
+
+        :param session_id: The ID of a saved session to resume, or None to start a new session.
         """
         # Print the greeting and a short user guide
         output.header()
 
-        # Start with an emtpy conversation
-        conversation = []
+        # Print the progress of each turn, like the calls to the model and the turn's latency and tokens
+        if self.output is output and self.tracer.get_exporter(ConsoleExporter) is None:
+            self.tracer.exporters.append(ConsoleExporter(all_spans=False))
+
+        # Analyze the sample diagrams while the user picks one
+        if PREWARM_DIAGRAM_ANALYSES:
+            self.prewarm_diagram_analyses()
+
+        if session_id:
+            try:
+                conversation = self.resume_session(session_id)
+            except ValueError as e:
+                print(e)
+                output.footer()
+                return
+            output.session_started(self.session.id, resumed_turns=self.session.turn_count)
+
+            # A session that was saved before its first turn still has to send its diagram
+            architecture_diagram_file = None if conversation else self.session.metadata["diagram"]
+            previous_diagram_file = None if conversation else self.session.metadata["previous_diagram"]
+            self._chat(conversation, architecture_diagram_file, previous_diagram_file)
+            return
 
         # Architecture diagram to use
         architecture_diagram_file = self._get_user_input("What is the name of the file you want to chat with? File must be located in the demo/ directory.")
@@ -105,67 +323,311 @@ class ArchitectureChatDemo:
           output.footer()
           return
 
+        # All diagrams must reside in demo directory
+        architecture_diagram_file = f"demo/{architecture_diagram_file}"
+
+        # A revision of a diagram that was reviewed before is reviewed by its changes
+        previous_diagram_file = self._get_user_input(
+            "If this is a revision of a diagram you reviewed before, what is the name of the earlier revision? "
+            "Press Enter to skip.",
+            optional=True,
+        )
+        if previous_diagram_file is None:
+          output.footer()
+          return
+        previous_diagram_file = f"demo/{previous_diagram_file}" if previous_diagram_file else None
+
+        # Start with an emtpy conversation, saved as a new session
+        conversation = []
+        if self.session_store is not None:
+            self.start_session(architecture_diagram_file, previous_diagram_file)
+            output.session_started(self.session.id)
+
+        self._chat(conversation, architecture_diagram_file, previous_diagram_file)
+
+    def _chat(self, conversation, architecture_diagram_file, previous_diagram_file):
+        """
+        Asks the user for queries and answers them, until the user exits.
+
+        :param conversation: The conversation history.
+        :param architecture_diagram_file: The path to the architecture diagram to send with the first query, or
+            None if it has already been sent.
+        :param previous_diagram_file: The path to the previous revision of the diagram, or None.
+        """
         # Get the first user input
         user_input = self._get_user_input()
 
         while user_input is not None:
 
-            # Send the architecture_diagram_file if there is one
-            if architecture_diagram_file:
-              # All diagrams must reside in demo directory
-              architecture_diagram_file = f"demo/{architecture_diagram_file}"
-
-              _, file_extension = os.path.splitext(architecture_diagram_file)
-              file_extension = file_extension.lstrip('.').lower()
-
-              if file_extension in image_formats:
-
-                  with open(architecture_diagram_file, "rb") as image_file:
-                      image_bytes = image_file.read()
-
-                      # Claude works best when images come before text.
-                      # https://docs.anthropic.com/en/docs/build-with-claude/vision#prompt-examples
-                      message = {
-                          "role": "user",
-                          "content": [
-                              {
-                                  "image": {
-                                      "format": image_formats[file_extension],
-                                      "source": {
-                                          "bytes": image_bytes
-                                      }
-                                  }
-                              },
-                              { "text": "Referencing " + architecture_diagram_file + ", " + user_input }
-                          ],
-                      }
-                      architecture_diagram_file = None
-
-              else:
-                  architecture_diagram_file = None
-                  print(f"Unsupported image format: '{file_extension}' not in {list(image_formats.keys())}")
-                  break
-
+            # Send the query, and the architecture diagram if it hasn't been sent yet, to Amazon Bedrock
+            # and handle the model's responses until the model has returned its final response
+            conversation_length = len(conversation)
+            try:
+                self.ask(conversation, user_input, architecture_diagram_file, previous_diagram_file)
+            except Exception as e:
+                # Remove the failed turn, so the user can ask again; the diagram is sent with the next query
+                del conversation[conversation_length:]
+                print(f"Error: {e}")
             else:
-              # Create a new message with the user input and append it to the conversation
+                architecture_diagram_file = None
+                previous_diagram_file = None
 
-              message = {"role": "user", "content": [{"text": user_input}]}
+            # Repeat the loop until the user decides to exit the application
+            user_input = self._get_user_input()
 
-            conversation.append(message)
+        output.footer()
 
-            # Send the conversation to Amazon Bedrock
-            bedrock_response = self._send_conversation_to_bedrock(conversation)
+    def ask(self, conversation, user_input, architecture_diagram_file=None, previous_diagram_file=None):
+        """
+        Sends a query to Amazon Bedrock and handles the model's responses, including its tool use requests,
+        until the model has returned its final response or the turn is out of budget. This is the
+        non-interactive entry point, used by the chat loop and by the batch runner.
+
+        :param conversation: The conversation history, updated in place.
+        :param user_input: The user's query.
+        :param architecture_diagram_file: The path to the architecture diagram to send with the query, or None
+            if the diagram has already been sent in an earlier turn.
+        :param previous_diagram_file: The path to the previous revision of the diagram, to send only the changes
+            since that revision; or None.
+        :return: The model's final message.
+        """
+        turn_start = len(conversation)
+        with self.tracer.span("user_turn") as span:
+            conversation.append(
+                self._create_user_message(user_input, architecture_diagram_file, previous_diagram_file)
+            )
+
+            # Start measuring the time to first token and the total latency of this turn
+            self._start_turn_metrics()
+
+            # Pick the model that answers this turn
+            self._route_turn(conversation)
+
+            message = self._run_agent_loop(conversation)
+
+            self._finish_turn_metrics()
+            span.set(**self.get_turn_metrics())
+
+        self._record_finding(user_input, message)
+        if self.session is not None:
+            self.session.append_turn(conversation[turn_start:])
+        return message
+
+    def start_session(self, architecture_diagram_file, previous_diagram_file=None):
+        """
+        Starts saving the conversation as a new session. Each turn is appended to the session when it completes.
 
-            # Recursively handle the model's response until the model has returned
-            # its final response or the recursion counter has reached 0
-            self._process_model_response(
-                bedrock_response, conversation, max_recursion=MAX_RECURSIONS
+        :param architecture_diagram_file: The path to the architecture diagram of the conversation.
+        :param previous_diagram_file: The path to the previous revision of the diagram, or None.
+        :return: The ID of the session.
+        """
+        self.session = self.session_store.create(
+            {"diagram": architecture_diagram_file, "previous_diagram": previous_diagram_file}
+        )
+        return self.session.id
+
+    def resume_session(self, session_id):
+        """
+        Loads a saved session to continue its conversation. Only the first turn, with the diagram, and the last
+        RESUME_TURNS turns are read; the turns in between are represented by their question and answer snippets.
+
+        :param session_id: The ID of the session.
+        :return: The conversation history.
+        :raises ValueError: If sessions aren't saved, or the session doesn't exist.
+        """
+        if self.session_store is None:
+            raise ValueError("Sessions can't be resumed, SESSION_DIR is empty.")
+
+        self.session = self.session_store.open(session_id)
+        conversation = self.session.load_conversation(RESUME_TURNS)
+        if not conversation:
+            return conversation
+
+        # Record the findings for the diagram, and replace its image with the stored analysis in later turns
+        diagram_file = self.session.metadata["diagram"]
+        if os.path.isfile(diagram_file):
+            self.diagram_hash = diagram_analysis.diagram_hash(diagram_file)
+            analysis = self._get_stored_analysis(self.diagram_hash)
+            if analysis is not None:
+                image_blocks = [block for block in conversation[0]["content"] if "image" in block]
+                for index, block in enumerate(image_blocks):
+                    self.history.set_image_description(
+                        block["image"]["source"]["bytes"],
+                        diagram_analysis.to_text(analysis) if index == 0 else "A detail of the diagram described above.",
+                    )
+        return conversation
+
+    def _create_user_message(self, user_input, architecture_diagram_file=None, previous_diagram_file=None):
+        """
+        Creates the message with the user's query and, if given, the architecture diagram.
+
+        :param user_input: The user's query.
+        :param architecture_diagram_file: The path to the architecture diagram, or None.
+        :param previous_diagram_file: The path to the previous revision of the diagram, or None.
+        :return: The user message.
+        """
+        if not architecture_diagram_file:
+            # Create a new message with the user input
+            return {"role": "user", "content": [{"text": user_input}]}
+
+        # Fetch the tool results that are likely needed while the model reads the diagram
+        self._prefetch_tool_results(architecture_diagram_file)
+
+        if previous_diagram_file:
+            # Send the changes since the previous revision instead of the whole diagram
+            message = self._create_revision_message(user_input, architecture_diagram_file, previous_diagram_file)
+            if message is not None:
+                return message
+
+        _, file_extension = os.path.splitext(architecture_diagram_file)
+        file_extension = file_extension.lstrip('.').lower()
+
+        if file_extension in image_formats:
+
+            # A diagram that has been analyzed before is sent as its stored analysis instead of the image,
+            # so the model doesn't need to look at it again
+            digest = self.diagram_hash = diagram_analysis.diagram_hash(architecture_diagram_file)
+            analysis = self._get_stored_analysis(digest)
+            if analysis is not None:
+                return {
+                    "role": "user",
+                    "content": [
+                        { "text": diagram_analysis.to_text(analysis, architecture_diagram_file) }
+                    ] + self._cache_points() + [
+                        { "text": "Referencing " + architecture_diagram_file + ", " + user_input }
+                    ],
+                }
+
+            image_blocks = self._load_image_blocks(architecture_diagram_file)
+
+            # Analyze the diagram to replace it in later turns and sessions
+            self._analyze_diagram_in_background(architecture_diagram_file, digest, image_blocks)
+
+            # Claude works best when images come before text.
+            # https://docs.anthropic.com/en/docs/build-with-claude/vision#prompt-examples
+            # The cache point after the diagram lets later requests reuse it from the cache.
+            return {
+                "role": "user",
+                "content": image_blocks + self._cache_points() + [
+                    { "text": "Referencing " + architecture_diagram_file + ", " + user_input }
+                ],
+            }
+
+        if file_extension in diagram_formats:
+
+            # Parse the diagram into a graph of its components and connections, and send it as text.
+            # Text is cheaper and faster to process than an image, and it's exact.
+            diagram_graph = diagram_formats[file_extension](architecture_diagram_file)
+            self.diagram_hash = diagram_analysis.diagram_hash(architecture_diagram_file)
+            return {
+                "role": "user",
+                "content": [
+                    { "text": drawio_parser.to_text(diagram_graph, architecture_diagram_file) }
+                ] + self._cache_points() + [
+                    { "text": "Referencing " + architecture_diagram_file + ", " + user_input }
+                ],
+            }
+
+        supported_formats = list(image_formats.keys()) + list(diagram_formats.keys())
+        raise ValueError(f"Unsupported image format: '{file_extension}' not in {supported_formats}")
+
+    def _create_revision_message(self, user_input, architecture_diagram_file, previous_diagram_file):
+        """
+        Creates the message that reviews a revision of a diagram: the components and connections that changed
+        since the previous revision, and the findings of the previous revision's reviews. draw.io diagrams are
+        compared as parsed; images are compared by their stored analyses, and the new revision is analyzed
+        first if it hasn't been.
+
+        :param user_input: The user's query.
+        :param architecture_diagram_file: The path to the new revision of the diagram.
+        :param previous_diagram_file: The path to the previous revision of the diagram.
+        :return: The user message, or None if the previous revision is an image that hasn't been analyzed.
+        """
+        if self._is_image(architecture_diagram_file) != self._is_image(previous_diagram_file):
+            raise ValueError(
+                f"Can't compare {previous_diagram_file} with {architecture_diagram_file}, "
+                "both revisions must be images or both must be draw.io diagrams."
             )
 
-            # Repeat the loop until the user decides to exit the application
-            user_input = self._get_user_input()
+        previous_digest = diagram_analysis.diagram_hash(previous_diagram_file)
+        previous_structure = self._diagram_structure(previous_diagram_file, previous_digest, analyze=False)
+        if previous_structure is None:
+            logging.warning(
+                "Warning: %s hasn't been analyzed, the whole diagram %s is sent.",
+                previous_diagram_file, architecture_diagram_file,
+            )
+            return None
 
-        output.footer()
+        self.diagram_hash = diagram_analysis.diagram_hash(architecture_diagram_file)
+        structure = self._diagram_structure(architecture_diagram_file, self.diagram_hash)
+        delta = diagram_diff.diff(previous_structure, structure)
+        logging.info(
+            "Sending %d changes since %s instead of the diagram %s.",
+            diagram_diff.count_changes(delta), previous_diagram_file, architecture_diagram_file,
+        )
+
+        content = [{"text": diagram_diff.to_text(delta, previous_diagram_file, architecture_diagram_file)}]
+        findings = self.analysis_store.get_findings(previous_digest, REVISION_FINDINGS) if self.analysis_store else []
+        if findings:
+            lines = [f"Findings of the earlier reviews of {previous_diagram_file}:"]
+            for finding in findings:
+                answer = finding["answer"]
+                if len(answer) > FINDING_MAX_CHARACTERS:
+                    answer = answer[:FINDING_MAX_CHARACTERS] + " [...]"
+                lines += [f"Q: {finding['query']}", f"A: {answer}"]
+            content.append({"text": "\n".join(lines)})
+
+        return {
+            "role": "user",
+            "content": content + self._cache_points() + [
+                { "text": "Referencing " + architecture_diagram_file + ", " + user_input }
+            ],
+        }
+
+    def _diagram_structure(self, diagram_file, digest, analyze=True):
+        """
+        Returns the components, connections, and notes of a diagram, to compare it with another revision.
+
+        :param diagram_file: The path to the diagram.
+        :param digest: The hash of the diagram file.
+        :param analyze: Whether to analyze an image that hasn't been analyzed yet.
+        :return: The structure of the diagram, see util.diagram_diff; or None if the diagram is an image without
+            a stored analysis, and analyze is False.
+        """
+        _, file_extension = os.path.splitext(diagram_file)
+        file_extension = file_extension.lstrip('.').lower()
+        if file_extension in diagram_formats:
+            return diagram_diff.from_drawio(diagram_formats[file_extension](diagram_file))
+        if file_extension not in image_formats:
+            supported_formats = list(image_formats.keys()) + list(diagram_formats.keys())
+            raise ValueError(f"Unsupported image format: '{file_extension}' not in {supported_formats}")
+
+        analysis = self._get_stored_analysis(digest)
+        if analysis is None and analyze:
+            analysis = self._analyze_diagram(diagram_file, digest)
+        return diagram_diff.from_analysis(analysis) if analysis is not None else None
+
+    @staticmethod
+    def _is_image(diagram_file):
+        """
+        :param diagram_file: The path to the diagram.
+        :return: True if the diagram is an image, False if it's in another format, like draw.io.
+        """
+        return os.path.splitext(diagram_file)[1].lstrip('.').lower() in image_formats
+
+    def _record_finding(self, user_input, message):
+        """
+        Records the model's answer as a finding of the review of the conversation's diagram, so a review of the
+        diagram's next revision can build on it.
+
+        :param user_input: The user's query.
+        :param message: The model's final message.
+        """
+        if self.analysis_store is None or self.diagram_hash is None:
+            return
+        answer = "\n".join(block["text"] for block in message["content"] if "text" in block).strip()
+        if answer:
+            self.analysis_store.add_finding(self.diagram_hash, user_input, answer)
 
     def _send_conversation_to_bedrock(self, conversation):
         """
@@ -174,82 +636,559 @@ class ArchitectureChatDemo:
         :param conversation: The conversation history including the next message to send.
         :return: The response from Amazon Bedrock.
         """
-        output.call_to_bedrock(conversation)
+        # Only send the compacted history; the full conversation stays unchanged
+        messages = self.history.prepare(conversation)
+
+        request_bytes = payload_bytes({"messages": messages, "system": self.system_prompt, "toolConfig": self.tool_config})
+        operation = "converse_stream" if self.streaming else "converse"
+        request_input = "tool_results" if "toolResult" in conversation[-1]["content"][0] else "query"
+        with self.tracer.span(
+            "bedrock_call", operation=operation, input=request_input, request_bytes=request_bytes
+        ) as span:
+            if self.streaming:
+                model_id, response = self.model_invoker.invoke(
+                    lambda model_id: self._send_conversation_to_bedrock_stream(messages, model_id),
+                    model_ids=self._turn_model_chain(),
+                )
+            else:
+                # Send the conversation, system prompt, and tool configuration, and return the response
+                def converse(model_id):
+                    return self.bedrock_runtime_client.converse(
+                        modelId=model_id,
+                        messages=self._for_model(messages, model_id),
+                        system=self._for_model(self.system_prompt, model_id),
+                        toolConfig=self.tool_config,
+                    )
+
+                model_id, response = self.model_invoker.invoke(converse, hedge=True, model_ids=self._turn_model_chain())
+
+                # Without streaming, the first token arrives together with the complete response
+                self._record_first_token(time.perf_counter())
+
+            span.set(
+                model_id=model_id,
+                stop_reason=response["stopReason"],
+                time_to_first_token_ms=response["metrics"].get("timeToFirstTokenMs"),
+                **token_attributes(response.get("usage", {})),
+            )
+        return response
+
+    def _send_conversation_to_bedrock_stream(self, conversation, model_id=MODEL_ID):
+        """
+        Sends the conversation to Amazon Bedrock using the ConverseStream API. Text deltas are printed
+        as they arrive, and tool use blocks are reassembled from their JSON input chunks.
+
+        :param conversation: The compacted conversation history including the next message to send.
+        :param model_id: The ID of the model to send the conversation to.
+        :return: The response, in the same shape as a response from the Converse API.
+        """
+        request_started_at = time.perf_counter()
+        first_token_at = None
 
-        # Send the conversation, system prompt, and tool configuration, and return the response
-        return self.bedrock_runtime_client.converse(
-            modelId=MODEL_ID,
-            messages=conversation,
-            system=self.system_prompt,
+        response = self.bedrock_runtime_client.converse_stream(
+            modelId=model_id,
+            messages=self._for_model(conversation, model_id),
+            system=self._for_model(self.system_prompt, model_id),
             toolConfig=self.tool_config,
         )
 
-    def _process_model_response(
-        self, model_response, conversation, max_recursion=MAX_RECURSIONS
-    ):
+        # Content blocks by their index in the message. Tool use input arrives as
+        # string fragments that are only valid JSON once the block is complete.
+        content_blocks = {}
+        tool_use_inputs = {}
+        role = "assistant"
+        stop_reason = None
+        usage = {}
+        metrics = {}
+        printing_text = False
+
+        try:
+            for event in response["stream"]:
+                if "messageStart" in event:
+                    role = event["messageStart"]["role"]
+
+                elif "contentBlockStart" in event:
+                    index = event["contentBlockStart"]["contentBlockIndex"]
+                    start = event["contentBlockStart"]["start"]
+                    if "toolUse" in start:
+                        content_blocks[index] = {"toolUse": dict(start["toolUse"])}
+                        tool_use_inputs[index] = []
+
+                elif "contentBlockDelta" in event:
+                    index = event["contentBlockDelta"]["contentBlockIndex"]
+                    delta = event["contentBlockDelta"]["delta"]
+
+                    if first_token_at is None:
+                        first_token_at = time.perf_counter()
+                        self._record_first_token(first_token_at)
+
+                    if "text" in delta:
+                        if not printing_text:
+                            self.output.model_response_start()
+                            printing_text = True
+                        self.output.model_response_delta(delta["text"])
+                        content_blocks.setdefault(index, {"text": ""})["text"] += delta["text"]
+                    elif "toolUse" in delta:
+                        tool_use_inputs[index].append(delta["toolUse"]["input"])
+
+                elif "contentBlockStop" in event:
+                    index = event["contentBlockStop"]["contentBlockIndex"]
+                    if index in tool_use_inputs:
+                        tool_input = "".join(tool_use_inputs.pop(index))
+                        content_blocks[index]["toolUse"]["input"] = json.loads(tool_input) if tool_input else {}
+                    elif printing_text:
+                        self.output.model_response_end()
+                        printing_text = False
+
+                elif "messageStop" in event:
+                    stop_reason = event["messageStop"]["stopReason"]
+
+                elif "metadata" in event:
+                    usage = event["metadata"].get("usage", {})
+                    metrics = event["metadata"].get("metrics", {})
+        except Exception as e:
+            # A retry would show the parts of the response that were already shown again
+            e.partial_response = first_token_at is not None
+            if printing_text:
+                self.output.model_response_end()
+            raise
+
+        if printing_text:
+            self.output.model_response_end()
+
+        request_finished_at = time.perf_counter()
+        metrics["timeToFirstTokenMs"] = (
+            None if first_token_at is None else round((first_token_at - request_started_at) * 1000)
+        )
+        metrics["totalLatencyMs"] = round((request_finished_at - request_started_at) * 1000)
+        logging.debug("ConverseStream metrics: %s", metrics)
+
+        return {
+            "output": {
+                "message": {
+                    "role": role,
+                    "content": [content_blocks[index] for index in sorted(content_blocks)],
+                }
+            },
+            "stopReason": stop_reason,
+            "usage": usage,
+            "metrics": metrics,
+        }
+
+    def close(self):
+        """
+        Shuts down the session's thread pools. Pending background work, like analyzing the diagram, is cancelled.
         """
-        Processes the response received via Amazon Bedrock and performs the necessary actions
-        based on the stop reason.
+        self.tool_executor.shutdown(wait=True)
+        self.background_executor.shutdown(wait=False, cancel_futures=True)
 
-        :param model_response: The model's response returned via Amazon Bedrock.
-        :param conversation: The conversation history.
-        :param max_recursion: The maximum number of recursive calls allowed.
+    def _prompt_caching_available(self):
         """
+        Checks whether any model that turns are routed to supports prompt caching and the installed SDK accepts
+        cache points. Cache points were added to the Converse API in boto3 1.37.25; older versions reject them.
 
-        if max_recursion <= 0:
-            # Stop the process, the number of recursive calls could indicate an infinite loop
+        :return: True if requests can contain cache points.
+        """
+        model_ids = self.model_router.model_ids() if self.model_router is not None else {MODEL_ID}
+        if not model_ids & PROMPT_CACHING_MODELS:
+            logging.debug("Prompt caching is disabled, none of the models %s support it.", sorted(model_ids))
+            return False
+
+        service_model = self.bedrock_runtime_client.meta.service_model
+        if "cachePoint" not in service_model.shape_for("SystemContentBlock").members:
             logging.warning(
-                "Warning: Maximum number of recursions reached. Please try again."
+                "Warning: Prompt caching is disabled, the installed boto3 version doesn't support cache points."
             )
-            exit(1)
+            return False
+
+        return True
+
+    def _route_turn(self, conversation):
+        """
+        Picks the model of the current user turn with the model router, based on the compacted history that
+        will be sent to the model. All model calls of the turn, including its tool rounds, use this model.
+
+        :param conversation: The conversation history including the user's message.
+        """
+        messages = self.history.prepare(conversation)
+        history_tokens = self.history.estimate_tokens(messages)
+        if self.model_router is None:
+            self.turn_route = {"model_id": MODEL_ID, "rule": None, "features": extract_features(messages, history_tokens)}
+        else:
+            self.turn_route = self.model_router.route(messages, history_tokens)
+
+        self.turn_metrics["model_id"] = self.turn_route["model_id"]
+        self.turn_metrics["routing_rule"] = self.turn_route["rule"]
+
+    def _turn_model_chain(self):
+        """
+        Returns the fallback chain of the current user turn: the model the turn was routed to, followed by the
+        MODEL_FALLBACKS. If the request contains an image, models that don't accept images are left out.
+
+        :return: The model IDs.
+        """
+        if self.turn_route is None:
+            return [MODEL_ID] + MODEL_FALLBACKS
+        model_ids = [self.turn_route["model_id"]] + MODEL_FALLBACKS
+        if self.turn_route["features"]["has_image"]:
+            model_ids = [model_id for model_id in model_ids if model_id in VISION_MODELS]
+        return model_ids
+
+    def _for_model(self, content, model_id):
+        """
+        Adapts messages or system content blocks to a model. Cache points are removed for models that don't
+        support prompt caching, e.g. when falling back to another model, and whenever prompt caching is off,
+        e.g. for a session that was saved with prompt caching and is resumed with an SDK that rejects them.
+
+        :param content: The messages or system content blocks.
+        :param model_id: The ID of the model they're sent to.
+        :return: The adapted messages or content blocks.
+        """
+        if self.prompt_caching and model_id in PROMPT_CACHING_MODELS:
+            return content
+        if content and "role" in content[0]:
+            return [
+                {**message, "content": [block for block in message["content"] if "cachePoint" not in block]}
+                for message in content
+            ]
+        return [block for block in content if "cachePoint" not in block]
+
+    def _cache_points(self):
+        """
+        Returns the content blocks that mark the end of a cacheable prefix, to be added after the system prompt
+        and the diagram.
+
+        :return: A list with a cache point if prompt caching is enabled, otherwise an empty list.
+        """
+        return [CACHE_POINT] if self.prompt_caching else []
+
+    def _load_image_blocks(self, diagram_file):
+        """
+        Downscales and re-encodes a diagram image, or loads the result from the cache.
+
+        :param diagram_file: The path to the diagram image.
+        :return: The image content blocks of the diagram; the overview first, followed by any tiles.
+        """
+        images = load_image(diagram_file, tile=IMAGE_TILING, cache_dir=IMAGE_CACHE_DIR)
+        return [
+            {
+                "image": {
+                    "format": image["format"],
+                    "source": {
+                        "bytes": image["bytes"]
+                    }
+                }
+            }
+            for image in images
+        ]
+
+    def _analysis_model_chain(self):
+        """
+        :return: The IDs of the models that analyze diagrams, in the order they're tried: MODEL_ID followed by
+            the MODEL_FALLBACKS, without models that don't accept images.
+        """
+        return [model_id for model_id in [MODEL_ID] + MODEL_FALLBACKS if model_id in VISION_MODELS]
+
+    def _get_stored_analysis(self, digest):
+        """
+        :param digest: The hash of the diagram file.
+        :return: The stored analysis of the diagram by the first model of the analysis chain that analyzed it,
+            or None.
+        """
+        if self.analysis_store is None:
+            return None
+        for model_id in self._analysis_model_chain():
+            analysis = self.analysis_store.get(digest, model_id)
+            if analysis is not None:
+                return analysis
+        return None
+
+    def _analyze_diagram(self, diagram_file, digest=None, image_blocks=None):
+        """
+        Asks the model for a structured analysis of a diagram image, and stores it. The model is forced to
+        record the analysis with a tool, so its input is valid JSON. A diagram whose analysis is already
+        stored isn't analyzed again.
+
+        :param diagram_file: The path to the diagram image.
+        :param digest: The hash of the diagram file, or None to compute it.
+        :param image_blocks: The image content blocks of the diagram, or None to load them.
+        :return: The analysis.
+        """
+        digest = digest or diagram_analysis.diagram_hash(diagram_file)
+        analysis = self._get_stored_analysis(digest)
+        if analysis is not None:
+            return analysis
+
+        image_blocks = image_blocks or self._load_image_blocks(diagram_file)
+        messages = [{"role": "user", "content": image_blocks + [{"text": diagram_analysis.ANALYSIS_PROMPT}]}]
+        with self.tracer.span(
+            "bedrock_call", operation="converse", purpose="diagram_analysis", request_bytes=payload_bytes(messages)
+        ) as span:
+            model_id, response = self.model_invoker.invoke(
+                lambda model_id: self.bedrock_runtime_client.converse(
+                    modelId=model_id, messages=messages, toolConfig=diagram_analysis.ANALYSIS_TOOL_CONFIG
+                ),
+                hedge=True,
+                model_ids=self._analysis_model_chain(),
+            )
+            span.set(model_id=model_id, stop_reason=response["stopReason"], **token_attributes(response["usage"]))
+
+        analysis = diagram_analysis.parse_analysis_response(response)
+        if self.analysis_store is not None:
+            self.analysis_store.put(digest, model_id, analysis, diagram_file)
+        return analysis
+
+    def _analyze_diagram_in_background(self, diagram_file, digest, image_blocks):
+        """
+        Analyzes the diagram without blocking the conversation. Once the analysis is available, the history
+        manager uses it in place of the image in later turns, and later sessions start with it.
+
+        :param diagram_file: The path to the diagram image.
+        :param digest: The hash of the diagram file.
+        :param image_blocks: The image content blocks of the diagram; the overview first, followed by any tiles.
+        """
+        def analyze():
+            analysis = self._analyze_diagram(diagram_file, digest, image_blocks)
+            self.history.set_image_description(
+                image_blocks[0]["image"]["source"]["bytes"], diagram_analysis.to_text(analysis)
+            )
+            for tile_block in image_blocks[1:]:
+                self.history.set_image_description(
+                    tile_block["image"]["source"]["bytes"], "A detail of the diagram described above."
+                )
+
+        def log_failure(future):
+            if future.exception() is not None:
+                logging.warning("Couldn't analyze the diagram, it will be sent as an image: %s", future.exception())
+
+        self.background_executor.submit(analyze).add_done_callback(log_failure)
+
+    def prewarm_diagram_analyses(self, directory="demo", wait=False):
+        """
+        Analyzes all diagram images in a directory in the background, so the first session on each of them
+        already starts with the stored analysis. Diagrams that have been analyzed before are skipped.
+
+        :param directory: The directory of the diagrams.
+        :param wait: Whether to wait until all diagrams are analyzed.
+        :return: The futures of the analyses, by the path to the diagram.
+        """
+        if self.analysis_store is None:
+            logging.warning("Warning: Diagrams aren't analyzed in advance, DIAGRAM_ANALYSIS_DIR is empty.")
+            return {}
+
+        diagram_files = sorted(os.path.join(directory, name) for name in os.listdir(directory) if self._is_image(name))
+
+        def log_failure(diagram_file):
+            def log(future):
+                if not future.cancelled() and future.exception() is not None:
+                    logging.warning("Warning: Couldn't analyze %s in advance: %s", diagram_file, future.exception())
+            return log
+
+        futures = {}
+        for diagram_file in diagram_files:
+            futures[diagram_file] = self.background_executor.submit(self._analyze_diagram, diagram_file)
+            futures[diagram_file].add_done_callback(log_failure(diagram_file))
+
+        if wait:
+            wait_for_futures(futures.values())
+        return futures
+
+    def _start_turn_metrics(self):
+        """
+        Starts measuring the latency of a user turn, from sending the user's query until the final response.
+        """
+        self.turn_metrics = {
+            "started_at": time.perf_counter(),
+            "first_token_at": None,
+            "input_tokens": 0,
+            "output_tokens": 0,
+            "cache_read_input_tokens": 0,
+            "cache_write_input_tokens": 0,
+            "model_id": None,
+            "routing_rule": None,
+            "tool_rounds": 0,
+            "stop_reason": None,
+            "exhausted_budget": None,
+        }
+
+    def _record_first_token(self, timestamp):
+        """
+        Records the arrival of the first token of the current user turn.
+
+        :param timestamp: The performance counter value when the token arrived.
+        """
+        if self.turn_metrics is not None and self.turn_metrics["first_token_at"] is None:
+            self.turn_metrics["first_token_at"] = timestamp
+
+    def _record_usage(self, usage):
+        """
+        Adds the token usage of a model call to the metrics of the current user turn, including the input tokens
+        read from and written to the prompt cache.
+
+        :param usage: The usage field of a Converse or ConverseStream response.
+        """
+        if self.turn_metrics is None:
+            return
+        self.turn_metrics["input_tokens"] += usage.get("inputTokens", 0)
+        self.turn_metrics["output_tokens"] += usage.get("outputTokens", 0)
+        self.turn_metrics["cache_read_input_tokens"] += usage.get("cacheReadInputTokens", 0)
+        self.turn_metrics["cache_write_input_tokens"] += usage.get("cacheWriteInputTokens", 0)
+
+    def _finish_turn_metrics(self):
+        """
+        Finishes measuring the latency of the current user turn. The console trace exporter reports it when the
+        turn's span ends.
+        """
+        finished_at = time.perf_counter()
+        started_at = self.turn_metrics["started_at"]
+        first_token_at = self.turn_metrics["first_token_at"]
+
+        self.turn_metrics["time_to_first_token_ms"] = (
+            None if first_token_at is None else round((first_token_at - started_at) * 1000)
+        )
+        self.turn_metrics["total_latency_ms"] = round((finished_at - started_at) * 1000)
+
+    def get_turn_metrics(self):
+        """
+        Returns the latency and token metrics of the last user turn.
+
+        :return: A dict with the TURN_METRICS, or None if no turn has finished yet.
+        """
+        if self.turn_metrics is None or "total_latency_ms" not in self.turn_metrics:
+            return None
+        return {name: self.turn_metrics[name] for name in TURN_METRICS}
+
+    def _new_turn_budget(self):
+        """
+        Creates the budget for a new user turn.
+
+        :return: The turn budget.
+        """
+        return TurnBudget(
+            max_tool_rounds=MAX_TOOL_ROUNDS,
+            max_seconds=MAX_TURN_SECONDS,
+            max_input_tokens=MAX_TURN_INPUT_TOKENS,
+            max_output_tokens=MAX_TURN_OUTPUT_TOKENS,
+        )
+
+    def _run_agent_loop(self, conversation):
+        """
+        Sends the conversation to Amazon Bedrock, and keeps invoking the requested tools and returning their
+        results to the model until the model has returned its final response. If the turn's budget is exhausted
+        while the model still requests tools, the turn ends early instead.
+
+        :param conversation: The conversation history including the user's message.
+        :return: The model's final message.
+        """
+        budget = self._new_turn_budget()
+
+        response = self._send_conversation_to_bedrock(conversation)
+
+        while True:
+            budget.record_usage(response.get("usage", {}))
+            self._record_usage(response.get("usage", {}))
+            message = self._process_model_response(response, conversation)
+            self.turn_metrics["stop_reason"] = response["stopReason"]
+
+            if response["stopReason"] != "tool_use":
+                return message
+
+            exhausted_budget = budget.exhausted()
+            if exhausted_budget is not None:
+                self.turn_metrics["exhausted_budget"] = exhausted_budget
+                self._end_turn_early(message, exhausted_budget)
+                return message
+
+            self._handle_tool_use(message, conversation, timeout=budget.remaining_seconds())
+            budget.record_tool_round()
+            self.turn_metrics["tool_rounds"] = budget.tool_rounds
+
+            response = self._send_conversation_to_bedrock(conversation)
+
+    def _process_model_response(self, model_response, conversation):
+        """
+        Processes the response received via Amazon Bedrock by appending the model's message to the conversation,
+        and printing it if it's the model's final response.
+
+        :param model_response: The model's response returned via Amazon Bedrock.
+        :param conversation: The conversation history.
+        :return: The model's message.
+        """
 
         # Append the model's response to the ongoing conversation
         message = model_response["output"]["message"]
         conversation.append(message)
 
-        if model_response["stopReason"] == "tool_use":
-            # If the stop reason is "tool_use", forward everything to the tool use handler
-            self._handle_tool_use(message, conversation, max_recursion)
+        if model_response["stopReason"] != "tool_use" and not self.streaming:
+            # If the model has finished, e.g. with the stop reason "end_turn", print the model's response text.
+            # A streamed response has already been printed while it arrived.
+            for content_block in message["content"]:
+                if "text" in content_block:
+                    self.output.model_response(content_block["text"])
 
-        if model_response["stopReason"] == "end_turn":
-            # If the stop reason is "end_turn", print the model's response text, and finish the process
-            output.model_response(message["content"][0]["text"])
-            return
+        return message
+
+    def _end_turn_early(self, message, exhausted_budget):
+        """
+        Ends the turn without invoking the tools the model requested. Tool use requests without tool results
+        aren't valid in a conversation, so they're replaced with a note that keeps the conversation consistent
+        for the next user turn.
 
-    def _handle_tool_use(
-        self, model_response, conversation, max_recursion=MAX_RECURSIONS
-    ):
+        :param message: The model's last message, containing the unanswered tool use requests.
+        :param exhausted_budget: A description of the exhausted budget.
         """
-        Handles the tool use case by invoking the specified tool and sending the tool's response back to Bedrock.
-        The tool response is appended to the conversation, and the conversation is sent back to Amazon Bedrock for further processing.
+        logging.warning("Warning: The turn's %s was reached. Ending the turn early.", exhausted_budget)
+
+        if not self.streaming:
+            for content_block in message["content"]:
+                if "text" in content_block:
+                    self.output.model_response(content_block["text"])
+
+        note = (
+            f"I stopped before completing my answer because this turn reached its {exhausted_budget}. "
+            "Ask me to continue if you need the rest."
+        )
+        message["content"] = [
+            content_block for content_block in message["content"] if "toolUse" not in content_block
+        ] + [{"text": note}]
+
+        self.output.turn_ended_early(note)
+
+    def _handle_tool_use(self, model_response, conversation, timeout=None):
+        """
+        Handles the tool use case by invoking the requested tools. The tools' responses are appended to the
+        conversation, ready to be sent back to Amazon Bedrock for further processing.
 
         :param model_response: The model's response containing the tool use request.
         :param conversation: The conversation history.
-        :param max_recursion: The maximum number of recursive calls allowed.
+        :param timeout: The maximum time to wait for the tools in seconds; at most TOOL_TIMEOUT_SECONDS.
         """
 
-        # Initialize an empty list of tool results
-        tool_results = []
-
         # The model's response can consist of multiple content blocks
+        tool_use_requests = []
         for content_block in model_response["content"]:
-            if "text" in content_block:
+            if "text" in content_block and not self.streaming:
                 # If the content block contains text, print it to the console
-                output.model_response(content_block["text"])
+                self.output.model_response(content_block["text"])
 
             if "toolUse" in content_block:
-                # If the content block is a tool use request, forward it to the tool
-                tool_response = self._invoke_tool(content_block["toolUse"])
-
-                # Add the tool use ID and the tool's response to the list of results
-                tool_results.append(
-                    {
-                        "toolResult": {
-                            "toolUseId": (tool_response["toolUseId"]),
-                            "content": [{"json": tool_response["content"]}],
-                        }
+                tool_use_requests.append(content_block["toolUse"])
+
+        # Forward all tool use requests to their tools at once, and collect the
+        # results in the order the model requested them
+        tool_results = []
+        with self.tracer.span("tool_round", tools=len(tool_use_requests)):
+            tool_responses = self._invoke_tools(tool_use_requests, timeout)
+        for tool_response in tool_responses:
+            # Add the tool use ID and the tool's response to the list of results
+            tool_results.append(
+                {
+                    "toolResult": {
+                        "toolUseId": (tool_response["toolUseId"]),
+                        "content": [{"json": tool_response["content"]}],
                     }
-                )
+                }
+            )
 
         # Embed the tool results in a new user message
         message = {"role": "user", "content": tool_results}
@@ -257,12 +1196,60 @@ class ArchitectureChatDemo:
         # Append the new message to the ongoing conversation
         conversation.append(message)
 
-        # Send the conversation to Amazon Bedrock
-        response = self._send_conversation_to_bedrock(conversation)
+    def _invoke_tools(self, payloads, timeout=None):
+        """
+        Invokes the requested tools concurrently and waits for all of them, so a turn takes as long as
+        its slowest tool rather than the sum of all tools. A tool that fails or exceeds the timeout
+        returns an error message.
 
-        # Recursively handle the model's response until the model has returned
-        # its final response or the recursion counter has reached 0
-        self._process_model_response(response, conversation, max_recursion - 1)
+        :param payloads: The tool use requests, each containing the tool use ID, tool name and input data.
+        :param timeout: The maximum time to wait for the tools in seconds; at most TOOL_TIMEOUT_SECONDS.
+        :return: The tools' responses in the same order as the requests.
+        """
+        timeout = TOOL_TIMEOUT_SECONDS if timeout is None else min(timeout, TOOL_TIMEOUT_SECONDS)
+
+        # Each tool runs in a copy of the current context, so its span is part of the turn's trace
+        futures = [
+            self.tool_executor.submit(contextvars.copy_context().run, self._invoke_tool_safely, payload)
+            for payload in payloads
+        ]
+        deadline = time.monotonic() + timeout
+
+        tool_responses = []
+        for payload, future in zip(payloads, futures):
+            try:
+                tool_responses.append(future.result(timeout=max(0, deadline - time.monotonic())))
+            except ToolTimeoutError:
+                future.cancel()
+                logging.warning("Tool '%s' timed out after %.1f seconds.", payload["name"], timeout)
+                error_message = f"The tool '{payload['name']}' did not respond within {timeout:.1f} seconds."
+                tool_responses.append(
+                    {"toolUseId": payload["toolUseId"], "content": {"error": "true", "message": error_message}}
+                )
+
+        return tool_responses
+
+    def _invoke_tool_safely(self, payload):
+        """
+        Invokes the specified tool like _invoke_tool, but returns an error message instead of raising
+        if the tool fails.
+
+        :param payload: The payload containing the tool name and input data.
+        :return: The tool's response or an error message.
+        """
+        with self.tracer.span("tool_invocation", tool=payload["name"]) as span:
+            try:
+                tool_response = self._invoke_tool(payload)
+            except Exception as e:
+                logging.exception("Tool '%s' failed.", payload["name"])
+                error_message = f"The tool '{payload['name']}' failed: {e}"
+                tool_response = {"toolUseId": payload["toolUseId"], "content": {"error": "true", "message": error_message}}
+
+            content = tool_response["content"]
+            if isinstance(content, dict) and content.get("error") == "true":
+                span.status = "error"
+            span.set(response_bytes=payload_bytes(content))
+            return tool_response
 
     def _invoke_tool(self, payload):
         """
@@ -274,24 +1261,18 @@ class ArchitectureChatDemo:
         """
         tool_name = payload["name"]
 
-        if tool_name == "Audit_Info_Tool":
+        if tool_name in self.tool_registry:
             input_data = payload["input"]
-            output.tool_use(tool_name, input_data)
-
-            # Invoke the tool with the input data provided
-            response = audit_info_tool.fetch_audit_info_data(input_data)
-        elif tool_name == "Joy_Count_Tool":
-            input_data = payload["input"]
-            output.tool_use(tool_name, input_data)
-
-            # Invoke the tool
-            response = joy_count_tool.fetch_joy_count_data()
-        elif tool_name == "Best_Practices_Tool":
-            input_data = payload["input"]
-            output.tool_use(tool_name, input_data)
-
-            # Invoke the tool with the input data provided
-            response = best_practices_tool.fetch_best_practices_data(input_data)
+            self.output.tool_use(tool_name, input_data)
+
+            # Invoke the tool with the input data provided, or reuse a fresh result of the same call
+            if self.tool_results is not None:
+                response, cache_status = self.tool_results.invoke(tool_name, input_data)
+                span = current_span()
+                if span is not None:
+                    span.set(cache=cache_status)
+            else:
+                response = self.tool_registry.invoke(tool_name, input_data)
         else:
             error_message = (
                 f"The requested tool with name '{tool_name}' does not exist."
@@ -300,19 +1281,43 @@ class ArchitectureChatDemo:
 
         return {"toolUseId": payload["toolUseId"], "content": response}
 
+    def _prefetch_tool_results(self, architecture_diagram_file):
+        """
+        Speculatively fetches the results of the PREFETCH_TOOLS on the tool thread pool, so they're ready when
+        the model asks for them. The system name is inferred from the diagram's file name, like the model does.
+
+        :param architecture_diagram_file: The path to the architecture diagram.
+        """
+        if self.tool_results is None:
+            return
+
+        system_name = os.path.splitext(os.path.basename(architecture_diagram_file))[0]
+        likely_inputs = {"Audit_Info_Tool": {"name": system_name}, "Joy_Count_Tool": {}}
+        for tool_name in PREFETCH_TOOLS:
+            if tool_name not in self.tool_registry or tool_name not in likely_inputs:
+                logging.warning("Warning: Can't prefetch the results of the tool %s.", tool_name)
+                continue
+            if self.tool_results.prefetch(tool_name, likely_inputs[tool_name], self.tool_executor):
+                logging.debug("Prefetching the result of %s for %s.", tool_name, system_name)
+
     @staticmethod
-    def _get_user_input(prompt="Your query"):
+    def _get_user_input(prompt="Your query", optional=False):
         """
         Prompts the user for input and returns the user's response.
         Returns None if the user enters 'x' to exit.
 
         :param prompt: The prompt to display to the user.
-        :return: The user's input or None if the user chooses to exit.
+        :param optional: Whether the user may skip the prompt by pressing Enter.
+        :return: The user's input, an empty string if the user skipped an optional prompt, or None if the user
+            chooses to exit.
         """
         output.separator()
         user_input = input(f"{prompt} (x to exit): ")
 
-        if user_input == "":
+        if user_input == "" and optional:
+            return ""
+
+        elif user_input == "":
             prompt = "Please enter your query"
             return ArchitectureChatDemo._get_user_input(prompt)
 
@@ -324,5 +1329,19 @@ class ArchitectureChatDemo:
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chat with your architecture diagrams.")
+    parser.add_argument(
+        "--prewarm", action="store_true", help="Analyze the diagrams in the demo/ directory in advance, and exit."
+    )
+    parser.add_argument("--resume", metavar="SESSION_ID", help="Resume a saved session.")
+    arguments = parser.parse_args()
+
     architecture_chat_demo = ArchitectureChatDemo()
-    architecture_chat_demo.run()
\ No newline at end of file
+    if arguments.resume:
+        architecture_chat_demo.run(arguments.resume)
+    elif arguments.prewarm:
+        futures = architecture_chat_demo.prewarm_diagram_analyses(wait=True)
+        architecture_chat_demo.close()
+        logging.info("Analyzed %d diagrams.", sum(1 for future in futures.values() if future.exception() is None))
+    else:
+        architecture_chat_demo.run()
\ No newline at end of file
@@ -1,7 +1,23 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: MIT-0
 
+import difflib
 import json
+import os
+import re
+import threading
+
+# The audit info API, which in this demo is a JSON file of audit records by system ID
+AUDIT_INFO_FILE = "demo/audit-info.json"
+
+# The minimum similarity of a system name to a known name to count as a fuzzy match
+FUZZY_MATCH_CUTOFF = 0.8
+
+# The maximum number of records returned for an ambiguous name
+MAX_MATCHES = 5
+
+# The maximum number of known names compared with a name that has no exact match
+MAX_CANDIDATES = 100
 
 def get_tool_spec():
     """
@@ -31,6 +47,120 @@ def get_tool_spec():
     }
 
 
+def normalize_name(name):
+    """
+    Normalizes a system name, so that e.g. "Fluffy Puppy Joy Generator" and "fluffy-puppy-joy-generator"
+    are the same name.
+
+    :param name: The system name.
+    :return: The normalized name.
+    """
+    return " ".join(re.findall(r"[a-z0-9]+", name.lower()))
+
+
+def canonicalize_input(input_data):
+    """
+    Converts the tool's input to a canonical form, so names that are the same system, like the file name
+    "fluffy-puppy-joy-generator" and "Fluffy Puppy Joy Generator", have the same result.
+
+    :param input_data: The input data containing the system name.
+    :return: The input data with the normalized name.
+    """
+    return {**input_data, "name": normalize_name(input_data.get("name") or "")}
+
+
+class AuditInfoStore:
+    """
+    Holds the audit records in memory, indexed by normalized system name. The audit info file is only
+    read again when its modification time changes.
+    """
+
+    def __init__(self, file_path):
+        """
+        :param file_path: The path to the audit info JSON file.
+        """
+        self.file_path = file_path
+
+        self._lock = threading.Lock()
+        self._mtime_ns = None
+        self._records = {}
+        self._ids_by_name = {}
+        self._names_by_token = {}
+
+    def lookup(self, name):
+        """
+        Finds the audit records of a system by its name or ID. An exact match of the normalized name is
+        preferred; otherwise, the most similar names are matched.
+
+        :param name: The system name.
+        :return: The matching audit records by system ID, best match first; empty if nothing matches.
+        """
+        self._reload_if_changed()
+
+        normalized = normalize_name(name)
+        with self._lock:
+            if normalized in self._ids_by_name:
+                names = [normalized]
+            else:
+                names = self._similar_names(normalized)
+            system_ids = [system_id for found_name in names for system_id in self._ids_by_name[found_name]]
+            return {system_id: self._records[system_id] for system_id in dict.fromkeys(system_ids)}
+
+    def _similar_names(self, normalized):
+        """
+        Finds the known names that are most similar to a normalized name. Only the names that share the most
+        distinctive words with the name are compared, so lookups stay fast with thousands of systems.
+
+        :param normalized: The normalized name.
+        :return: The similar names, most similar first.
+        """
+        # Weigh shared words by how rare they are, so "4321" counts more than "system"
+        candidate_weights = {}
+        for token in set(normalized.split()):
+            names = self._names_by_token.get(token, ())
+            for candidate in names:
+                candidate_weights[candidate] = candidate_weights.get(candidate, 0) + 1 / len(names)
+        if candidate_weights:
+            candidates = sorted(candidate_weights, key=candidate_weights.get, reverse=True)[:MAX_CANDIDATES]
+        else:
+            candidates = list(self._ids_by_name)
+
+        contained = [candidate for candidate in candidates if normalized and normalized in candidate]
+        similar = difflib.get_close_matches(normalized, candidates, n=MAX_MATCHES, cutoff=FUZZY_MATCH_CUTOFF)
+        return list(dict.fromkeys(similar + sorted(contained, key=len)))[:MAX_MATCHES]
+
+    def _reload_if_changed(self):
+        """
+        Reads the audit info file and rebuilds the index if the file changed since it was last read.
+        """
+        mtime_ns = os.stat(self.file_path).st_mtime_ns
+        if mtime_ns == self._mtime_ns:
+            return
+
+        with open(self.file_path, "r") as f:
+            records = json.load(f)
+
+        ids_by_name = {}
+        for system_id, record in records.items():
+            for system_name in (system_id, record.get("name", "")):
+                if normalize_name(system_name):
+                    ids_by_name.setdefault(normalize_name(system_name), []).append(system_id)
+
+        names_by_token = {}
+        for system_name in ids_by_name:
+            for token in system_name.split():
+                names_by_token.setdefault(token, set()).add(system_name)
+
+        with self._lock:
+            self._records = records
+            self._ids_by_name = ids_by_name
+            self._names_by_token = names_by_token
+            self._mtime_ns = mtime_ns
+
+
+_audit_info_store = AuditInfoStore(AUDIT_INFO_FILE)
+
+
 def fetch_audit_info_data(input_data):
     """
     Fetches audit info data for the given system name using the audit info API
@@ -43,8 +173,8 @@ def fetch_audit_info_data(input_data):
 
     name = input_data.get("name")
 
-    # open json file audit-info.json
-    with open("demo/audit-info.json", "r") as f:
-        audit_info_data = json.load(f)
+    audit_info_data = _audit_info_store.lookup(name or "")
+    if not audit_info_data:
+        return {"error": "true", "message": f"No audit info found for a system named '{name}'."}
 
     return audit_info_data
@@ -0,0 +1,228 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+"""
+Runs architecture reviews without user interaction. Each job chats with one architecture diagram and asks a list
+of questions in the same conversation, like a user of the demo would. Jobs run concurrently, and each job's result
+is appended to a JSONL file as soon as the job completes. When the batch is run again with the same results file,
+completed jobs are skipped, so a batch that was interrupted resumes where it stopped.
+
+Usage:
+    python batch_runner.py jobs.jsonl --output results.jsonl --concurrency 4
+
+Each line of the job file is a JSON object with the path to the diagram, and optionally the job's ID and its
+questions; the sample queries of the demo are asked by default:
+    {"id": "puppy", "diagram": "demo/fluffy-puppy-joy-generator.png", "questions": ["What is the current joy count?"]}
+
+A job with the path to the previous revision of its diagram reviews only the changes since that revision, along
+with the findings of that revision's earlier reviews:
+    {"diagram": "demo/puppy-v2.drawio", "previous_diagram": "demo/puppy-v1.drawio"}
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from architecture_chat_demo import ArchitectureChatDemo
+from util.demo_print_utils import SAMPLE_QUERIES
+
+# The number of jobs that run at the same time
+BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', '4'))
+
+
+def read_jobs(job_file):
+    """
+    Reads the jobs of a batch.
+
+    :param job_file: The path to the JSONL job file.
+    :return: The list of jobs, each a dict with an ID, the path to the diagram, the path to the previous revision
+        of the diagram or None, and the questions.
+    """
+    jobs = []
+    with open(job_file, "r") as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            job = json.loads(line)
+            if not job.get("diagram"):
+                raise ValueError(f"Job on line {line_number} of {job_file} has no diagram.")
+
+            questions = job.get("questions") or SAMPLE_QUERIES
+            previous_diagram = job.get("previous_diagram")
+            jobs.append(
+                {
+                    "id": job.get("id") or job_id(job["diagram"], questions, previous_diagram),
+                    "diagram": job["diagram"],
+                    "previous_diagram": previous_diagram,
+                    "questions": questions,
+                }
+            )
+    return jobs
+
+
+def job_id(diagram, questions, previous_diagram=None):
+    """
+    Derives the ID of a job without an explicit ID from its content, so it stays the same when the job file is
+    reordered or extended.
+
+    :param diagram: The path to the diagram.
+    :param questions: The questions.
+    :param previous_diagram: The path to the previous revision of the diagram, or None.
+    :return: The job ID.
+    """
+    content = [diagram, questions] + ([previous_diagram] if previous_diagram else [])
+    return hashlib.sha256(json.dumps(content).encode("utf-8")).hexdigest()[:16]
+
+
+def load_completed_job_ids(results_file):
+    """
+    Reads the IDs of the jobs that have completed in an earlier run. Failed jobs are run again.
+    A line that was only partially written when the earlier run crashed is removed.
+
+    :param results_file: The path to the JSONL results file.
+    :return: The set of completed job IDs.
+    """
+    if not os.path.exists(results_file):
+        return set()
+
+    _remove_partial_line(results_file)
+
+    completed_job_ids = set()
+    with open(results_file, "r") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if result.get("status") == "completed":
+                completed_job_ids.add(result["id"])
+    return completed_job_ids
+
+
+def _remove_partial_line(results_file):
+    """
+    Truncates the results file after its last complete line.
+
+    :param results_file: The path to the JSONL results file.
+    """
+    with open(results_file, "rb+") as f:
+        data = f.read()
+        if data and not data.endswith(b"\n"):
+            f.truncate(data.rfind(b"\n") + 1)
+
+
+class ResultWriter:
+    """
+    Appends results to a JSONL file, one line per job. Each line is flushed to disk once it's written,
+    so the results of completed jobs survive a crash.
+    """
+
+    def __init__(self, results_file):
+        """
+        :param results_file: The path to the JSONL results file; created if it doesn't exist.
+        """
+        self._file = open(results_file, "a")
+        self._lock = threading.Lock()
+
+    def write(self, result):
+        """
+        Appends a result.
+
+        :param result: The result of a job.
+        """
+        line = json.dumps(result, default=str) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+def run_job(job):
+    """
+    Runs a job: asks all of its questions about the diagram in one conversation.
+
+    :param job: The job.
+    :return: The job's result, with the answers and their metrics. If a question fails, the status is "failed",
+        and the result contains the error and the answers up to the failed question.
+    """
+    started_at = time.perf_counter()
+    result = {"id": job["id"], "diagram": job["diagram"], "status": "completed", "answers": []}
+    if job["previous_diagram"]:
+        result["previous_diagram"] = job["previous_diagram"]
+
+    demo = ArchitectureChatDemo(streaming=False, quiet=True)
+    try:
+        conversation = []
+        for index, question in enumerate(job["questions"]):
+            # The diagram is sent with the first question only, like in the interactive demo
+            if index == 0:
+                message = demo.ask(conversation, question, job["diagram"], job["previous_diagram"])
+            else:
+                message = demo.ask(conversation, question)
+            answer = "\n".join(block["text"] for block in message["content"] if "text" in block)
+            result["answers"].append(
+                {"question": question, "answer": answer, **demo.get_turn_metrics()}
+            )
+    except Exception as e:
+        logging.exception("Job %s failed.", job["id"])
+        result["status"] = "failed"
+        result["error"] = str(e)
+    finally:
+        demo.close()
+
+    result["duration_ms"] = round((time.perf_counter() - started_at) * 1000)
+    return result
+
+
+def run_batch(job_file, results_file, concurrency=BATCH_CONCURRENCY):
+    """
+    Runs the jobs of a batch concurrently and appends their results to the results file, skipping the jobs
+    that have completed in an earlier run.
+
+    :param job_file: The path to the JSONL job file.
+    :param results_file: The path to the JSONL results file.
+    :param concurrency: The number of jobs that run at the same time.
+    :return: A dict with the number of completed, failed, and skipped jobs.
+    """
+    jobs = read_jobs(job_file)
+    completed_job_ids = load_completed_job_ids(results_file)
+    pending_jobs = [job for job in jobs if job["id"] not in completed_job_ids]
+
+    summary = {"completed": 0, "failed": 0, "skipped": len(jobs) - len(pending_jobs)}
+    logging.info("Running %d jobs, skipping %d completed jobs.", len(pending_jobs), summary["skipped"])
+
+    writer = ResultWriter(results_file)
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="job") as executor:
+            futures = [executor.submit(run_job, job) for job in pending_jobs]
+            for future in as_completed(futures):
+                result = future.result()
+                writer.write(result)
+                summary[result["status"]] += 1
+                logging.info(
+                    "Job %s %s (%d of %d).",
+                    result["id"], result["status"], summary["completed"] + summary["failed"], len(pending_jobs),
+                )
+    finally:
+        writer.close()
+
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run architecture reviews for a batch of diagrams and questions.")
+    parser.add_argument("jobs", help="The JSONL job file.")
+    parser.add_argument("--output", required=True, help="The JSONL results file; completed jobs in it are skipped.")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY, help="The number of concurrent jobs.")
+    arguments = parser.parse_args()
+
+    summary = run_batch(arguments.jobs, arguments.output, arguments.concurrency)
+    logging.info("Completed %d jobs, %d failed, %d skipped.", summary["completed"], summary["failed"], summary["skipped"])
@@ -0,0 +1,413 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+"""
+Benchmarks the app's own overhead without AWS: recorded conversations are replayed through the fake Bedrock
+endpoint, which serves the Converse, ConverseStream, and knowledge base Retrieve APIs, so ArchitectureChatDemo
+runs its full agent loop, including routing, history compaction, tool dispatch, and building the best
+practices prompt.
+
+The latency of the fake endpoint is injected and zero by default, so the results show the time the app spends
+on its own. The stages are measured with the app's tracing spans:
+
+- turn: a user turn, from the query to the final response
+- loop_overhead: the part of a turn that's neither a model call nor a tool round
+- model_call: a call to the Converse or ConverseStream API, including the HTTP round trip to the fake endpoint
+- tool_round: the tools requested in one model response, which run concurrently
+- tool:<name>: the invocation of a tool
+- kb_retrieval: a knowledge base retrieval
+- best_practices_prompt: the Best Practices Tool without its retrieval, i.e. building the prompt
+- diagram_analysis: the background call that analyzes the diagram
+
+The warm-up conversation stores the analysis of the diagram, so the measured conversations start with it
+instead of the image, like repeat sessions of the app do. Add --analysis-store false to send the image in every
+conversation instead.
+
+Write the results to a file with --output, and compare them with the results of another commit with --baseline.
+Results are only comparable if they were measured on the same machine with the same parameters.
+
+Usage:
+    python benchmarks/agent_loop.py [--conversations 20] [--concurrency 4] [--output results.json]
+        [--baseline baseline.json] [--recording benchmarks/recordings/fluffy-puppy-review.json]
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web
+
+from chat_server_load import free_port, percentile
+from fake_bedrock import FakeBedrock, Recording
+
+REPOSITORY_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_RECORDING = os.path.join(REPOSITORY_ROOT, "benchmarks", "recordings", "fluffy-puppy-review.json")
+
+# The stages whose percentiles are compared with the baseline
+COMPARED_PERCENTILES = ("p50_ms", "p99_ms")
+
+
+class SpanCollector:
+    """
+    A trace exporter that keeps the finished spans in memory.
+    """
+
+    def __init__(self):
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def export(self, span):
+        with self._lock:
+            self.spans.append(span.to_dict())
+
+    def clear(self):
+        """
+        Discards the collected spans.
+        """
+        with self._lock:
+            self.spans = []
+
+
+def start_fake_bedrock(fake_bedrock):
+    """
+    Serves the fake Bedrock endpoint on an event loop in a background thread.
+
+    :param fake_bedrock: The fake Bedrock endpoint.
+    :return: The endpoint URL.
+    """
+    port = free_port()
+    started = threading.Event()
+
+    async def serve():
+        runner = web.AppRunner(fake_bedrock.create_app(), access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", port).start()
+        started.set()
+        await asyncio.Event().wait()
+
+    threading.Thread(target=asyncio.run, args=(serve(),), daemon=True, name="fake-bedrock").start()
+    started.wait()
+    return f"http://127.0.0.1:{port}"
+
+
+def configure_environment(endpoint_url, concurrency, analysis_store=True):
+    """
+    Points the app at the fake endpoint, and fixes the settings that affect the results. Must be called before
+    the app is imported.
+
+    :param endpoint_url: The URL of the fake Bedrock endpoint.
+    :param concurrency: The number of concurrent conversations.
+    :param analysis_store: Whether to store the diagram analyses, in a new directory.
+    """
+    os.environ.update(
+        {
+            "AWS_REGION": "us-east-1",
+            "AWS_ACCESS_KEY_ID": "fake",
+            "AWS_SECRET_ACCESS_KEY": "fake",
+            "AWS_ENDPOINT_URL_BEDROCK_RUNTIME": endpoint_url,
+            "AWS_ENDPOINT_URL_BEDROCK_AGENT_RUNTIME": endpoint_url,
+            "AWS_MAX_POOL_CONNECTIONS": str(max(50, 2 * concurrency)),
+            "KNOWLEDGE_BASE_ID": "FAKEKB0001",
+            "RETRIEVAL_BACKEND": "knowledge_base",
+            # Every retrieval reaches the fake endpoint, so the results don't depend on the cache
+            "RETRIEVAL_CACHE_SIZE": "0",
+            "IMAGE_CACHE_DIR": tempfile.mkdtemp(prefix="agent-loop-images-"),
+            "DIAGRAM_ANALYSIS_DIR": tempfile.mkdtemp(prefix="agent-loop-analyses-") if analysis_store else "",
+            "PROMPT_CACHING": "false",
+            "HEDGE_AFTER_SECONDS": "0",
+            "TRACE_EXPORTERS": "",
+        }
+    )
+
+
+def run_conversation(recording, streaming):
+    """
+    Runs the recorded conversation with a new session of the demo.
+
+    :param recording: The recording.
+    :param streaming: Whether to use the ConverseStream API.
+    :return: The number of turns.
+    """
+    from architecture_chat_demo import ArchitectureChatDemo
+
+    demo = ArchitectureChatDemo(streaming=streaming, quiet=True)
+    conversation = []
+    for index, turn in enumerate(recording.turns):
+        demo.ask(conversation, turn["query"], recording.diagram if index == 0 else None)
+    demo.close()
+    return len(recording.turns)
+
+
+def stage_durations(spans):
+    """
+    Groups the span durations by stage, see the module docstring.
+
+    :param spans: The finished spans, as dicts.
+    :return: The durations in milliseconds by stage.
+    """
+    children = defaultdict(list)
+    for span in spans:
+        children[span["parent_id"]].append(span)
+
+    stages = defaultdict(list)
+    for span in spans:
+        name, duration_ms, attributes = span["name"], span["duration_ms"], span["attributes"]
+        if name == "user_turn":
+            stages["turn"].append(duration_ms)
+            accounted_ms = sum(
+                child["duration_ms"]
+                for child in children[span["span_id"]]
+                if child["name"] in ("bedrock_call", "tool_round")
+            )
+            stages["loop_overhead"].append(duration_ms - accounted_ms)
+        elif name == "bedrock_call":
+            stages[attributes.get("purpose") or "model_call"].append(duration_ms)
+        elif name == "tool_invocation":
+            stages[f"tool:{attributes['tool']}"].append(duration_ms)
+            if attributes["tool"] == "Best_Practices_Tool":
+                retrieval_ms = sum(
+                    child["duration_ms"] for child in children[span["span_id"]] if child["name"] == "kb_retrieval"
+                )
+                stages["best_practices_prompt"].append(duration_ms - retrieval_ms)
+        else:
+            stages[name].append(duration_ms)
+    return stages
+
+
+def summarize(values):
+    """
+    :param values: The measured values.
+    :return: The count, mean, and percentiles of the values.
+    """
+    return {
+        "count": len(values),
+        "mean_ms": round(statistics.fmean(values), 3),
+        "p50_ms": round(percentile(values, 50), 3),
+        "p90_ms": round(percentile(values, 90), 3),
+        "p99_ms": round(percentile(values, 99), 3),
+    }
+
+
+def summarize_sizes(values):
+    """
+    :param values: The measured sizes in bytes.
+    :return: The median, maximum, and total of the sizes.
+    """
+    if not values:
+        return None
+    return {"p50_bytes": percentile(values, 50), "max_bytes": max(values), "total_bytes": sum(values)}
+
+
+def peak_rss_bytes():
+    """
+    :return: The peak resident set size of the process in bytes, or None if it isn't available.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    # Linux reports the peak in kilobytes, macOS in bytes
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def git_commit():
+    """
+    :return: The current commit of the repository, with "-dirty" if there are uncommitted changes; or None.
+    """
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPOSITORY_ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"], cwd=REPOSITORY_ROOT, capture_output=True, text=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ("-dirty" if dirty else "")
+
+
+def run_benchmark(arguments):
+    """
+    Runs the benchmark.
+
+    :param arguments: The command line arguments.
+    :return: The results, with the parameters and environment they were measured with.
+    """
+    recording = Recording.load(arguments.recording)
+    fake_bedrock = FakeBedrock(
+        arguments.time_to_first_token_ms,
+        arguments.chunk_interval_ms,
+        recording=recording,
+        retrieve_latency_ms=arguments.retrieve_latency_ms,
+    )
+    configure_environment(start_fake_bedrock(fake_bedrock), arguments.concurrency, arguments.analysis_store)
+    os.chdir(REPOSITORY_ROOT)
+    sys.path.insert(0, REPOSITORY_ROOT)
+
+    import architecture_chat_demo
+    from util.tracing import get_tracer
+
+    # The app logs each routing decision; only warnings are of interest here
+    logging.getLogger().setLevel(logging.WARNING)
+    collector = SpanCollector()
+    get_tracer().exporters.append(collector)
+
+    # Warm up the clients, the image cache, the diagram analysis store, and the tools' imports
+    run_conversation(recording, arguments.streaming)
+    collector.clear()
+    requests_before, request_bytes_before = fake_bedrock.requests, fake_bedrock.request_bytes
+
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=arguments.concurrency) as executor:
+        turns = sum(
+            executor.map(lambda _: run_conversation(recording, arguments.streaming), range(arguments.conversations))
+        )
+    wall_seconds = time.perf_counter() - started_at
+
+    # The background diagram analyses may still be finishing
+    time.sleep(0.1)
+    spans = list(collector.spans)
+    requests = fake_bedrock.requests - requests_before
+
+    # Measure the Python heap of one conversation separately, since tracing allocations slows everything down
+    tracemalloc.start()
+    run_conversation(recording, arguments.streaming)
+    _, heap_peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    stages = stage_durations(spans)
+    return {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "parameters": {
+            "recording": os.path.relpath(arguments.recording, REPOSITORY_ROOT),
+            "conversations": arguments.conversations,
+            "concurrency": arguments.concurrency,
+            "streaming": arguments.streaming,
+            "analysis_store": arguments.analysis_store,
+            "time_to_first_token_ms": arguments.time_to_first_token_ms,
+            "chunk_interval_ms": arguments.chunk_interval_ms,
+            "retrieve_latency_ms": arguments.retrieve_latency_ms,
+            "model_id": architecture_chat_demo.MODEL_ID,
+        },
+        "throughput": {
+            "wall_seconds": round(wall_seconds, 3),
+            "conversations_per_second": round(arguments.conversations / wall_seconds, 2),
+            "turns_per_second": round(turns / wall_seconds, 2),
+            "requests_per_second": round(requests / wall_seconds, 2),
+        },
+        "stages": {name: summarize(values) for name, values in sorted(stages.items())},
+        "payloads": {
+            "model_request": summarize_sizes(
+                [span["attributes"]["request_bytes"] for span in spans if span["name"] == "bedrock_call"]
+            ),
+            "tool_response": summarize_sizes(
+                [span["attributes"]["response_bytes"] for span in spans if span["name"] == "tool_invocation"]
+            ),
+            "received_by_endpoint": {
+                "requests": requests,
+                "total_bytes": fake_bedrock.request_bytes - request_bytes_before,
+            },
+        },
+        "memory": {
+            "peak_rss_bytes": peak_rss_bytes(),
+            "heap_peak_bytes_per_conversation": heap_peak_bytes,
+        },
+    }
+
+
+def report(results, baseline=None):
+    """
+    Prints the results, and their change from the baseline.
+
+    :param results: The results.
+    :param baseline: The results to compare with, or None.
+    """
+    print(f"Commit {results['commit']}, Python {results['python']}, {results['cpus']} CPUs")
+    if baseline is not None:
+        print(f"Baseline: commit {baseline['commit']}")
+        if baseline["parameters"] != results["parameters"]:
+            print("Warning: The baseline was measured with different parameters.")
+    print("")
+
+    def change(current, previous):
+        if previous in (None, 0) or current is None:
+            return ""
+        return f"{(current - previous) / previous * 100:+.1f}%"
+
+    print(f"{'Throughput':<28} {'current':>12} {'baseline':>12} {'change':>9}")
+    for name, value in results["throughput"].items():
+        previous = baseline["throughput"].get(name) if baseline else None
+        print(f"{name:<28} {value:>12} {'' if previous is None else previous:>12} {change(value, previous):>9}")
+    print("")
+
+    print(f"{'Stage (ms)':<28} {'count':>7} {'p50':>9} {'p90':>9} {'p99':>9} {'p50 change':>11} {'p99 change':>11}")
+    for name, stage in results["stages"].items():
+        previous = baseline["stages"].get(name, {}) if baseline else {}
+        changes = [change(stage[key], previous.get(key)) for key in COMPARED_PERCENTILES]
+        print(
+            f"{name:<28} {stage['count']:>7} {stage['p50_ms']:>9.2f} {stage['p90_ms']:>9.2f} {stage['p99_ms']:>9.2f} "
+            f"{changes[0]:>11} {changes[1]:>11}"
+        )
+    print("")
+
+    for name, sizes in results["payloads"].items():
+        if sizes and "p50_bytes" in sizes:
+            print(f"{name + ' payload':<28} p50 {sizes['p50_bytes']} bytes, max {sizes['max_bytes']} bytes")
+    received = results["payloads"]["received_by_endpoint"]
+    print(f"{'Received by the endpoint':<28} {received['total_bytes']} bytes in {received['requests']} requests")
+
+    memory = results["memory"]
+    if memory["peak_rss_bytes"] is not None:
+        print(f"{'Peak RSS':<28} {memory['peak_rss_bytes'] / 2 ** 20:.1f} MiB")
+    print(f"{'Heap peak per conversation':<28} {memory['heap_peak_bytes_per_conversation'] / 2 ** 20:.1f} MiB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the agent loop against a fake Bedrock endpoint.")
+    parser.add_argument("--recording", default=DEFAULT_RECORDING, help="The recorded conversation to replay.")
+    parser.add_argument("--conversations", type=int, default=20, help="The number of conversations to run.")
+    parser.add_argument("--concurrency", type=int, default=4, help="The number of concurrent conversations.")
+    parser.add_argument("--streaming", default="true", choices=["true", "false"], help="Use ConverseStream.")
+    parser.add_argument(
+        "--analysis-store", default="true", choices=["true", "false"], help="Start with the stored diagram analysis."
+    )
+    parser.add_argument("--time-to-first-token-ms", type=int, default=0, help="The injected model latency.")
+    parser.add_argument("--chunk-interval-ms", type=int, default=0, help="The injected delay between chunks.")
+    parser.add_argument("--retrieve-latency-ms", type=int, default=0, help="The injected retrieval latency.")
+    parser.add_argument("--output", help="The file to write the results to, as JSON.")
+    parser.add_argument("--baseline", help="The results of an earlier run to compare with.")
+    arguments = parser.parse_args()
+    arguments.recording = os.path.abspath(arguments.recording)
+    arguments.streaming = arguments.streaming == "true"
+    arguments.analysis_store = arguments.analysis_store == "true"
+
+    baseline_results = None
+    if arguments.baseline:
+        with open(arguments.baseline, "r", encoding="utf-8") as f:
+            baseline_results = json.load(f)
+    output_file = os.path.abspath(arguments.output) if arguments.output else None
+
+    benchmark_results = run_benchmark(arguments)
+    report(benchmark_results, baseline_results)
+
+    if output_file:
+        with open(output_file, "w", encoding="utf-8") as f:
+            json.dump(benchmark_results, f, indent=2)
+            f.write("\n")
+        print(f"\nWrote the results to {output_file}.")
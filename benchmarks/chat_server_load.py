@@ -0,0 +1,234 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+"""
+Load-tests the chat server against the fake Bedrock endpoint. The server runs in its own process, and a number
+of simulated users each open a session and ask several questions over a WebSocket, one after the other.
+
+The report shows the turn latency percentiles as the users see them, the throughput, and the server's CPU time.
+Sessions per core is the number of concurrent sessions divided by the number of cores the server kept busy,
+i.e. how many sessions like these one core can serve. The server's CPU time is read from /proc, so it's only
+reported on Linux.
+
+Usage:
+    python benchmarks/chat_server_load.py [--sessions 100] [--turns 3] [--time-to-first-token-ms 300]
+"""
+
+import argparse
+import asyncio
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+from aiohttp import web
+
+from fake_bedrock import FakeBedrock
+
+REPOSITORY_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    """
+    :return: A free TCP port on the loopback interface.
+    """
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def process_cpu_seconds(pid):
+    """
+    Reads the CPU time a process has used so far.
+
+    :param pid: The process ID.
+    :return: The user and system CPU time in seconds, or None if /proc isn't available.
+    """
+    try:
+        with open(f"/proc/{pid}/stat", "r") as f:
+            # The process name in parentheses may contain spaces, the fields after it don't
+            fields = f.read().rsplit(")", 1)[1].split()
+    except OSError:
+        return None
+    # utime and stime are fields 14 and 15 of the stat file, in clock ticks
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def percentile(values, percent):
+    """
+    :param values: The values.
+    :param percent: The percentile, e.g. 99.
+    :return: The percentile of the values, using the nearest-rank method.
+    """
+    ordered = sorted(values)
+    return ordered[max(0, -(-len(ordered) * percent // 100) - 1)]
+
+
+async def wait_for_port(port, timeout=30):
+    """
+    Waits until a server accepts connections on the port.
+
+    :param port: The port.
+    :param timeout: The maximum time to wait in seconds.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.1)
+
+
+async def simulate_user(http, server_url, turns, results):
+    """
+    Opens a session and asks questions one after the other, measuring the latency of each turn.
+
+    :param http: The aiohttp client session.
+    :param server_url: The base URL of the chat server.
+    :param turns: The number of questions to ask.
+    :param results: The dict of measurements to add to.
+    """
+    async with http.post(f"{server_url}/sessions", json={}) as response:
+        session_id = (await response.json())["session_id"]
+
+    async with http.ws_connect(f"{server_url}/sessions/{session_id}/ws") as ws:
+        for turn in range(turns):
+            started_at = time.perf_counter()
+            first_token_at = None
+            await ws.send_json({"query": f"Question {turn + 1}: which services does this architecture use?"})
+            while True:
+                event = await ws.receive_json()
+                if event["type"] == "text" and first_token_at is None:
+                    first_token_at = time.perf_counter()
+                if event["type"] in ("done", "error"):
+                    break
+
+            if event["type"] == "error":
+                results["errors"] += 1
+                continue
+            results["turn_latencies_ms"].append((time.perf_counter() - started_at) * 1000)
+            if first_token_at is not None:
+                results["times_to_first_token_ms"].append((first_token_at - started_at) * 1000)
+
+    await http.delete(f"{server_url}/sessions/{session_id}")
+
+
+async def run_load_test(sessions, turns, time_to_first_token_ms, chunk_interval_ms, server_workers, throttle_rate=0.0):
+    """
+    Starts the fake Bedrock endpoint and the chat server, and runs the simulated users concurrently.
+
+    :return: The measurements.
+    """
+    fake_bedrock = FakeBedrock(time_to_first_token_ms, chunk_interval_ms, throttle_rate=throttle_rate)
+    fake_bedrock_port = free_port()
+    runner = web.AppRunner(fake_bedrock.create_app())
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", fake_bedrock_port).start()
+
+    server_port = free_port()
+    environment = {
+        **os.environ,
+        "AWS_REGION": "us-east-1",
+        "AWS_ACCESS_KEY_ID": "fake",
+        "AWS_SECRET_ACCESS_KEY": "fake",
+        "AWS_ENDPOINT_URL_BEDROCK_RUNTIME": f"http://127.0.0.1:{fake_bedrock_port}",
+        "SERVER_WORKERS": str(server_workers),
+        "AWS_MAX_POOL_CONNECTIONS": str(server_workers),
+        "PROMPT_CACHING": "false",
+        # The fake analyses mustn't end up in the app's store
+        "DIAGRAM_ANALYSIS_DIR": tempfile.mkdtemp(prefix="chat-server-load-analyses-"),
+    }
+    server = subprocess.Popen(
+        [sys.executable, "chat_server.py", "--port", str(server_port)],
+        cwd=REPOSITORY_ROOT,
+        env=environment,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+    results = {"turn_latencies_ms": [], "times_to_first_token_ms": [], "errors": 0}
+    try:
+        await wait_for_port(server_port)
+        server_url = f"http://127.0.0.1:{server_port}"
+
+        connector = aiohttp.TCPConnector(limit=0)
+        async with aiohttp.ClientSession(connector=connector) as http:
+            # Warm up the server, so the measurement doesn't include its first client and thread creations
+            await simulate_user(http, server_url, 1, {"turn_latencies_ms": [], "times_to_first_token_ms": [], "errors": 0})
+
+            cpu_seconds_before = process_cpu_seconds(server.pid)
+            started_at = time.perf_counter()
+            await asyncio.gather(*(simulate_user(http, server_url, turns, results) for _ in range(sessions)))
+            results["wall_seconds"] = time.perf_counter() - started_at
+            cpu_seconds_after = process_cpu_seconds(server.pid)
+
+        results["server_cpu_seconds"] = (
+            None if cpu_seconds_before is None else cpu_seconds_after - cpu_seconds_before
+        )
+    finally:
+        server.terminate()
+        server.wait()
+        await runner.cleanup()
+
+    results["throttled_requests"] = fake_bedrock.throttled_requests
+    return results
+
+
+def report(results, sessions):
+    """
+    Prints the results of the load test.
+
+    :param results: The measurements.
+    :param sessions: The number of concurrent sessions.
+    """
+    latencies = results["turn_latencies_ms"]
+    times_to_first_token = results["times_to_first_token_ms"]
+    print(f"{'Concurrent sessions':<28} {sessions:>10}")
+    print(f"{'Turns':<28} {len(latencies):>10}")
+    print(f"{'Errors':<28} {results['errors']:>10}")
+    print(f"{'Throttled requests':<28} {results['throttled_requests']:>10}")
+    print(f"{'Throughput (turns/s)':<28} {len(latencies) / results['wall_seconds']:>10.1f}")
+    if times_to_first_token:
+        print(f"{'Time to first token p50 (ms)':<28} {statistics.median(times_to_first_token):>10.0f}")
+        print(f"{'Time to first token p99 (ms)':<28} {percentile(times_to_first_token, 99):>10.0f}")
+    if latencies:
+        print(f"{'Turn latency p50 (ms)':<28} {statistics.median(latencies):>10.0f}")
+        print(f"{'Turn latency p99 (ms)':<28} {percentile(latencies, 99):>10.0f}")
+
+    cpu_seconds = results["server_cpu_seconds"]
+    if cpu_seconds:
+        cores_busy = cpu_seconds / results["wall_seconds"]
+        print(f"{'Server CPU (s)':<28} {cpu_seconds:>10.2f}")
+        print(f"{'Server cores busy':<28} {cores_busy:>10.2f}")
+        print(f"{'Sessions per core':<28} {sessions / cores_busy:>10.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load-test the chat server against a fake Bedrock endpoint.")
+    parser.add_argument("--sessions", type=int, default=100, help="The number of concurrent sessions.")
+    parser.add_argument("--turns", type=int, default=3, help="The number of questions per session.")
+    parser.add_argument("--time-to-first-token-ms", type=int, default=300, help="The fake model's first token delay.")
+    parser.add_argument("--chunk-interval-ms", type=int, default=20, help="The fake model's delay between chunks.")
+    parser.add_argument("--server-workers", type=int, default=128, help="The SERVER_WORKERS of the chat server.")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="The fraction of throttled requests.")
+    arguments = parser.parse_args()
+
+    load_test_results = asyncio.run(
+        run_load_test(
+            arguments.sessions,
+            arguments.turns,
+            arguments.time_to_first_token_ms,
+            arguments.chunk_interval_ms,
+            arguments.server_workers,
+            arguments.throttle_rate,
+        )
+    )
+    report(load_test_results, arguments.sessions)
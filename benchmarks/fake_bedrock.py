@@ -0,0 +1,348 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+"""
+A local stand-in for the Amazon Bedrock Runtime Converse and ConverseStream APIs and the knowledge base Retrieve
+API, for benchmarks and load tests that shouldn't call, or pay for, the real services. It answers after an
+injected latency, and streams responses in chunks with the AWS event stream encoding that boto3 expects.
+
+By default, every request is answered with the same text. With a recording (see record_conversation.py), the
+recorded responses are replayed instead, including the model's tool use requests, so the app runs its full
+agent loop: each request is matched to the recorded turn with the same user query, and to the step within
+that turn by the number of model responses that followed the query.
+
+Point the app at it with the AWS_ENDPOINT_URL_BEDROCK_RUNTIME and AWS_ENDPOINT_URL_BEDROCK_AGENT_RUNTIME
+environment variables; boto3 still signs the requests, so it needs credentials, but any values will do.
+
+Usage:
+    python benchmarks/fake_bedrock.py --port 8090 --time-to-first-token-ms 300 [--recording recording.json]
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import struct
+import zlib
+
+from aiohttp import web
+
+RESPONSE_TEXT = (
+    "The architecture uses Amazon API Gateway, AWS Lambda, and Amazon DynamoDB. Requests flow from the client "
+    "through API Gateway to the Lambda function, which stores the generated joy in the DynamoDB table."
+)
+
+# The analysis recorded by every request that forces the model to use a tool, like the diagram analysis
+DIAGRAM_ANALYSIS = {
+    "title": "Fluffy Puppy Joy Generator",
+    "summary": RESPONSE_TEXT,
+    "services": [
+        {"label": "API Gateway", "service": "Amazon API Gateway"},
+        {"label": "Joy Generator", "service": "AWS Lambda"},
+        {"label": "Joy Table", "service": "Amazon DynamoDB"},
+    ],
+    "edges": [
+        {"source": "API Gateway", "target": "Joy Generator", "label": "invokes"},
+        {"source": "Joy Generator", "target": "Joy Table", "label": "stores joy"},
+    ],
+    "data_flow": ["The client calls API Gateway.", "Lambda generates joy and stores it in DynamoDB."],
+    "notes": [],
+}
+
+
+class Recording:
+    """
+    The recorded exchanges of a conversation with an architecture diagram: the model's responses to each user
+    query, the analysis of the diagram, and the knowledge base retrievals.
+    """
+
+    def __init__(self, data):
+        """
+        :param data: The recording, as written by record_conversation.py.
+        """
+        self.diagram = data.get("diagram")
+        self.turns = data["turns"]
+        self.diagram_analysis = data.get("diagram_analysis")
+        self.retrievals = data.get("retrievals", [])
+
+    @classmethod
+    def load(cls, path):
+        """
+        :param path: The path of the recording file.
+        :return: The recording.
+        """
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def converse_response(self, body):
+        """
+        Finds the recorded response to a Converse or ConverseStream request.
+
+        :param body: The request body.
+        :return: The recorded response, or None if the recording has no response to the request.
+        """
+        if "toolChoice" in body.get("toolConfig", {}):
+            # Only the diagram analysis forces the model to use a tool
+            return self.diagram_analysis
+
+        messages = body["messages"]
+        query_indexes = [index for index, message in enumerate(messages) if _is_user_query(message)]
+        if not query_indexes:
+            return None
+        query_texts = [block["text"] for block in messages[query_indexes[-1]]["content"] if "text" in block]
+        query = query_texts[-1] if query_texts else ""
+        step = sum(1 for message in messages[query_indexes[-1]:] if message["role"] == "assistant")
+
+        for turn in self.turns:
+            # The first query is prefixed with the diagram's file name
+            if turn["responses"] and query.endswith(turn["query"]):
+                return turn["responses"][min(step, len(turn["responses"]) - 1)]
+        return None
+
+    def retrieve_response(self, body):
+        """
+        Finds the recorded response to a Retrieve request, by its query or, failing that, the first one.
+
+        :param body: The request body.
+        :return: The recorded response, or None if the recording has no retrievals.
+        """
+        query = body.get("retrievalQuery", {}).get("text")
+        for retrieval in self.retrievals:
+            if retrieval["query"] == query:
+                return retrieval["response"]
+        return self.retrievals[0]["response"] if self.retrievals else None
+
+
+class FakeBedrock:
+    """
+    The fake Bedrock Runtime endpoint with configurable latency.
+    """
+
+    def __init__(
+        self,
+        time_to_first_token_ms=300,
+        chunk_interval_ms=20,
+        chunks=20,
+        response_text=RESPONSE_TEXT,
+        throttle_rate=0.0,
+        recording=None,
+        retrieve_latency_ms=50,
+    ):
+        """
+        :param time_to_first_token_ms: The delay before the first chunk of the response.
+        :param chunk_interval_ms: The delay between the chunks of a streamed response.
+        :param chunks: The number of chunks the text of a response is streamed in.
+        :param response_text: The text of every response that isn't replayed from the recording.
+        :param throttle_rate: The fraction of requests that are rejected with a ThrottlingException.
+        :param recording: The recording to replay, or None.
+        :param retrieve_latency_ms: The delay before the response of a knowledge base retrieval.
+        """
+        self.time_to_first_token_ms = time_to_first_token_ms
+        self.chunk_interval_ms = chunk_interval_ms
+        self.chunks = chunks
+        self.response_text = response_text
+        self.throttle_rate = throttle_rate
+        self.recording = recording
+        self.retrieve_latency_ms = retrieve_latency_ms
+        self.requests = 0
+        self.throttled_requests = 0
+        self.request_bytes = 0
+
+    def create_app(self):
+        """
+        Creates the aiohttp application with the Converse and ConverseStream routes.
+
+        :return: The aiohttp application.
+        """
+        app = web.Application()
+        app.add_routes(
+            [
+                web.post("/model/{model_id}/converse", self.converse),
+                web.post("/model/{model_id}/converse-stream", self.converse_stream),
+                web.post("/knowledgebases/{knowledge_base_id}/retrieve", self.retrieve),
+            ]
+        )
+        return app
+
+    async def converse(self, request):
+        """
+        Answers a Converse request after the latency of a complete response.
+        """
+        body = await self._read_body(request)
+        if random.random() < self.throttle_rate:
+            return self._throttle()
+        latency_ms = self.time_to_first_token_ms + self.chunks * self.chunk_interval_ms
+        await asyncio.sleep(latency_ms / 1000)
+        return web.json_response({**self._response(body), "metrics": {"latencyMs": latency_ms}})
+
+    async def converse_stream(self, request):
+        """
+        Answers a ConverseStream request, streaming the text in chunks. Tool use requests are streamed with
+        their complete input in one chunk.
+        """
+        body = await self._read_body(request)
+        if random.random() < self.throttle_rate:
+            return self._throttle()
+        converse_response = self._response(body)
+        message = converse_response["output"]["message"]
+
+        response = web.StreamResponse(headers={"Content-Type": "application/vnd.amazon.eventstream"})
+        await response.prepare(request)
+
+        await response.write(encode_event("messageStart", {"role": message["role"]}))
+        await asyncio.sleep(self.time_to_first_token_ms / 1000)
+
+        for index, block in enumerate(message["content"]):
+            if "toolUse" in block:
+                tool_use = block["toolUse"]
+                start = {"toolUse": {"toolUseId": tool_use["toolUseId"], "name": tool_use["name"]}}
+                await response.write(encode_event("contentBlockStart", {"contentBlockIndex": index, "start": start}))
+                delta = {"contentBlockIndex": index, "delta": {"toolUse": {"input": json.dumps(tool_use["input"])}}}
+                await response.write(encode_event("contentBlockDelta", delta))
+            elif "text" in block:
+                text = block["text"]
+                chunk_size = max(1, -(-len(text) // self.chunks))
+                for start in range(0, len(text), chunk_size):
+                    delta = {"contentBlockIndex": index, "delta": {"text": text[start:start + chunk_size]}}
+                    await response.write(encode_event("contentBlockDelta", delta))
+                    await asyncio.sleep(self.chunk_interval_ms / 1000)
+            await response.write(encode_event("contentBlockStop", {"contentBlockIndex": index}))
+
+        await response.write(encode_event("messageStop", {"stopReason": converse_response["stopReason"]}))
+        await response.write(
+            encode_event(
+                "metadata",
+                {"usage": converse_response["usage"], "metrics": {"latencyMs": self.time_to_first_token_ms}},
+            )
+        )
+        await response.write_eof()
+        return response
+
+    async def retrieve(self, request):
+        """
+        Answers a knowledge base Retrieve request after the retrieval latency.
+        """
+        body = await self._read_body(request)
+        if random.random() < self.throttle_rate:
+            return self._throttle()
+        await asyncio.sleep(self.retrieve_latency_ms / 1000)
+
+        response = self.recording.retrieve_response(body) if self.recording is not None else None
+        if response is None:
+            response = {"retrievalResults": [{"content": {"text": self.response_text}, "score": 0.5}]}
+        return web.json_response(response)
+
+    async def _read_body(self, request):
+        """
+        Reads and counts a request.
+
+        :param request: The request.
+        :return: The JSON request body.
+        """
+        self.requests += 1
+        body = await request.read()
+        self.request_bytes += len(body)
+        return json.loads(body) if body else {}
+
+    def _response(self, body):
+        """
+        :param body: The Converse or ConverseStream request body.
+        :return: The recorded response to the request, or the default response: the use of the tool the
+            request forces, or the default text.
+        """
+        response = self.recording.converse_response(body) if self.recording is not None else None
+        forced_tool = body.get("toolConfig", {}).get("toolChoice", {}).get("tool")
+        if response is None and forced_tool is not None:
+            tool_use = {"toolUseId": "tooluse_analysis", "name": forced_tool["name"], "input": DIAGRAM_ANALYSIS}
+            response = {
+                "output": {"message": {"role": "assistant", "content": [{"toolUse": tool_use}]}},
+                "stopReason": "tool_use",
+                "usage": self._usage(),
+            }
+        elif response is None:
+            response = {
+                "output": {"message": {"role": "assistant", "content": [{"text": self.response_text}]}},
+                "stopReason": "end_turn",
+                "usage": self._usage(),
+            }
+        return response
+
+    def _throttle(self):
+        """
+        :return: The error response of a throttled request.
+        """
+        self.throttled_requests += 1
+        return web.json_response(
+            {"message": "Too many requests, please wait before trying again."},
+            status=429,
+            headers={"x-amzn-ErrorType": "ThrottlingException"},
+        )
+
+    def _usage(self):
+        """
+        :return: The token usage reported for every response.
+        """
+        output_tokens = len(self.response_text) // 4
+        return {"inputTokens": 1500, "outputTokens": output_tokens, "totalTokens": 1500 + output_tokens}
+
+
+def _is_user_query(message):
+    """
+    :param message: A message of the conversation.
+    :return: True if the message is a user query, i.e. a user message that isn't a tool result.
+    """
+    return message["role"] == "user" and not any("toolResult" in block for block in message["content"])
+
+
+def encode_event(event_type, payload):
+    """
+    Encodes an event in the AWS event stream format: a prelude with the total and header lengths and its CRC32,
+    the headers, the JSON payload, and the CRC32 of the whole message.
+
+    :param event_type: The type of the event, e.g. "contentBlockDelta".
+    :param payload: The event's payload.
+    :return: The encoded event.
+    """
+    headers = b"".join(
+        _encode_header(name, value)
+        for name, value in ((":event-type", event_type), (":content-type", "application/json"), (":message-type", "event"))
+    )
+    body = json.dumps(payload).encode("utf-8")
+
+    prelude = struct.pack(">II", 12 + len(headers) + len(body) + 4, len(headers))
+    message = prelude + struct.pack(">I", zlib.crc32(prelude)) + headers + body
+    return message + struct.pack(">I", zlib.crc32(message))
+
+
+def _encode_header(name, value):
+    """
+    Encodes a string header of an event stream message.
+
+    :param name: The header name.
+    :param value: The header value.
+    :return: The encoded header.
+    """
+    name = name.encode("utf-8")
+    value = value.encode("utf-8")
+    # Header value type 7 is a string with a 2-byte length
+    return struct.pack(">B", len(name)) + name + b"\x07" + struct.pack(">H", len(value)) + value
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a fake Amazon Bedrock Runtime endpoint.")
+    parser.add_argument("--port", type=int, default=8090, help="The port to listen on.")
+    parser.add_argument("--time-to-first-token-ms", type=int, default=300, help="The delay before the first chunk.")
+    parser.add_argument("--chunk-interval-ms", type=int, default=20, help="The delay between chunks.")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="The fraction of throttled requests.")
+    parser.add_argument("--retrieve-latency-ms", type=int, default=50, help="The delay of a retrieval.")
+    parser.add_argument("--recording", help="A recording to replay, see record_conversation.py.")
+    arguments = parser.parse_args()
+
+    fake_bedrock = FakeBedrock(
+        arguments.time_to_first_token_ms,
+        arguments.chunk_interval_ms,
+        throttle_rate=arguments.throttle_rate,
+        recording=Recording.load(arguments.recording) if arguments.recording else None,
+        retrieve_latency_ms=arguments.retrieve_latency_ms,
+    )
+    web.run_app(fake_bedrock.create_app(), host="127.0.0.1", port=arguments.port)
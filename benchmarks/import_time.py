@@ -0,0 +1,63 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+"""
+Measures the cold-start import time of the demo, which matters for short-lived CLI and container invocations.
+Each scenario runs in a fresh interpreter several times; the table shows the median wall-clock time, minus the
+time of an interpreter that imports nothing.
+
+The "eager" scenario imports what the demo used to import at startup, before the tool registry deferred it to
+the first invocation of the tool that needs it: boto3, LangChain's prompts, and the three tool modules. It
+leaves out dependencies that were added later, like NumPy and Pillow, so it measures only the registry's effect.
+
+Usage:
+    python benchmarks/import_time.py [--runs N]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+REPOSITORY_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCENARIOS = {
+    "interpreter": "pass",
+    "lazy (current)": "import architecture_chat_demo",
+    "eager": (
+        "import architecture_chat_demo, boto3, langchain.prompts, "
+        "audit_info_tool, best_practices_tool, joy_count_tool"
+    ),
+    "first Best_Practices_Tool use": "import architecture_chat_demo, best_practices_tool, langchain_core.prompts",
+    "first Joy_Count_Tool use": "import architecture_chat_demo, joy_count_tool, util.time_series",
+}
+
+
+def measure(code, runs):
+    """
+    Runs code in fresh interpreters and measures the wall-clock time.
+
+    :param code: The Python code to run.
+    :param runs: The number of runs.
+    :return: The median time in milliseconds.
+    """
+    timings = []
+    for _ in range(runs):
+        started_at = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], cwd=REPOSITORY_ROOT, check=True)
+        timings.append((time.perf_counter() - started_at) * 1000)
+    return statistics.median(timings)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the cold-start import time of the demo.")
+    parser.add_argument("--runs", type=int, default=7, help="The number of runs per scenario.")
+    arguments = parser.parse_args()
+
+    interpreter_ms = measure(SCENARIOS["interpreter"], arguments.runs)
+    print(f"{'Scenario':<32} {'Import time (ms)':>16}")
+    for name, code in SCENARIOS.items():
+        if name != "interpreter":
+            print(f"{name:<32} {measure(code, arguments.runs) - interpreter_ms:>16.1f}")
@@ -0,0 +1,111 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+"""
+Records a conversation with an architecture diagram against Amazon Bedrock, for the fake Bedrock endpoint to
+replay in benchmarks. The recording contains the model's responses to each query, including its tool use
+requests, the analysis of the diagram, and the knowledge base retrievals. Requests aren't recorded; the
+app builds them again when the recording is replayed.
+
+The responses are captured with botocore event hooks on the shared clients, so the conversation runs exactly
+as it does in the app, using the blocking Converse API.
+
+Usage:
+    python benchmarks/record_conversation.py --diagram fluffy-puppy-joy-generator.png --output recording.json \\
+        "What is the current joy count of the system?" "Is the current joy count good or bad?"
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+REPOSITORY_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPOSITORY_ROOT)
+
+# The recorded fields of a Converse response; the response metadata is specific to the request
+RESPONSE_FIELDS = ("output", "stopReason", "usage")
+
+
+def record_conversation(diagram_file, queries):
+    """
+    Runs a conversation with Amazon Bedrock and records the responses.
+
+    :param diagram_file: The path to the architecture diagram, relative to the repository root.
+    :param queries: The user's queries.
+    :return: The recording.
+    """
+    # Every retrieval goes to the knowledge base, and the diagram is analyzed, so the replay can serve them
+    os.environ["RETRIEVAL_CACHE_SIZE"] = "0"
+    os.environ["DIAGRAM_ANALYSIS_DIR"] = tempfile.mkdtemp(prefix="recording-analyses-")
+
+    from architecture_chat_demo import AWS_REGION, ArchitectureChatDemo
+    from util import aws_clients
+
+    demo = ArchitectureChatDemo(streaming=False, quiet=True)
+    model_responses = []
+    analysis_responses = []
+    retrievals = []
+
+    def mark_analysis_request(params, context, **kwargs):
+        # Only the diagram analysis forces the model to use a tool
+        context["is_diagram_analysis"] = "toolChoice" in params.get("toolConfig", {})
+
+    def record_model_response(parsed, context, **kwargs):
+        response = {field: parsed[field] for field in RESPONSE_FIELDS if field in parsed}
+        if context.get("is_diagram_analysis"):
+            analysis_responses.append(response)
+        else:
+            model_responses.append(response)
+
+    def mark_retrieval_query(params, context, **kwargs):
+        context["retrieval_query"] = params["retrievalQuery"]["text"]
+
+    def record_retrieval(parsed, context, **kwargs):
+        retrievals.append(
+            {"query": context["retrieval_query"], "response": {"retrievalResults": parsed["retrievalResults"]}}
+        )
+
+    runtime_events = demo.bedrock_runtime_client.meta.events
+    runtime_events.register("before-parameter-build.bedrock-runtime.Converse", mark_analysis_request)
+    runtime_events.register("after-call.bedrock-runtime.Converse", record_model_response)
+    agent_runtime_events = aws_clients.get_client("bedrock-agent-runtime", AWS_REGION).meta.events
+    agent_runtime_events.register("before-parameter-build.bedrock-agent-runtime.Retrieve", mark_retrieval_query)
+    agent_runtime_events.register("after-call.bedrock-agent-runtime.Retrieve", record_retrieval)
+
+    os.chdir(REPOSITORY_ROOT)
+    conversation = []
+    turns = []
+    for index, query in enumerate(queries):
+        first_response = len(model_responses)
+        demo.ask(conversation, query, diagram_file if index == 0 else None)
+        turns.append({"query": query, "responses": model_responses[first_response:]})
+        print(f"Recorded {len(turns[-1]['responses'])} responses to: {query}")
+
+    # Wait for the diagram analysis before closing the session
+    demo.background_executor.shutdown(wait=True)
+    demo.close()
+
+    return {
+        "diagram": diagram_file,
+        "turns": turns,
+        "diagram_analysis": analysis_responses[0] if analysis_responses else None,
+        "retrievals": retrievals,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Record a conversation with Amazon Bedrock for replay in benchmarks.")
+    parser.add_argument("--diagram", default="fluffy-puppy-joy-generator.png", help="A diagram in the demo directory.")
+    parser.add_argument("--output", required=True, help="The recording file to write.")
+    parser.add_argument("queries", nargs="+", help="The queries of the conversation.")
+    arguments = parser.parse_args()
+
+    # The conversation runs in the repository root, so resolve the output path first
+    output_file = os.path.abspath(arguments.output)
+    recording = record_conversation(f"demo/{os.path.basename(arguments.diagram)}", arguments.queries)
+    with open(output_file, "w", encoding="utf-8") as f:
+        json.dump(recording, f, indent=2, default=str)
+        f.write("\n")
+    print(f"Wrote the recording to {output_file}.")
@@ -1,9 +1,38 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: MIT-0
 
+import logging
+import math
 import os
-import boto3
-from langchain.prompts import PromptTemplate
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+from util import aws_clients
+from util.tracing import get_tracer
+
+# The search type of knowledge base retrievals
+SEARCH_TYPE = "HYBRID"
+
+# The retrieval backend, set with the RETRIEVAL_BACKEND environment variable: "knowledge_base" (default) queries
+# the Amazon Bedrock knowledge base, "local" searches an in-process index without any network calls. The local
+# index is loaded from LOCAL_RETRIEVAL_INDEX, a directory written by the ingestion pipeline (util/ingestion.py),
+# if it exists, and built from LOCAL_RETRIEVAL_DOCUMENTS, a comma-separated list of markdown files, otherwise.
+DEFAULT_RETRIEVAL_BACKEND = "knowledge_base"
+DEFAULT_LOCAL_RETRIEVAL_DOCUMENTS = "demo/best-practices-data.md"
+DEFAULT_LOCAL_RETRIEVAL_INDEX = ".index/best-practices"
+
+# Retrievals are cached by their normalized query. The defaults can be overridden with the
+# RETRIEVAL_CACHE_SIZE and RETRIEVAL_CACHE_TTL_SECONDS environment variables; a size of 0 disables the cache.
+DEFAULT_RETRIEVAL_CACHE_SIZE = 256
+DEFAULT_RETRIEVAL_CACHE_TTL_SECONDS = 3600
+
+# Optionally, a query that isn't cached can reuse the results of a cached query with a similar meaning.
+# Set RETRIEVAL_CACHE_SIMILARITY_THRESHOLD to the minimum cosine similarity of the query embeddings,
+# e.g. 0.95, to enable this. Each cache miss then costs an additional embedding call.
+DEFAULT_RETRIEVAL_CACHE_SIMILARITY_THRESHOLD = None
 
 PROMPT_TEMPLATE = """
 DOCUMENT:
@@ -44,22 +73,271 @@ def get_tool_spec():
         }
     }
 
-def retrieve(query, number_of_results=3):
+class RetrievalCache:
+    """
+    A thread-safe cache of retrieval results with a time to live and least-recently-used eviction. Entries are
+    keyed by the normalized query, the number of results and the search type. If an embedding function is given,
+    a query without an exact match can also match a cached query whose embedding is similar enough.
+    """
+
+    def __init__(self, max_size, ttl_seconds, embed=None, similarity_threshold=None):
+        """
+        :param max_size: The maximum number of cached retrievals.
+        :param ttl_seconds: The time in seconds after which a cached retrieval expires.
+        :param embed: A function that returns the embedding vector of a text, or None to only match exact queries.
+        :param similarity_threshold: The minimum cosine similarity for a near-duplicate match.
+        """
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.embed = embed
+        self.similarity_threshold = similarity_threshold
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._stats = {"hits": 0, "similar_hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+
+    @staticmethod
+    def normalize_query(query):
+        """
+        Normalizes a query, so queries that only differ in case, punctuation or whitespace share a cache entry.
+
+        :param query: The query.
+        :return: The normalized query.
+        """
+        query = unicodedata.normalize("NFKC", query).casefold()
+        query = re.sub(r"[^\w\s]", " ", query)
+        return " ".join(query.split())
+
+    def get(self, query, number_of_results, search_type):
+        """
+        Looks up the cached results of a query.
+
+        :param query: The query.
+        :param number_of_results: The number of results.
+        :param search_type: The search type.
+        :return: A tuple of the cached retrieval response, or None on a miss, and the query's embedding,
+            if one was computed, to pass on to put.
+        """
+        key = (self.normalize_query(query), number_of_results, search_type)
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry["expires_at"] <= now:
+                del self._entries[key]
+                self._stats["expirations"] += 1
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                return entry["response"], None
+
+        if self.embed is None or self.similarity_threshold is None:
+            with self._lock:
+                self._stats["misses"] += 1
+            return None, None
+
+        # Compute the embedding outside the lock, it's a call to the model. If it fails, the retrieval still
+        # works, it just can't match a similar query, and its response is cached without an embedding.
+        try:
+            embedding = self.embed(key[0])
+        except Exception as e:
+            logging.warning("Warning: Couldn't embed the query for the retrieval cache: %s", e)
+            with self._lock:
+                self._stats["misses"] += 1
+            return None, None
+
+        with self._lock:
+            best_key, best_similarity = None, self.similarity_threshold
+            for candidate_key, candidate in self._entries.items():
+                if candidate_key[1:] != key[1:] or candidate["embedding"] is None or candidate["expires_at"] <= now:
+                    continue
+                similarity = _cosine_similarity(embedding, candidate["embedding"])
+                if similarity >= best_similarity:
+                    best_key, best_similarity = candidate_key, similarity
+
+            if best_key is None:
+                self._stats["misses"] += 1
+                return None, embedding
+
+            self._entries.move_to_end(best_key)
+            self._stats["similar_hits"] += 1
+            return self._entries[best_key]["response"], embedding
+
+    def put(self, query, number_of_results, search_type, response, embedding=None):
+        """
+        Caches the results of a query, evicting the least recently used entry if the cache is full.
+
+        :param query: The query.
+        :param number_of_results: The number of results.
+        :param search_type: The search type.
+        :param response: The retrieval response.
+        :param embedding: The query's embedding returned by get, if any.
+        """
+        key = (self.normalize_query(query), number_of_results, search_type)
+
+        with self._lock:
+            self._entries[key] = {
+                "response": response,
+                "embedding": embedding,
+                "expires_at": time.monotonic() + self.ttl_seconds,
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def invalidate(self):
+        """
+        Removes all cached results, e.g. after the knowledge base was synced with new data.
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """
+        :return: The hit, miss, eviction and expiration counts, and the current number of entries.
+        """
+        with self._lock:
+            return {**self._stats, "size": len(self._entries)}
+
+
+def _cosine_similarity(a, b):
+    """
+    Computes the cosine similarity of two vectors.
+
+    :param a: The first vector.
+    :param b: The second vector.
+    :return: The cosine similarity.
+    """
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+def embed_text(text):
+    """
+    Computes the embedding of a text with an Amazon Titan text embeddings model.
+
+    :param text: The text.
+    :return: The embedding vector.
+    """
+    from util.local_retrieval import embed_text_with_titan
+
+    return embed_text_with_titan(text)
+
+
+_retrieval_cache = None
+_retrieval_cache_lock = threading.Lock()
+
+
+def get_retrieval_cache():
+    """
+    Returns the retrieval cache, creating it on first use from the environment configuration.
+
+    :return: The retrieval cache, or None if caching is disabled.
+    """
+    global _retrieval_cache
+
+    with _retrieval_cache_lock:
+        if _retrieval_cache is None:
+            max_size = int(os.getenv('RETRIEVAL_CACHE_SIZE', DEFAULT_RETRIEVAL_CACHE_SIZE))
+            if max_size <= 0:
+                return None
+
+            similarity_threshold = os.getenv(
+                'RETRIEVAL_CACHE_SIMILARITY_THRESHOLD', DEFAULT_RETRIEVAL_CACHE_SIMILARITY_THRESHOLD
+            )
+            _retrieval_cache = RetrievalCache(
+                max_size=max_size,
+                ttl_seconds=float(os.getenv('RETRIEVAL_CACHE_TTL_SECONDS', DEFAULT_RETRIEVAL_CACHE_TTL_SECONDS)),
+                embed=embed_text if similarity_threshold else None,
+                similarity_threshold=float(similarity_threshold) if similarity_threshold else None,
+            )
+        return _retrieval_cache
+
+
+def get_retrieval_cache_stats():
+    """
+    Returns the statistics of the retrieval cache.
+
+    :return: The hit, miss, eviction and expiration counts and the number of entries, or None if caching is disabled.
+    """
+    retrieval_cache = get_retrieval_cache()
+    return None if retrieval_cache is None else retrieval_cache.stats()
+
+
+def invalidate_retrieval_cache():
     """
-    Retrieves the most relevant documents from the knowledge base using the given query.
+    Removes all cached retrievals. Call this after the knowledge base was synced with new data.
+    """
+    retrieval_cache = get_retrieval_cache()
+    if retrieval_cache is not None:
+        retrieval_cache.invalidate()
+
+
+def retrieve(query, number_of_results=3, search_type=SEARCH_TYPE):
+    """
+    Retrieves the most relevant documents from the knowledge base using the given query. Results are served
+    from the retrieval cache if the same, or optionally a similar, query was retrieved recently.
 
     :param query: The query to search the knowledge base.
     :param number_of_results: The number of results to retrieve; defaults to 3.
+    :param search_type: The search type, "HYBRID" or "SEMANTIC"; defaults to "HYBRID".
+    :return: The retrieval results.
+    """
+    backend = os.getenv('RETRIEVAL_BACKEND', DEFAULT_RETRIEVAL_BACKEND)
+    if backend not in RETRIEVAL_BACKENDS:
+        raise ValueError(f"Unknown retrieval backend '{backend}', expected one of {list(RETRIEVAL_BACKENDS)}.")
+    with get_tracer().span("kb_retrieval", backend=backend, number_of_results=number_of_results) as span:
+        if backend != "knowledge_base":
+            # In-process backends are fast enough without the cache
+            response = RETRIEVAL_BACKENDS[backend](query, number_of_results, search_type)
+        else:
+            response = _retrieve_cached(query, number_of_results, search_type, span)
+        span.set(results=len(response["retrievalResults"]))
+        return response
+
+
+def _retrieve_cached(query, number_of_results, search_type, span):
+    """
+    Retrieves the most relevant documents from the knowledge base, or from the retrieval cache.
+
+    :param query: The query to search the knowledge base.
+    :param number_of_results: The number of results to retrieve.
+    :param search_type: The search type.
+    :param span: The span of the retrieval, which records whether the cache was hit.
+    :return: The retrieval results.
+    """
+    retrieval_cache = get_retrieval_cache()
+    if retrieval_cache is None:
+        span.set(cache="disabled")
+        return retrieve_from_knowledge_base(query, number_of_results, search_type)
+
+    response, embedding = retrieval_cache.get(query, number_of_results, search_type)
+    span.set(cache="miss" if response is None else "hit")
+    if response is None:
+        response = retrieve_from_knowledge_base(query, number_of_results, search_type)
+        retrieval_cache.put(query, number_of_results, search_type, response, embedding)
+    return response
+
+
+def retrieve_from_knowledge_base(query, number_of_results, search_type):
+    """
+    Retrieves the most relevant documents from the knowledge base, bypassing the cache.
+
+    :param query: The query to search the knowledge base.
+    :param number_of_results: The number of results to retrieve.
+    :param search_type: The search type.
     :return: The retrieval results.
     """
 
     aws_region = os.getenv('AWS_REGION')
     knowledge_base_id = os.getenv('KNOWLEDGE_BASE_ID')
 
-    bedrock_agent_runtime_client = boto3.client(
-        "bedrock-agent-runtime", region_name=aws_region
-    )
-    return bedrock_agent_runtime_client.retrieve(
+    # Reuse the shared client and its warm connections
+    bedrock_agent_runtime_client = aws_clients.get_client("bedrock-agent-runtime", aws_region)
+    response = bedrock_agent_runtime_client.retrieve(
         retrievalQuery= {
             'text': query
         },
@@ -67,11 +345,68 @@ def retrieve(query, number_of_results=3):
         retrievalConfiguration= {
             'vectorSearchConfiguration': {
                 'numberOfResults': number_of_results,
-                'overrideSearchType': "HYBRID"
+                'overrideSearchType': search_type
             }
         }
     )
 
+    # Only keep the results, the response metadata is specific to the request
+    return {"retrievalResults": response["retrievalResults"]}
+
+
+_local_index = None
+_local_index_mtime_ns = None
+_local_index_lock = threading.Lock()
+
+
+def get_local_index():
+    """
+    Returns the in-process index of the local documents, loading or building it on first use. An index written
+    by the ingestion pipeline is loaded again when its manifest's modification time changes, so a re-ingestion
+    is picked up without a restart.
+
+    :return: The local hybrid index.
+    """
+    global _local_index, _local_index_mtime_ns
+
+    index_dir = os.getenv('LOCAL_RETRIEVAL_INDEX', DEFAULT_LOCAL_RETRIEVAL_INDEX)
+    try:
+        mtime_ns = os.stat(os.path.join(index_dir, "manifest.json")).st_mtime_ns
+    except FileNotFoundError:
+        mtime_ns = None
+
+    with _local_index_lock:
+        if mtime_ns is not None and mtime_ns != _local_index_mtime_ns:
+            from util.local_retrieval import HybridIndex
+
+            _local_index = HybridIndex.load(index_dir)
+            _local_index_mtime_ns = mtime_ns
+        elif _local_index is None:
+            from util.local_retrieval import HybridIndex
+
+            document_paths = os.getenv('LOCAL_RETRIEVAL_DOCUMENTS', DEFAULT_LOCAL_RETRIEVAL_DOCUMENTS).split(",")
+            _local_index = HybridIndex.from_documents([path.strip() for path in document_paths if path.strip()])
+        return _local_index
+
+
+def retrieve_from_local_index(query, number_of_results, search_type):
+    """
+    Retrieves the most relevant chunks of the local documents with hybrid keyword and dense search.
+
+    :param query: The query to search the documents.
+    :param number_of_results: The number of results to retrieve.
+    :param search_type: The search type; the local index always uses hybrid search.
+    :return: The retrieval results, in the same shape as the knowledge base's results.
+    """
+    return get_local_index().retrieve(query, number_of_results)
+
+
+# The retrieval backends by name, each a function of the query, number of results and search type
+RETRIEVAL_BACKENDS = {
+    "knowledge_base": retrieve_from_knowledge_base,
+    "local": retrieve_from_local_index,
+}
+
 def get_retrieval_result_texts(retrieval_results):
     """
     Retrieves the text content from the retrieval results.
@@ -99,6 +434,9 @@ def fetch_best_practices_data(input_data):
     retrieval_results = retrieve(question)["retrievalResults"]
     document_text = get_retrieval_result_texts(retrieval_results)
 
+    # Importing LangChain takes a while, so it's deferred until the tool is first used
+    from langchain_core.prompts import PromptTemplate
+
     prompt = PromptTemplate(template=PROMPT_TEMPLATE, input_variables=["document_text", "message"])
     prompt_final = prompt.format(document_text=document_text, message=question)
 
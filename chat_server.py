@@ -0,0 +1,365 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+"""
+Hosts many concurrent conversations with architecture diagrams over HTTP. Each session has its own conversation
+history, and the model's response is streamed to the client as it arrives, over a WebSocket or as server-sent
+events (SSE).
+
+The server runs on asyncio with aiohttp. The conversation logic of the demo uses blocking boto3 calls, so each
+turn runs on a worker thread and forwards its output to the event loop; the event loop itself never blocks.
+
+Usage:
+    python chat_server.py --host 127.0.0.1 --port 8080
+
+API:
+    POST   /sessions                   {"diagram": "fluffy-puppy-joy-generator.png"} -> {"session_id": ...}
+                                       with "previous_diagram", only the changes since that revision are sent
+    POST   /sessions/{id}/messages     {"query": ...} -> a stream of server-sent events
+    GET    /sessions/{id}/ws           WebSocket; send {"query": ...}, receive one JSON event per message
+    DELETE /sessions/{id}
+    GET    /metrics                    Prometheus metrics, if TRACE_EXPORTERS includes prometheus
+
+Events are {"type": "text", "text": ...} for each chunk of the model's response, {"type": "tool_use", "tool": ...,
+"input": ...} for each tool the model uses, {"type": "turn_ended_early", "note": ...} if the turn ran out of budget,
+and finally {"type": "done", "metrics": {...}} or {"type": "error", "message": ...}.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import aclosing
+
+from aiohttp import WSMsgType, web
+
+from architecture_chat_demo import ArchitectureChatDemo
+from util.demo_print_utils import QuietOutput
+from util.tracing import PrometheusExporter, get_tracer
+
+# The maximum number of turns that run at the same time. Each running turn occupies a worker thread while it
+# waits for Amazon Bedrock; raise AWS_MAX_POOL_CONNECTIONS along with it.
+SERVER_WORKERS = int(os.getenv('SERVER_WORKERS', '64'))
+
+# The maximum number of open sessions, and the time after which an idle session is closed
+MAX_SESSIONS = int(os.getenv('MAX_SESSIONS', '1000'))
+SESSION_IDLE_SECONDS = float(os.getenv('SESSION_IDLE_SECONDS', '1800'))
+
+# All diagrams must reside in the demo directory
+DIAGRAM_DIR = "demo"
+
+
+class SessionOutput(QuietOutput):
+    """
+    Receives the output of a session's demo on its worker thread and forwards it as events to the event loop.
+    Console-only output, like the messages about calls to Amazon Bedrock, is discarded.
+    """
+
+    def __init__(self):
+        self._emit = None
+
+    def attach(self, loop, queue):
+        """
+        Forwards the events of the next turn to a queue.
+
+        :param loop: The event loop that consumes the queue.
+        :param queue: The asyncio queue of the turn's events.
+        """
+        self._emit = lambda event: loop.call_soon_threadsafe(queue.put_nowait, event)
+
+    def model_response_delta(self, text):
+        self._emit({"type": "text", "text": text})
+
+    def model_response(self, message):
+        self._emit({"type": "text", "text": message})
+
+    def tool_use(self, tool_name, input_data):
+        self._emit({"type": "tool_use", "tool": tool_name, "input": input_data})
+
+    def turn_ended_early(self, note):
+        self._emit({"type": "turn_ended_early", "note": note})
+
+
+class ChatSession:
+    """
+    A conversation with an architecture diagram. Turns of the same session run one after the other.
+    """
+
+    def __init__(self, diagram_file=None, previous_diagram_file=None):
+        """
+        :param diagram_file: The path to the architecture diagram, sent with the first query; or None.
+        :param previous_diagram_file: The path to the previous revision of the diagram, to send only the changes
+            since that revision; or None.
+        """
+        self.id = uuid.uuid4().hex
+        self.diagram_file = diagram_file
+        self.previous_diagram_file = previous_diagram_file
+        self.conversation = []
+        self.last_active = time.monotonic()
+
+        self._output = SessionOutput()
+        self._demo = ArchitectureChatDemo(streaming=True, output_sink=self._output)
+        self._lock = asyncio.Lock()
+
+    async def ask(self, query):
+        """
+        Runs a turn on a worker thread and yields its events as they arrive. If the turn fails, it's removed
+        from the conversation, so the session can continue with the next query.
+
+        :param query: The user's query.
+        :return: An async generator of the turn's events, ending with a "done" or "error" event.
+        """
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            queue = asyncio.Queue()
+            self._output.attach(loop, queue)
+            self.last_active = time.monotonic()
+
+            conversation_length = len(self.conversation)
+            diagram_file, self.diagram_file = self.diagram_file, None
+            previous_diagram_file = self.previous_diagram_file if diagram_file else None
+            turn = loop.run_in_executor(
+                None, self._demo.ask, self.conversation, query, diagram_file, previous_diagram_file
+            )
+            # A None event marks the end of the turn, after all of its output has been queued
+            turn.add_done_callback(lambda _: queue.put_nowait(None))
+
+            try:
+                while True:
+                    event = await queue.get()
+                    if event is None:
+                        break
+                    yield event
+            finally:
+                # If the client disconnects, the turn still runs to its end before the next turn may start
+                error = (await asyncio.gather(turn, return_exceptions=True))[0]
+                self.last_active = time.monotonic()
+                if isinstance(error, Exception):
+                    logging.error("Turn of session %s failed: %s", self.id, error)
+                    del self.conversation[conversation_length:]
+                    self.diagram_file = self.diagram_file or diagram_file
+
+            if isinstance(error, Exception):
+                yield {"type": "error", "message": str(error)}
+            else:
+                yield {"type": "done", "metrics": self._demo.get_turn_metrics()}
+
+    def close(self):
+        """
+        Shuts down the session's thread pools; blocks until running tools have finished.
+        """
+        self._demo.close()
+
+
+class ChatServer:
+    """
+    The HTTP server that hosts the chat sessions.
+    """
+
+    def __init__(self, max_sessions=MAX_SESSIONS, session_idle_seconds=SESSION_IDLE_SECONDS):
+        """
+        :param max_sessions: The maximum number of open sessions.
+        :param session_idle_seconds: The time after which an idle session is closed.
+        """
+        self.max_sessions = max_sessions
+        self.session_idle_seconds = session_idle_seconds
+        self.sessions = {}
+
+    def create_app(self):
+        """
+        Creates the aiohttp application with the API routes.
+
+        :return: The aiohttp application.
+        """
+        app = web.Application()
+        app.add_routes(
+            [
+                web.post("/sessions", self.create_session),
+                web.delete("/sessions/{session_id}", self.delete_session),
+                web.post("/sessions/{session_id}/messages", self.post_message),
+                web.get("/sessions/{session_id}/ws", self.websocket),
+                web.get("/metrics", self.metrics),
+            ]
+        )
+        app.on_startup.append(self._on_startup)
+        app.on_cleanup.append(self._on_cleanup)
+        return app
+
+    async def create_session(self, request):
+        """
+        Creates a session, optionally with the architecture diagram to chat with.
+
+        :param request: The request; its optional JSON body has the file name of a diagram in the demo directory,
+            and optionally the file name of the diagram's previous revision.
+        :return: The response with the session ID.
+        """
+        if len(self.sessions) >= self.max_sessions:
+            return _error_response(503, "The server has reached its maximum number of sessions.")
+
+        body = await request.json() if request.can_read_body else {}
+        diagram_files = {}
+        for field in ("diagram", "previous_diagram"):
+            if body.get(field):
+                # Only the file name is used, so clients can't read files outside the demo directory
+                diagram_files[field] = os.path.join(DIAGRAM_DIR, os.path.basename(body[field]))
+                if not os.path.isfile(diagram_files[field]):
+                    return _error_response(404, f"The diagram '{body[field]}' does not exist.")
+        if "previous_diagram" in diagram_files and "diagram" not in diagram_files:
+            return _error_response(400, "A previous diagram requires a diagram.")
+
+        # Creating a session creates its Bedrock client and thread pools, which would block the event loop
+        loop = asyncio.get_running_loop()
+        session = await loop.run_in_executor(
+            None, ChatSession, diagram_files.get("diagram"), diagram_files.get("previous_diagram")
+        )
+        if len(self.sessions) >= self.max_sessions:
+            # Other sessions were created in the meantime
+            await loop.run_in_executor(None, session.close)
+            return _error_response(503, "The server has reached its maximum number of sessions.")
+        self.sessions[session.id] = session
+        return web.json_response({"session_id": session.id}, status=201)
+
+    async def delete_session(self, request):
+        """
+        Closes a session.
+
+        :param request: The request.
+        :return: An empty response.
+        """
+        session = self.sessions.pop(request.match_info["session_id"], None)
+        if session is None:
+            return _error_response(404, "The session does not exist.")
+        await asyncio.get_running_loop().run_in_executor(None, session.close)
+        return web.Response(status=204)
+
+    async def post_message(self, request):
+        """
+        Sends a query to a session and streams the turn's events as server-sent events.
+
+        :param request: The request; its JSON body has the query.
+        :return: The event stream response.
+        """
+        session = self.sessions.get(request.match_info["session_id"])
+        if session is None:
+            return _error_response(404, "The session does not exist.")
+        body = await request.json()
+        if not body.get("query"):
+            return _error_response(400, "The request has no query.")
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        await response.prepare(request)
+        async with aclosing(session.ask(body["query"])) as events:
+            async for event in events:
+                await response.write(f"event: {event['type']}\ndata: {_dumps(event)}\n\n".encode("utf-8"))
+        await response.write_eof()
+        return response
+
+    async def websocket(self, request):
+        """
+        Connects a WebSocket to a session. Each message from the client is a query; the turn's events are sent
+        back as they arrive.
+
+        :param request: The request.
+        :return: The WebSocket response.
+        """
+        session = self.sessions.get(request.match_info["session_id"])
+        if session is None:
+            return _error_response(404, "The session does not exist.")
+
+        ws = web.WebSocketResponse(heartbeat=30)
+        await ws.prepare(request)
+        async for message in ws:
+            if message.type != WSMsgType.TEXT:
+                continue
+            query = message.json().get("query")
+            if not query:
+                await ws.send_json({"type": "error", "message": "The message has no query."})
+                continue
+            async with aclosing(session.ask(query)) as events:
+                async for event in events:
+                    await ws.send_json(event, dumps=_dumps)
+        return ws
+
+    async def metrics(self, request):
+        """
+        Returns the metrics of the traced turns, model calls, and tool invocations of all sessions.
+
+        :param request: The request.
+        :return: The metrics in the Prometheus text format.
+        """
+        exporter = get_tracer().get_exporter(PrometheusExporter)
+        if exporter is None:
+            return _error_response(404, "Metrics are disabled. Add prometheus to TRACE_EXPORTERS to enable them.")
+        return web.Response(text=exporter.render(), content_type="text/plain", charset="utf-8")
+
+    async def _on_startup(self, app):
+        """
+        Sets up the worker threads for blocking calls, and starts closing idle sessions.
+
+        :param app: The aiohttp application.
+        """
+        # Blocking calls run on a bounded pool of worker threads
+        asyncio.get_running_loop().set_default_executor(
+            ThreadPoolExecutor(max_workers=SERVER_WORKERS, thread_name_prefix="turn")
+        )
+        app["session_reaper"] = asyncio.create_task(self._close_idle_sessions())
+
+    async def _on_cleanup(self, app):
+        """
+        Closes all sessions when the server shuts down.
+
+        :param app: The aiohttp application.
+        """
+        app["session_reaper"].cancel()
+        loop = asyncio.get_running_loop()
+        for session in list(self.sessions.values()):
+            await loop.run_in_executor(None, session.close)
+        self.sessions.clear()
+
+    async def _close_idle_sessions(self):
+        """
+        Periodically closes the sessions that have been idle for longer than the idle timeout.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(min(60, self.session_idle_seconds))
+            idle_before = time.monotonic() - self.session_idle_seconds
+            for session_id, session in list(self.sessions.items()):
+                if session.last_active < idle_before:
+                    logging.info("Closing idle session %s.", session_id)
+                    del self.sessions[session_id]
+                    await loop.run_in_executor(None, session.close)
+
+
+def _dumps(data):
+    """
+    Serializes an event as JSON. Tool inputs may contain values that aren't JSON types, like decimals.
+
+    :param data: The event.
+    :return: The JSON string.
+    """
+    return json.dumps(data, default=str)
+
+
+def _error_response(status, message):
+    """
+    Creates a JSON error response in the shape the tools use for errors.
+
+    :param status: The HTTP status code.
+    :param message: The error message.
+    :return: The response.
+    """
+    return web.json_response({"error": "true", "message": message}, status=status)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve concurrent conversations with architecture diagrams.")
+    parser.add_argument("--host", default="127.0.0.1", help="The interface to listen on.")
+    parser.add_argument("--port", type=int, default=8080, help="The port to listen on.")
+    arguments = parser.parse_args()
+
+    web.run_app(ChatServer().create_app(), host=arguments.host, port=arguments.port)
@@ -2,6 +2,15 @@
 # SPDX-License-Identifier: MIT-0
 
 import json
+import threading
+
+# The joy count API, which in this demo is a JSON file with the current joy count,
+# and a CSV file with the joy count history
+JOY_COUNT_FILE = "demo/joy-count.json"
+JOY_COUNT_HISTORY_FILE = "demo/joy-count-history.csv"
+
+# The aggregates returned for a window if the model doesn't request specific ones
+DEFAULT_AGGREGATES = ["count", "min", "max", "mean", "p50", "p90", "first", "last", "trend_per_hour"]
 
 def get_tool_spec():
     """
@@ -14,28 +23,79 @@ def get_tool_spec():
     return {
         "toolSpec": {
             "name": "Joy_Count_Tool",
-            "description": "Get the current joy count for the system.",
+            "description": "Get the current joy count for the system. To evaluate trends, request a time window "
+                           "to get aggregates of the joy count history over the window instead.",
             "inputSchema": {
                 "json": {
                     "type": "object",
-                    "properties": {},
+                    "properties": {
+                        "window_hours": {
+                            "type": "number",
+                            "description": "Optional. Aggregate the joy count over the last number of hours, "
+                                           "e.g. 24 for the last day.",
+                        },
+                        "aggregates": {
+                            "type": "array",
+                            "items": {
+                                "type": "string",
+                                "enum": ["count", "min", "max", "mean", "p50", "p90", "p95", "p99",
+                                         "first", "last", "trend_per_hour"],
+                            },
+                            "description": "Optional. The aggregates to compute over the window; "
+                                           "trend_per_hour is the average change of the joy count per hour.",
+                        },
+                    },
                 }
             },
         }
     }
 
 
-def fetch_joy_count_data():
+_joy_count_history = None
+_joy_count_history_lock = threading.Lock()
+
+
+def get_joy_count_history():
+    """
+    Returns the joy count history, creating it on first use.
+
+    :return: The joy count time series.
+    """
+    global _joy_count_history
+
+    with _joy_count_history_lock:
+        if _joy_count_history is None:
+            from util.time_series import TimeSeries
+
+            _joy_count_history = TimeSeries(JOY_COUNT_HISTORY_FILE, "joy_count")
+        return _joy_count_history
+
+
+def fetch_joy_count_data(input_data=None):
     """
     Fetches joy count data for the system using the joy count API
     (which in this demo is the demo/joy-count.json file).
+    If a time window is requested, aggregates the joy count history over the window instead
+    (which in this demo is the demo/joy-count-history.csv file).
     Returns the joy count data or an error message if the request fails.
 
+    :param input_data: The input data, optionally containing the window in hours and the aggregates.
     :return: The joy count data or an error message.
     """
+    input_data = input_data or {}
+
+    if input_data.get("window_hours") is not None:
+        try:
+            return {
+                "joy-count-window": get_joy_count_history().aggregate(
+                    float(input_data["window_hours"]), input_data.get("aggregates") or DEFAULT_AGGREGATES
+                )
+            }
+        except ValueError as e:
+            return {"error": "true", "message": str(e)}
 
     # open json file joy-count.json
-    with open("demo/joy-count.json", "r") as f:
+    with open(JOY_COUNT_FILE, "r") as f:
         joy_count_data = json.load(f)
 
     return joy_count_data
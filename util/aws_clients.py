@@ -0,0 +1,85 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import logging
+import os
+import threading
+
+# The default maximum number of pooled connections per client, overridden by AWS_MAX_POOL_CONNECTIONS.
+# Every concurrent request, e.g. from the tool threads or concurrent sessions, needs its own connection;
+# beyond this, requests wait for a free one.
+DEFAULT_MAX_POOL_CONNECTIONS = 50
+
+_clients = {}
+_clients_lock = threading.Lock()
+_session = None
+
+
+def get_client(service_name, region_name=None, max_attempts=None):
+    """
+    Returns the process-wide client for an AWS service and Region, creating it on first use. Clients are
+    thread-safe, so all sessions and tool threads share the same client and its pool of warm connections.
+
+    :param service_name: The name of the AWS service, e.g. "bedrock-runtime".
+    :param region_name: The AWS Region; defaults to the AWS_REGION environment variable.
+    :param max_attempts: The maximum number of attempts of the SDK's built-in retries, e.g. 1 for callers that
+        retry themselves; defaults to the SDK's configuration.
+    :return: The boto3 client.
+    """
+    if region_name is None:
+        region_name = os.getenv('AWS_REGION')
+
+    key = (service_name, region_name, max_attempts)
+    client = _clients.get(key)
+    if client is not None:
+        return client
+
+    with _clients_lock:
+        # Another thread may have created the client while this one was waiting for the lock
+        client = _clients.get(key)
+        if client is None:
+            client = _create_client(service_name, region_name, max_attempts)
+            _clients[key] = client
+        return client
+
+
+def clear_clients():
+    """
+    Closes and forgets all cached clients, e.g. after the credentials changed.
+    """
+    with _clients_lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
+
+
+def _create_client(service_name, region_name, max_attempts=None):
+    """
+    Creates a client with the configured connection pool. Must be called with the lock held, since creating
+    clients from a shared boto3 session isn't thread-safe. The configuration is read from the environment
+    here rather than at import time, so values from the .env file are picked up.
+
+    :param service_name: The name of the AWS service.
+    :param region_name: The AWS Region.
+    :param max_attempts: The maximum number of attempts of the SDK's built-in retries, or None for the default.
+    :return: The boto3 client.
+    """
+    global _session
+
+    import boto3
+    from botocore.config import Config
+
+    if _session is None:
+        _session = boto3.session.Session()
+
+    max_pool_connections = int(os.getenv('AWS_MAX_POOL_CONNECTIONS', DEFAULT_MAX_POOL_CONNECTIONS))
+
+    # Keep idle pooled connections alive, so short calls don't pay for a new TLS handshake
+    tcp_keepalive = os.getenv('AWS_TCP_KEEPALIVE', 'true').lower() == 'true'
+
+    config = Config(max_pool_connections=max_pool_connections, tcp_keepalive=tcp_keepalive)
+    if max_attempts is not None:
+        config = config.merge(Config(retries={"mode": "standard", "total_max_attempts": max_attempts}))
+
+    logging.debug("Creating %s client in Region %s.", service_name, region_name)
+    return _session.client(service_name, region_name=region_name, config=config)
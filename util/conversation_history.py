@@ -0,0 +1,270 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import hashlib
+import io
+import json
+import logging
+import threading
+
+# Rough number of characters per token, used to estimate the size of text content
+CHARS_PER_TOKEN = 4
+
+# Images are billed by their pixel count (width * height / 750 tokens), and the model
+# downscales anything larger than about 1600 tokens
+MAX_IMAGE_TOKENS = 1600
+
+# Number of characters of a collapsed tool result kept in the history
+COLLAPSED_TOOL_RESULT_CHARS = 200
+
+# Number of characters of each question and answer kept in the rolling summary
+SUMMARY_SNIPPET_CHARS = 300
+
+
+def image_hash(image_bytes):
+    """
+    Returns the content hash used to identify an image.
+
+    :param image_bytes: The image bytes.
+    :return: The SHA-256 hex digest of the image bytes.
+    """
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def is_user_query(message):
+    """
+    Checks whether a message starts a new turn, i.e. is a user message that isn't a tool result.
+
+    :param message: The message to check.
+    :return: True if the message is a user query.
+    """
+    return message["role"] == "user" and not any("toolResult" in block for block in message["content"])
+
+
+def split_turns(conversation):
+    """
+    Splits the conversation into turns. Each turn starts with a user query and contains all following messages
+    up to the next user query, so a tool use request and its tool result always end up in the same turn.
+
+    :param conversation: The conversation history.
+    :return: The list of turns, each a list of messages.
+    """
+    turns = []
+    for message in conversation:
+        if is_user_query(message) or not turns:
+            turns.append([])
+        turns[-1].append(message)
+    return turns
+
+
+class HistoryManager:
+    """
+    Compacts the conversation history before it's sent to the model, so the payload and input tokens
+    don't grow with every turn. The full conversation is kept unchanged; compaction works on a copy.
+
+    Compaction keeps the toolUse/toolResult pairing intact: tool results are shortened but never removed
+    on their own, and whole turns are dropped from the start of the history only.
+    """
+
+    def __init__(self, token_budget, image_turns=1, tool_result_turns=1, min_recent_turns=2):
+        """
+        :param token_budget: The estimated number of tokens the compacted history should stay within.
+        :param image_turns: The number of most recent turns in which images are sent as is. Older images
+            are replaced with their description, once one has been registered.
+        :param tool_result_turns: The number of most recent turns in which tool results are sent in full.
+        :param min_recent_turns: The number of most recent turns that are never dropped from the history.
+        """
+        self.token_budget = token_budget
+        self.image_turns = image_turns
+        self.tool_result_turns = tool_result_turns
+        self.min_recent_turns = min_recent_turns
+
+        self._lock = threading.Lock()
+        self._image_descriptions = {}
+        self._image_tokens = {}
+
+    def set_image_description(self, image_bytes, description):
+        """
+        Registers the text description used in place of an image once the image is old enough.
+
+        :param image_bytes: The image bytes.
+        :param description: The text description of the image.
+        """
+        with self._lock:
+            self._image_descriptions[image_hash(image_bytes)] = description
+
+    def get_image_description(self, image_bytes):
+        """
+        :param image_bytes: The image bytes.
+        :return: The registered description of the image, or None if there is none yet.
+        """
+        with self._lock:
+            return self._image_descriptions.get(image_hash(image_bytes))
+
+    def prepare(self, conversation):
+        """
+        Returns the compacted version of the conversation to send to the model.
+
+        :param conversation: The full conversation history.
+        :return: The compacted conversation.
+        """
+        turns = split_turns(conversation)
+
+        compacted_turns = []
+        for turns_ago, turn in zip(range(len(turns) - 1, -1, -1), turns):
+            compacted_turns.append(
+                [
+                    self._compact_message(
+                        message,
+                        replace_images=turns_ago >= self.image_turns,
+                        collapse_tool_results=turns_ago >= self.tool_result_turns,
+                    )
+                    for message in turn
+                ]
+            )
+
+        # Drop the oldest turns until the history, including the summary of the dropped turns and the content
+        # carried over from them, fits the token budget
+        turn_tokens = [self.estimate_tokens(turn) for turn in compacted_turns]
+        kept_tokens = sum(turn_tokens)
+        dropped_turns = []
+        carried_blocks, summary_lines = [], []
+        while len(compacted_turns) > self.min_recent_turns:
+            summary_tokens = 0
+            if dropped_turns:
+                summary_tokens = self.estimate_tokens([{"content": self._summary_content(carried_blocks, summary_lines)}])
+            if kept_tokens + summary_tokens <= self.token_budget:
+                break
+            dropped_turns.append(turns[len(dropped_turns)])
+            self._summarize_turn(dropped_turns[-1], carried_blocks, summary_lines)
+            compacted_turns.pop(0)
+            kept_tokens -= turn_tokens.pop(0)
+
+        if dropped_turns:
+            logging.debug("Dropped %d turns from the history sent to the model.", len(dropped_turns))
+            first_message = compacted_turns[0][0]
+            compacted_turns[0][0] = {
+                **first_message,
+                "content": self._summary_content(carried_blocks, summary_lines) + first_message["content"],
+            }
+
+        return [message for turn in compacted_turns for message in turn]
+
+    def estimate_tokens(self, messages):
+        """
+        Estimates the number of input tokens of the given messages.
+
+        :param messages: The messages.
+        :return: The estimated number of tokens.
+        """
+        tokens = 0
+        for message in messages:
+            for block in message["content"]:
+                if "image" in block:
+                    tokens += self._estimate_image_tokens(block["image"]["source"]["bytes"])
+                elif "text" in block:
+                    tokens += len(block["text"]) // CHARS_PER_TOKEN
+                else:
+                    tokens += len(json.dumps(block, default=str)) // CHARS_PER_TOKEN
+        return tokens
+
+    def _estimate_image_tokens(self, image_bytes):
+        """
+        Estimates the number of tokens of an image from its dimensions.
+
+        :param image_bytes: The image bytes.
+        :return: The estimated number of tokens.
+        """
+        key = image_hash(image_bytes)
+        with self._lock:
+            if key in self._image_tokens:
+                return self._image_tokens[key]
+
+        try:
+            from PIL import Image
+
+            # Opening an image only reads its header, the pixels aren't decoded
+            with Image.open(io.BytesIO(image_bytes)) as image:
+                width, height = image.size
+            tokens = min(MAX_IMAGE_TOKENS, width * height // 750)
+        except Exception:
+            tokens = MAX_IMAGE_TOKENS
+
+        with self._lock:
+            self._image_tokens[key] = tokens
+        return tokens
+
+    def _compact_message(self, message, replace_images, collapse_tool_results):
+        """
+        Returns a compacted copy of a message; the original message is left unchanged.
+
+        :param message: The message.
+        :param replace_images: Whether to replace images with their description.
+        :param collapse_tool_results: Whether to shorten tool results.
+        :return: The compacted message.
+        """
+        content = []
+        for block in message["content"]:
+            if replace_images and "image" in block:
+                description = self.get_image_description(block["image"]["source"]["bytes"])
+                if description is not None:
+                    block = {"text": f"[Architecture diagram, shown earlier in the conversation: {description}]"}
+            elif collapse_tool_results and "toolResult" in block:
+                block = {"toolResult": self._collapse_tool_result(block["toolResult"])}
+            content.append(block)
+        return {**message, "content": content}
+
+    @staticmethod
+    def _collapse_tool_result(tool_result):
+        """
+        Shortens a tool result that the model has already used to answer an earlier query.
+
+        :param tool_result: The tool result.
+        :return: The shortened tool result with the same tool use ID.
+        """
+        result_text = json.dumps(tool_result["content"], default=str)
+        if len(result_text) <= COLLAPSED_TOOL_RESULT_CHARS:
+            return tool_result
+        return {
+            **tool_result,
+            "content": [
+                {"text": f"[Earlier tool result, shortened: {result_text[:COLLAPSED_TOOL_RESULT_CHARS]}...]"}
+            ],
+        }
+
+    def _summarize_turn(self, turn, carried_blocks, summary_lines):
+        """
+        Adds a dropped turn to the summary. Images are carried over as their description or, if there is none,
+        as the image itself, and the text blocks that come with a query, like a draw.io diagram converted to
+        text, are carried over verbatim, so the model doesn't lose the architecture diagram.
+
+        :param turn: The dropped turn.
+        :param carried_blocks: The content blocks carried over from the dropped turns; extended in place.
+        :param summary_lines: The lines of the summary; extended in place.
+        """
+        for message in turn:
+            for block in message["content"]:
+                if "image" in block:
+                    description = self.get_image_description(block["image"]["source"]["bytes"])
+                    if description is None:
+                        carried_blocks.append(block)
+                    else:
+                        summary_lines.append(f"- Architecture diagram: {description}")
+
+        # The query is the last text block of its message; the text blocks before it describe the diagram
+        text_blocks = [block for block in turn[0]["content"] if "text" in block]
+        carried_blocks.extend(text_blocks[:-1])
+        question = text_blocks[-1]["text"] if text_blocks else ""
+        answer = " ".join(block["text"] for block in turn[-1]["content"] if "text" in block)
+        summary_lines.append(f"- User: {question[:SUMMARY_SNIPPET_CHARS]}")
+        if turn[-1]["role"] == "assistant" and answer:
+            summary_lines.append(f"  Assistant: {answer[:SUMMARY_SNIPPET_CHARS]}")
+
+    @staticmethod
+    def _summary_content(carried_blocks, summary_lines):
+        """
+        :param carried_blocks: The content blocks carried over from the dropped turns.
+        :param summary_lines: The lines of the summary.
+        :return: The content blocks added to the first user query that is still sent.
+        """
+        return carried_blocks + [{"text": "Summary of the earlier conversation:\n" + "\n".join(summary_lines)}]
@@ -1,6 +1,29 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: MIT-0
 
+# The sample queries shown in the header, also the default questions of the batch runner
+SAMPLE_QUERIES = [
+    "List the AWS Services used in the architecture diagram by official AWS name and excluding any sub-titles.",
+    "What are the recommended strategies for unit testing this architecture?",
+    "How well does this architecture adhere to the AWS Well Architected Framework?",
+    "What improvements should be made to the resiliency of this architecture?",
+    "Convert the data flow from this architecture into a Mermaid formatted sequence diagram.",
+    "What are the quotas or limits in this architecture?",
+    "What is the current joy count of the system?",
+    "Is the current joy count good or bad?",
+    "Can you generate the Cloudformation/CDK/Terraform code to provision this architecture?",
+]
+
+
+class QuietOutput:
+    """
+    Discards everything the demo would log to the console, for sessions that run without one.
+    """
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
 def header():
     """
     Logs the welcome message and usage guide for the demo.
@@ -17,15 +40,8 @@ def header():
     print("sample diagram 'fluffy-puppy-joy-generator.png' to start.")
     print("")
     print("Sample queries:")
-    print("- List the AWS Services used in the architecture diagram by official AWS name and excluding any sub-titles.")
-    print("- What are the recommended strategies for unit testing this architecture?")
-    print("- How well does this architecture adhere to the AWS Well Architected Framework?")
-    print("- What improvements should be made to the resiliency of this architecture?")
-    print("- Convert the data flow from this architecture into a Mermaid formatted sequence diagram.")
-    print("- What are the quotas or limits in this architecture?")
-    print("- What is the current joy count of the system?")
-    print("- Is the current joy count good or bad?")
-    print("- Can you generate the Cloudformation/CDK/Terraform code to provision this architecture?")
+    for query in SAMPLE_QUERIES:
+        print(f"- {query}")
     print("")
     print("To exit the program, simply type 'x' and press Enter.")
     print("")
@@ -48,13 +64,27 @@ def footer():
     separator("=")
 
 
-def call_to_bedrock(conversation):
+def session_started(session_id, resumed_turns=None):
+    """
+    Logs the ID of the session, and how to resume it.
+
+    :param session_id: The ID of the session.
+    :param resumed_turns: The number of turns of a resumed session, or None for a new session.
+    """
+    if resumed_turns is not None:
+        print(f"\033[0;90mResumed session {session_id} with {resumed_turns} turns.\033[0m")
+    else:
+        print(f"\033[0;90mSession {session_id}. To continue it later, run: "
+              f"python architecture_chat_demo.py --resume {session_id}\033[0m")
+
+
+def call_to_bedrock(returns_tool_results):
     """
-    Logs information about the call to Amazon Bedrock.
+    Logs information about the call to Amazon Bedrock. Called by the console trace exporter when the call starts.
 
-    :param conversation: The conversation history.
+    :param returns_tool_results: Whether the call returns tool results to the model, rather than sending a query.
     """
-    if "toolResult" in conversation[-1]["content"][0]:
+    if returns_tool_results:
         print("\033[0;90mReturning the tool response(s) to the model...\033[0m")
     else:
         print("\033[0;90mSending the query to the model...\033[0m")
@@ -80,6 +110,79 @@ def model_response(message):
     print(message)
 
 
+def model_response_start():
+    """
+    Logs the start of a streamed model response.
+    """
+    print("\033[0;90mThe model's response:\033[0m")
+
+
+def model_response_delta(text):
+    """
+    Logs a chunk of a streamed model response as soon as it arrives.
+
+    :param text: The text chunk of the model's response.
+    """
+    print(text, end="", flush=True)
+
+
+def model_response_end():
+    """
+    Logs the end of a streamed model response.
+    """
+    print("")
+
+
+def turn_latency(time_to_first_token_ms, total_latency_ms):
+    """
+    Logs the latency of a user turn. Called by the console trace exporter when the turn ends.
+
+    :param time_to_first_token_ms: The time until the first token arrived in milliseconds, or None if no token arrived.
+    :param total_latency_ms: The total latency of the turn in milliseconds.
+    """
+    time_to_first_token = "n/a" if time_to_first_token_ms is None else f"{time_to_first_token_ms} ms"
+    print(f"\033[0;90mTime to first token: {time_to_first_token}, total latency: {total_latency_ms} ms\033[0m")
+
+
+def turn_usage(input_tokens, output_tokens, cache_read_input_tokens, cache_write_input_tokens):
+    """
+    Logs the token usage of a user turn across all of its model calls. Called by the console trace exporter
+    when the turn ends.
+
+    :param input_tokens: The number of input tokens that were neither read from nor written to the prompt cache.
+    :param output_tokens: The number of output tokens.
+    :param cache_read_input_tokens: The number of input tokens read from the prompt cache.
+    :param cache_write_input_tokens: The number of input tokens written to the prompt cache.
+    """
+    print(
+        f"\033[0;90mTokens: {input_tokens} input, {cache_read_input_tokens} read from cache, "
+        f"{cache_write_input_tokens} written to cache, {output_tokens} output\033[0m"
+    )
+
+
+def turn_ended_early(note):
+    """
+    Logs that a turn ended before the model's final response.
+
+    :param note: The explanation shown to the user.
+    """
+    print(f"\033[0;33m{note}\033[0m")
+
+
+def span_finished(name, duration_ms, status, attributes):
+    """
+    Logs a finished span of the trace, with its duration and attributes.
+
+    :param name: The name of the traced operation.
+    :param duration_ms: The duration of the operation in milliseconds.
+    :param status: "ok", or "error" if the operation failed.
+    :param attributes: The span's attributes.
+    """
+    details = ", ".join(f"{key}={value}" for key, value in attributes.items())
+    color = "\033[0;90m" if status == "ok" else "\033[0;33m"
+    print(f"{color}[trace] {name} {duration_ms:.0f} ms {status}: {details}\033[0m")
+
+
 def separator(char="-"):
     """
     Logs a separator line.
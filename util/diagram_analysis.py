@@ -0,0 +1,302 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+"""
+Structured analyses of architecture diagrams: the diagram's services, the connections between them, the data
+flow, and notes. The model records an analysis by calling a tool with a fixed input schema, so the result is
+always valid JSON.
+
+Analyses are stored on disk by the hash of the diagram file and the ID of the model that made them. A new
+session on a diagram that has already been analyzed sends the analysis as text instead of the diagram, so
+the model doesn't need to look at the image again. The store also records the findings of each diagram's
+reviews, the questions and the model's answers, so a review of the diagram's next revision can build on them.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+# Increment when the prompt or the schema changes, to invalidate the stored analyses
+ANALYSIS_VERSION = 1
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+ANALYSIS_TOOL_NAME = "Record_Diagram_Analysis"
+
+ANALYSIS_PROMPT = """
+Analyze this architecture diagram so that someone who can't see it can answer detailed questions about it.
+Record every component with its exact label, its AWS service, and the group or container it belongs to, and
+every connection with its direction and label. Describe the data flow step by step, and add notes for anything
+else the diagram shows, like titles, legends, or annotations. Don't add recommendations.
+Record the analysis with the Record_Diagram_Analysis tool.
+"""
+
+ANALYSIS_TOOL_CONFIG = {
+    "tools": [
+        {
+            "toolSpec": {
+                "name": ANALYSIS_TOOL_NAME,
+                "description": "Records the structured analysis of an architecture diagram.",
+                "inputSchema": {
+                    "json": {
+                        "type": "object",
+                        "properties": {
+                            "title": {"type": "string", "description": "The title of the diagram or system."},
+                            "summary": {"type": "string", "description": "What the architecture does, in 1-3 sentences."},
+                            "services": {
+                                "type": "array",
+                                "description": "The components of the diagram.",
+                                "items": {
+                                    "type": "object",
+                                    "properties": {
+                                        "label": {"type": "string", "description": "The exact label in the diagram."},
+                                        "service": {"type": "string", "description": "The official AWS service name."},
+                                        "group": {"type": "string", "description": "The enclosing group, if any."},
+                                    },
+                                    "required": ["label"],
+                                },
+                            },
+                            "edges": {
+                                "type": "array",
+                                "description": "The connections between the components.",
+                                "items": {
+                                    "type": "object",
+                                    "properties": {
+                                        "source": {"type": "string", "description": "The label of the source."},
+                                        "target": {"type": "string", "description": "The label of the target."},
+                                        "label": {"type": "string", "description": "The label of the connection."},
+                                    },
+                                    "required": ["source", "target"],
+                                },
+                            },
+                            "data_flow": {
+                                "type": "array",
+                                "description": "The steps of the data flow, in order.",
+                                "items": {"type": "string"},
+                            },
+                            "notes": {
+                                "type": "array",
+                                "description": "Anything else the diagram shows.",
+                                "items": {"type": "string"},
+                            },
+                        },
+                        "required": ["title", "summary", "services", "edges"],
+                    }
+                },
+            }
+        }
+    ],
+    "toolChoice": {"tool": {"name": ANALYSIS_TOOL_NAME}},
+}
+
+
+def diagram_hash(diagram_file):
+    """
+    :param diagram_file: The path to the diagram file.
+    :return: The SHA-256 hash of the file's content.
+    """
+    with open(diagram_file, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def parse_analysis_response(response):
+    """
+    Extracts the analysis from the model's response to a request with the ANALYSIS_TOOL_CONFIG.
+
+    :param response: The Converse response.
+    :return: The analysis, a dict with the title, summary, services, edges, data flow, and notes.
+    :raises ValueError: If the response doesn't contain an analysis.
+    """
+    for block in response["output"]["message"]["content"]:
+        if "toolUse" in block and block["toolUse"]["name"] == ANALYSIS_TOOL_NAME:
+            analysis = block["toolUse"]["input"]
+            if not isinstance(analysis, dict):
+                break
+            return {
+                "title": analysis.get("title", ""),
+                "summary": analysis.get("summary", ""),
+                "services": list(analysis.get("services", [])),
+                "edges": list(analysis.get("edges", [])),
+                "data_flow": list(analysis.get("data_flow", [])),
+                "notes": list(analysis.get("notes", [])),
+            }
+    raise ValueError("The model's response doesn't contain a diagram analysis.")
+
+
+def to_text(analysis, diagram_file=None):
+    """
+    Serializes an analysis as compact text for the model.
+
+    :param analysis: The analysis.
+    :param diagram_file: The path to the diagram, mentioned in the text; or None.
+    :return: The text representation of the analysis.
+    """
+    lines = []
+    if diagram_file:
+        lines.append(f"Architecture diagram {diagram_file} (analyzed earlier, converted to text):")
+    if analysis["title"]:
+        lines.append(f'Title: "{analysis["title"]}"')
+    if analysis["summary"]:
+        lines.append(f"Summary: {analysis['summary']}")
+
+    if analysis["services"]:
+        lines.append("Components:")
+        for service in analysis["services"]:
+            details = [detail for detail in (service.get("service"), service.get("group") and f"in {service['group']}") if detail]
+            suffix = f" ({', '.join(details)})" if details else ""
+            lines.append(f'- "{service.get("label", "")}"{suffix}')
+
+    if analysis["edges"]:
+        lines.append("Connections:")
+        for edge in analysis["edges"]:
+            label = f": {edge['label']}" if edge.get("label") else ""
+            lines.append(f'- "{edge.get("source", "")}" -> "{edge.get("target", "")}"{label}')
+
+    if analysis["data_flow"]:
+        lines.append("Data flow:")
+        lines.extend(f"{index}. {step}" for index, step in enumerate(analysis["data_flow"], start=1))
+
+    if analysis["notes"]:
+        lines.append("Notes:")
+        lines.extend(f"- {note}" for note in analysis["notes"])
+
+    return "\n".join(lines)
+
+
+class DiagramAnalysisStore:
+    """
+    A persistent, content-addressed store of diagram analyses. Each analysis is a JSON file named after the
+    hash of the diagram and the model ID, so analyses survive restarts and are shared by all sessions and
+    processes that use the same directory.
+    """
+
+    def __init__(self, directory):
+        """
+        :param directory: The directory of the analysis files; created on the first write.
+        """
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._analyses = {}
+
+    def get(self, diagram_hash, model_id):
+        """
+        :param diagram_hash: The hash of the diagram file, see diagram_hash.
+        :param model_id: The ID of the model that made the analysis.
+        :return: The stored analysis, or None if the diagram hasn't been analyzed by the model.
+        """
+        key = self._key(diagram_hash, model_id)
+        with self._lock:
+            if key in self._analyses:
+                return self._analyses[key]
+
+        try:
+            with open(os.path.join(self.directory, f"{key}.json"), "r", encoding="utf-8") as f:
+                record = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logging.warning("Warning: Couldn't read the stored analysis %s: %s", key, e)
+            return None
+
+        with self._lock:
+            self._analyses[key] = record["analysis"]
+        return record["analysis"]
+
+    def put(self, diagram_hash, model_id, analysis, diagram_file=None):
+        """
+        Stores an analysis. The file is replaced atomically, so concurrent readers never see a partial file.
+
+        :param diagram_hash: The hash of the diagram file, see diagram_hash.
+        :param model_id: The ID of the model that made the analysis.
+        :param analysis: The analysis.
+        :param diagram_file: The path to the diagram, stored for reference; or None.
+        """
+        key = self._key(diagram_hash, model_id)
+        record = {
+            "version": ANALYSIS_VERSION,
+            "diagram_hash": diagram_hash,
+            "diagram_file": diagram_file,
+            "model_id": model_id,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "analysis": analysis,
+        }
+        with self._lock:
+            self._analyses[key] = analysis
+
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, f"{key}.json")
+            temporary_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(temporary_path, "w", encoding="utf-8") as f:
+                json.dump(record, f, indent=2)
+            os.replace(temporary_path, path)
+        except OSError as e:
+            logging.warning("Warning: Couldn't store the analysis of %s: %s", diagram_file or diagram_hash, e)
+
+    def add_finding(self, diagram_hash, query, answer):
+        """
+        Records the answer to a question about a diagram. Findings are appended to one JSON lines file per
+        diagram, independent of the model.
+
+        :param diagram_hash: The hash of the diagram file, see diagram_hash.
+        :param query: The user's question.
+        :param answer: The model's answer.
+        """
+        line = json.dumps(
+            {"query": query, "answer": answer, "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())}
+        )
+        with self._lock:
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                with open(os.path.join(self.directory, f"{diagram_hash}-findings.jsonl"), "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+            except OSError as e:
+                logging.warning("Warning: Couldn't record the finding for %s: %s", diagram_hash, e)
+
+    def get_findings(self, diagram_hash, limit=None):
+        """
+        :param diagram_hash: The hash of the diagram file, see diagram_hash.
+        :param limit: The maximum number of findings, the most recent ones are returned; or None for all.
+        :return: The recorded findings, oldest first, each a dict with the query, the answer, and the time.
+        """
+        findings = []
+        try:
+            with open(os.path.join(self.directory, f"{diagram_hash}-findings.jsonl"), "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        findings.append(json.loads(line))
+                    except ValueError:
+                        # A line that was cut off when the process stopped
+                        continue
+        except FileNotFoundError:
+            return []
+        except OSError as e:
+            logging.warning("Warning: Couldn't read the findings for %s: %s", diagram_hash, e)
+            return []
+        return findings[-limit:] if limit else findings
+
+    @staticmethod
+    def _key(diagram_hash, model_id):
+        """
+        :return: The file name of an analysis, without the extension. Model IDs contain characters like ":",
+            so they're hashed, together with the analysis version.
+        """
+        model_key = hashlib.sha256(f"{model_id}-v{ANALYSIS_VERSION}".encode("utf-8")).hexdigest()[:12]
+        return f"{diagram_hash}-{model_key}"
+
+
+def get_store(directory):
+    """
+    Returns the process-wide store of a directory, so all sessions of the process share its loaded analyses.
+
+    :param directory: The directory of the analysis files.
+    :return: The store.
+    """
+    with _stores_lock:
+        if directory not in _stores:
+            _stores[directory] = DiagramAnalysisStore(directory)
+        return _stores[directory]
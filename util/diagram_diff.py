@@ -0,0 +1,215 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+"""
+Compares two revisions of an architecture diagram and describes what changed: the components and connections
+that were added, removed, or changed, and the notes that were added or removed. A review of a revision sends
+this delta to the model instead of the whole diagram.
+
+Both revisions are first converted to the same structure:
+
+    {"components": {key: {"label": str, "service": str, "group": str}},
+     "connections": {key: {"source": str, "target": str, "label": str}},
+     "notes": [str]}
+
+draw.io diagrams keep the IDs of their cells across revisions, so their components and connections are matched
+by ID, and a renamed component is a change. Diagram images have no IDs; their structure comes from the model's
+stored analysis (see diagram_analysis.py), and they're matched by label.
+"""
+
+# The fields that are compared, and how they're named in the description of a change
+COMPONENT_FIELDS = {"label": "label", "service": "service", "group": "group"}
+CONNECTION_FIELDS = {"source": "source", "target": "target", "label": "label"}
+
+
+def from_drawio(graph):
+    """
+    :param graph: The graph of a draw.io diagram, see drawio_parser.parse_drawio.
+    :return: The structure of the diagram, keyed by the IDs of its cells.
+    """
+    components = {}
+    connections = {}
+    notes = []
+    for page in graph["pages"]:
+        nodes = page["nodes"]
+        for node_id, node in nodes.items():
+            if node["note"]:
+                if node["label"]:
+                    notes.append(node["label"])
+            elif not node["container"]:
+                parent = nodes.get(node["parent"])
+                components[f"{page['name']}/{node_id}"] = {
+                    "label": node["label"],
+                    "service": node["type"] or "",
+                    "group": parent["label"] if parent is not None else "",
+                }
+
+        for edge in page["edges"]:
+            source = nodes.get(edge["source"])
+            target = nodes.get(edge["target"])
+            connections[f"{page['name']}/{edge['id']}"] = {
+                "source": source["label"] if source is not None else "?",
+                "target": target["label"] if target is not None else "?",
+                "label": edge["label"],
+            }
+
+    return {"components": components, "connections": connections, "notes": notes}
+
+
+def from_analysis(analysis):
+    """
+    :param analysis: The stored analysis of a diagram image, see diagram_analysis.parse_analysis_response.
+    :return: The structure of the diagram, keyed by the labels of its components and connections.
+    """
+    components = {}
+    for service in analysis["services"]:
+        label = service.get("label", "")
+        components[_unique_key(components, label.lower())] = {
+            "label": label,
+            "service": service.get("service") or "",
+            "group": service.get("group") or "",
+        }
+
+    connections = {}
+    for edge in analysis["edges"]:
+        source, target = edge.get("source", ""), edge.get("target", "")
+        connections[_unique_key(connections, f"{source.lower()} -> {target.lower()}")] = {
+            "source": source,
+            "target": target,
+            "label": edge.get("label") or "",
+        }
+
+    return {"components": components, "connections": connections, "notes": list(analysis["notes"])}
+
+
+def diff(previous, current):
+    """
+    Compares the structures of two revisions of a diagram.
+
+    :param previous: The structure of the previous revision.
+    :param current: The structure of the current revision.
+    :return: The delta, {"components": changes, "connections": changes, "notes": {"added": [str],
+        "removed": [str]}}, where changes are {"added": [item], "removed": [item], "changed": [{"before": item,
+        "after": item}]}.
+    """
+    previous_notes = set(previous["notes"])
+    current_notes = set(current["notes"])
+    return {
+        "components": _diff_items(previous["components"], current["components"], COMPONENT_FIELDS),
+        "connections": _diff_items(previous["connections"], current["connections"], CONNECTION_FIELDS),
+        "notes": {
+            "added": [note for note in current["notes"] if note not in previous_notes],
+            "removed": [note for note in previous["notes"] if note not in current_notes],
+        },
+    }
+
+
+def is_empty(delta):
+    """
+    :param delta: The delta, see diff.
+    :return: True if the revisions have the same structure.
+    """
+    return not any(items for changes in delta.values() for items in changes.values())
+
+
+def count_changes(delta):
+    """
+    :param delta: The delta, see diff.
+    :return: The number of added, removed, and changed items.
+    """
+    return sum(len(items) for changes in delta.values() for items in changes.values())
+
+
+def to_text(delta, previous_title, title):
+    """
+    Serializes a delta as compact text for the model.
+
+    :param delta: The delta, see diff.
+    :param previous_title: The title of the previous revision, e.g. its file name.
+    :param title: The title of the current revision.
+    :return: The text representation of the delta.
+    """
+    lines = [f"Architecture diagram {title} is a revision of {previous_title}. Changes since {previous_title}:"]
+    if is_empty(delta):
+        lines.append("- None, the components, connections, and notes are the same.")
+        return "\n".join(lines)
+
+    for kind, describe, fields in (
+        ("components", _describe_component, COMPONENT_FIELDS),
+        ("connections", _describe_connection, CONNECTION_FIELDS),
+    ):
+        changes = delta[kind]
+        if changes["added"]:
+            lines.append(f"Added {kind}:")
+            lines.extend(f"- {describe(item)}" for item in changes["added"])
+        if changes["removed"]:
+            lines.append(f"Removed {kind}:")
+            lines.extend(f"- {describe(item)}" for item in changes["removed"])
+        if changes["changed"]:
+            lines.append(f"Changed {kind}:")
+            for change in changes["changed"]:
+                differences = "; ".join(
+                    f"{name} {change['before'][field] or '(none)'} -> {change['after'][field] or '(none)'}"
+                    for field, name in fields.items()
+                    if change["before"][field] != change["after"][field]
+                )
+                lines.append(f"- {describe(change['before'])}: {differences}")
+
+    if delta["notes"]["added"]:
+        lines.append("Added notes:")
+        lines.extend(f"- {note}" for note in delta["notes"]["added"])
+    if delta["notes"]["removed"]:
+        lines.append("Removed notes:")
+        lines.extend(f"- {note}" for note in delta["notes"]["removed"])
+
+    return "\n".join(lines)
+
+
+def _diff_items(previous, current, fields):
+    """
+    :param previous: The items of the previous revision, by key.
+    :param current: The items of the current revision, by key.
+    :param fields: The fields that are compared.
+    :return: The added, removed, and changed items.
+    """
+    return {
+        "added": [item for key, item in current.items() if key not in previous],
+        "removed": [item for key, item in previous.items() if key not in current],
+        "changed": [
+            {"before": previous[key], "after": item}
+            for key, item in current.items()
+            if key in previous and any(previous[key][field] != item[field] for field in fields)
+        ],
+    }
+
+
+def _unique_key(items, key):
+    """
+    :param items: The items collected so far, by key.
+    :param key: The key of the next item.
+    :return: The key, with a suffix if an item with the same key was collected before, e.g. "a -> b #2".
+    """
+    if key not in items:
+        return key
+    index = 2
+    while f"{key} #{index}" in items:
+        index += 1
+    return f"{key} #{index}"
+
+
+def _describe_component(component):
+    """
+    :param component: The component.
+    :return: The description, e.g. '"Lambda Meme Generator" (lambda, in Content Generation)'.
+    """
+    details = [detail for detail in (component["service"], component["group"] and f"in {component['group']}") if detail]
+    return f'"{component["label"]}"' + (f" ({', '.join(details)})" if details else "")
+
+
+def _describe_connection(connection):
+    """
+    :param connection: The connection.
+    :return: The description, e.g. '"Users" -> "Puppy Images S3 Bucket": 1. Upload puppy images'.
+    """
+    label = f": {connection['label']}" if connection["label"] else ""
+    return f'"{connection["source"]}" -> "{connection["target"]}"{label}'
@@ -0,0 +1,301 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+"""
+Parses draw.io diagrams into a graph of components, containers, and connections, and serializes the graph as
+compact text for the model. Text is cheaper and faster for the model to process than an image of the diagram,
+and it's exact: no labels are misread and no connections are missed.
+"""
+
+import base64
+import html
+import re
+import xml.etree.ElementTree as ET
+import zlib
+from urllib.parse import unquote
+
+# Style keys that mark a shape as a container of other shapes
+CONTAINER_STYLES = ("container=1", "swimlane", "group", "mxgraph.aws4.group")
+
+# Prefix of the AWS architecture icon shapes, e.g. mxgraph.aws4.lambda
+AWS_SHAPE_PREFIX = "mxgraph.aws4."
+
+HTML_TAG = re.compile(r"<[^>]+>")
+LINE_BREAK = re.compile(r"<br\s*/?>|</div>|</p>", re.IGNORECASE)
+WHITESPACE = re.compile(r"\s+")
+
+
+def load_drawio(diagram_path):
+    """
+    Loads a draw.io file into a diagram graph.
+
+    :param diagram_path: The path to the .drawio file.
+    :return: The diagram graph, see parse_drawio.
+    """
+    with open(diagram_path, "rb") as diagram_file:
+        return parse_drawio(diagram_file.read())
+
+
+def parse_drawio(xml_data):
+    """
+    Parses the XML of a draw.io file into a diagram graph. Both uncompressed and compressed pages are supported,
+    as well as files that contain a single mxGraphModel.
+
+    The graph is a dict that only contains JSON-serializable values:
+    {"pages": [{"name": str, "nodes": {id: node}, "edges": [edge]}]}
+    where each node is {"label": str, "type": str or None, "parent": id or None, "container": bool,
+    "note": bool, "geometry": [x, y, width, height]} and each edge is
+    {"id": str, "source": id or None, "target": id or None, "label": str}.
+
+    :param xml_data: The XML of the draw.io file, as bytes or str.
+    :return: The diagram graph.
+    """
+    root = ET.fromstring(xml_data)
+
+    if root.tag == "mxGraphModel":
+        return {"pages": [_parse_page("Page-1", root)]}
+
+    pages = []
+    for index, diagram in enumerate(root.iter("diagram")):
+        name = diagram.get("name") or f"Page-{index + 1}"
+        model = diagram.find("mxGraphModel")
+        if model is None and diagram.text and diagram.text.strip():
+            model = ET.fromstring(_decompress(diagram.text.strip()))
+        if model is not None:
+            pages.append(_parse_page(name, model))
+    return {"pages": pages}
+
+
+def _decompress(diagram_text):
+    """
+    Decompresses a compressed draw.io page: base64-encoded, raw-deflated, URL-encoded XML.
+
+    :param diagram_text: The text content of the diagram element.
+    :return: The XML of the page's mxGraphModel.
+    """
+    return unquote(zlib.decompress(base64.b64decode(diagram_text), -15).decode("utf-8"))
+
+
+def _parse_page(name, model):
+    """
+    Parses the mxGraphModel of a page.
+
+    :param name: The name of the page.
+    :param model: The mxGraphModel element.
+    :return: The page graph.
+    """
+    nodes = {}
+    edges = []
+    edge_ids = set()
+    edge_labels = {}
+
+    for cell, cell_id, label in _cells(model):
+        style = cell.get("style") or ""
+
+        if cell.get("edge") == "1":
+            edge_ids.add(cell_id)
+            edges.append({"id": cell_id, "source": cell.get("source"), "target": cell.get("target"), "label": label})
+
+        elif cell.get("vertex") == "1":
+            parent = cell.get("parent")
+            if style.startswith("edgeLabel") or parent in edge_ids:
+                # Labels placed on a connection are children of the connection
+                edge_labels.setdefault(parent, []).append(label)
+                continue
+
+            nodes[cell_id] = {
+                "label": label,
+                "type": _shape_type(style),
+                "parent": parent,
+                "container": any(container_style in style for container_style in CONTAINER_STYLES),
+                "note": style.startswith("text;"),
+                "geometry": _geometry(cell),
+            }
+
+    for edge in edges:
+        if edge["id"] in edge_labels:
+            edge["label"] = " ".join([edge["label"]] + edge_labels[edge["id"]]).strip()
+
+    _resolve_parents(nodes)
+    return {"name": name, "nodes": nodes, "edges": edges}
+
+
+def _cells(model):
+    """
+    Yields the cells of a graph model with their ID and plain text label. Cells that carry custom data are
+    wrapped in UserObject or object elements that hold the ID and label.
+
+    :param model: The mxGraphModel element.
+    :return: A generator of (cell element, cell ID, label) tuples.
+    """
+    root = model.find("root")
+    if root is None:
+        return
+    for element in root:
+        if element.tag == "mxCell":
+            yield element, element.get("id"), _plain_text(element.get("value"))
+        else:
+            cell = element.find("mxCell")
+            if cell is not None:
+                yield cell, element.get("id"), _plain_text(element.get("label") or element.get("value"))
+
+
+def _plain_text(value):
+    """
+    Converts a label, which may contain HTML, to plain text on a single line.
+
+    :param value: The label.
+    :return: The plain text label.
+    """
+    if not value:
+        return ""
+    text = LINE_BREAK.sub(" ", value)
+    text = html.unescape(HTML_TAG.sub("", text))
+    return WHITESPACE.sub(" ", text).strip()
+
+
+def _shape_type(style):
+    """
+    Derives the component type from the shape style, e.g. "lambda" for the AWS Lambda icon.
+
+    :param style: The style of the cell.
+    :return: The component type, or None if the shape isn't an AWS icon.
+    """
+    properties = dict(item.split("=", 1) for item in style.split(";") if "=" in item)
+    for key in ("resIcon", "prIcon", "shape"):
+        value = properties.get(key, "")
+        if value.startswith(AWS_SHAPE_PREFIX) and value != AWS_SHAPE_PREFIX + "resourceIcon":
+            return value[len(AWS_SHAPE_PREFIX):]
+    return None
+
+
+def _geometry(cell):
+    """
+    Reads the geometry of a cell, relative to its parent.
+
+    :param cell: The mxCell element.
+    :return: The geometry as [x, y, width, height].
+    """
+    geometry = cell.find("mxGeometry")
+    if geometry is None:
+        return [0.0, 0.0, 0.0, 0.0]
+    return [float(geometry.get(key, 0)) for key in ("x", "y", "width", "height")]
+
+
+def _resolve_parents(nodes):
+    """
+    Converts node geometries to absolute coordinates, and assigns each node to the innermost container that
+    holds it. draw.io diagrams often draw groups as plain boxes placed around their components, instead of as
+    parent cells, so a node that lies entirely within another shape's box is considered part of that group.
+
+    :param nodes: The nodes of a page, updated in place.
+    """
+    def absolute(node_id, seen=()):
+        node = nodes[node_id]
+        parent = node["parent"]
+        if parent in nodes and parent not in seen:
+            parent_x, parent_y, _, _ = absolute(parent, seen + (node_id,))
+            x, y, width, height = node["geometry"]
+            return [x + parent_x, y + parent_y, width, height]
+        return node["geometry"]
+
+    absolute_geometries = {node_id: absolute(node_id) for node_id in nodes}
+    for node_id, geometry in absolute_geometries.items():
+        nodes[node_id]["geometry"] = geometry
+
+    # Shapes without an icon or text style that have a label can act as groups
+    group_candidates = [
+        (node_id, node["geometry"])
+        for node_id, node in nodes.items()
+        if node["container"] or (node["type"] is None and not node["note"] and node["label"])
+    ]
+    # Sort by area, so the first group found for a node is the innermost one
+    group_candidates.sort(key=lambda candidate: candidate[1][2] * candidate[1][3])
+
+    for node_id, node in nodes.items():
+        if node["parent"] in nodes:
+            nodes[node["parent"]]["container"] = True
+            continue
+
+        node["parent"] = None
+        x, y, width, height = node["geometry"]
+        for group_id, (group_x, group_y, group_width, group_height) in group_candidates:
+            if (
+                group_id != node_id
+                and group_width * group_height > width * height
+                and group_x <= x and x + width <= group_x + group_width
+                and group_y <= y and y + height <= group_y + group_height
+            ):
+                node["parent"] = group_id
+                nodes[group_id]["container"] = True
+                break
+
+
+def to_text(graph, title=None):
+    """
+    Serializes a diagram graph as compact text for the model. Components and containers get short IDs,
+    so connections can refer to them without repeating their labels.
+
+    :param graph: The diagram graph.
+    :param title: The title of the diagram, e.g. its file name.
+    :return: The text representation of the diagram.
+    """
+    lines = []
+    if title:
+        lines.append(f"Architecture diagram {title} (draw.io, converted to text):")
+
+    for page in graph["pages"]:
+        nodes = page["nodes"]
+        short_ids = {}
+        for node_id, node in nodes.items():
+            if not node["note"]:
+                short_ids[node_id] = f"N{len(short_ids) + 1}"
+
+        lines.append(f'Page "{page["name"]}"')
+
+        containers = [node_id for node_id in short_ids if nodes[node_id]["container"]]
+        if containers:
+            lines.append("Groups:")
+            for node_id in containers:
+                lines.append(f"- {_describe_node(node_id, nodes, short_ids)}")
+
+        components = [node_id for node_id in short_ids if not nodes[node_id]["container"]]
+        if components:
+            lines.append("Components:")
+            for node_id in components:
+                lines.append(f"- {_describe_node(node_id, nodes, short_ids)}")
+
+        if page["edges"]:
+            lines.append("Connections:")
+            for edge in page["edges"]:
+                source = short_ids.get(edge["source"], "?")
+                target = short_ids.get(edge["target"], "?")
+                label = f": {edge['label']}" if edge["label"] else ""
+                lines.append(f"- {source} -> {target}{label}")
+
+        notes = [node for node in nodes.values() if node["note"] and node["label"]]
+        if notes:
+            lines.append("Notes:")
+            # Order notes top to bottom, left to right, the way they're read
+            for node in sorted(notes, key=lambda note: (note["geometry"][1], note["geometry"][0])):
+                lines.append(f"- {node['label']}")
+
+    return "\n".join(lines)
+
+
+def _describe_node(node_id, nodes, short_ids):
+    """
+    Describes a component or container on a single line.
+
+    :param node_id: The ID of the node.
+    :param nodes: The nodes of the page.
+    :param short_ids: The short IDs of the nodes.
+    :return: The description, e.g. "N4 Lambda Meme Generator [lambda] in N2".
+    """
+    node = nodes[node_id]
+    description = f"{short_ids[node_id]} {node['label'] or '(no label)'}"
+    if node["type"]:
+        description += f" [{node['type']}]"
+    if node["parent"] in short_ids:
+        description += f" in {short_ids[node['parent']]}"
+    return description
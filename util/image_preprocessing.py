@@ -0,0 +1,245 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import hashlib
+import io
+import json
+import logging
+import math
+import os
+
+# The model downscales images whose long edge exceeds this size, so larger images only add upload time.
+# https://docs.anthropic.com/en/docs/build-with-claude/vision#evaluate-image-size
+MAX_IMAGE_EDGE = 1568
+
+# When tiling is enabled, images whose long edge exceeds this size are split into tiles at full resolution,
+# sent together with a downscaled overview of the whole image
+TILE_THRESHOLD_EDGE = 2 * MAX_IMAGE_EDGE
+
+# The maximum number of tiles per image; larger images are downscaled until they fit
+MAX_TILES = 6
+
+# Tiles overlap by this many pixels, so labels on a tile border remain readable on one of them
+TILE_OVERLAP = 64
+
+# JPEG is lossy and blurs the text and lines of diagrams, so it's only used if it's at most
+# this fraction of the size of the best lossless encoding
+JPEG_MAX_SIZE_RATIO = 0.5
+JPEG_QUALITY = 85
+
+# Increment when the preprocessing changes, to invalidate the cached results
+PREPROCESSING_VERSION = 1
+
+# Maps Pillow's format names to the image formats of the Converse API
+CONVERSE_FORMATS = {
+    "PNG": "png",
+    "JPEG": "jpeg",
+    "GIF": "gif",
+    "WEBP": "webp",
+}
+
+
+def load_image(image_path, tile=False, cache_dir=None):
+    """
+    Loads an image for the model: downscaled to the model's effective resolution, re-encoded to the smallest
+    acceptable format and, optionally, split into tiles. The results are cached on disk by the hash of the
+    image's content, so loading the same image again skips decoding and encoding.
+
+    :param image_path: The path to the image file.
+    :param tile: Whether to split very large images into tiles.
+    :param cache_dir: The cache directory, or None to disable the cache.
+    :return: The list of images to send, each a dict with the Converse image format and the image bytes.
+        Tiled images start with the overview, followed by the tiles from left to right and top to bottom.
+    """
+    with open(image_path, "rb") as image_file:
+        image_bytes = image_file.read()
+
+    settings = f"v{PREPROCESSING_VERSION}-{MAX_IMAGE_EDGE}-{TILE_THRESHOLD_EDGE if tile else 0}"
+    cache_key = hashlib.sha256(image_bytes).hexdigest() + "-" + hashlib.sha256(settings.encode()).hexdigest()[:8]
+
+    if cache_dir is not None:
+        images = _read_cache(cache_dir, cache_key)
+        if images is not None:
+            logging.debug("Loaded preprocessed image %s from the cache.", image_path)
+            return images
+
+    images = preprocess_image(image_bytes, tile)
+
+    if cache_dir is not None:
+        _write_cache(cache_dir, cache_key, images)
+
+    logging.debug(
+        "Preprocessed image %s from %d bytes to %d bytes in %d part(s).",
+        image_path, len(image_bytes), sum(len(image["bytes"]) for image in images), len(images),
+    )
+    return images
+
+
+def preprocess_image(image_bytes, tile=False):
+    """
+    Downscales, re-encodes and optionally tiles an image.
+
+    :param image_bytes: The original image bytes.
+    :param tile: Whether to split very large images into tiles.
+    :return: The list of images to send, each a dict with the Converse image format and the image bytes.
+    """
+    from PIL import Image
+
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        image.load()
+        original_format = CONVERSE_FORMATS.get(image.format)
+        width, height = image.size
+
+        if tile and max(width, height) > TILE_THRESHOLD_EDGE:
+            return [_encode(_downscale(image, MAX_IMAGE_EDGE))] + [_encode(tile_image) for tile_image in _tiles(image)]
+
+        if max(width, height) <= MAX_IMAGE_EDGE and original_format is not None:
+            # The original may already be the smallest encoding, e.g. an optimized PNG
+            encoded = _encode(image)
+            if len(image_bytes) <= len(encoded["bytes"]):
+                return [{"format": original_format, "bytes": image_bytes}]
+            return [encoded]
+
+        return [_encode(_downscale(image, MAX_IMAGE_EDGE))]
+
+
+def _downscale(image, max_edge):
+    """
+    Downscales an image so its long edge is at most max_edge, keeping its aspect ratio.
+
+    :param image: The Pillow image.
+    :param max_edge: The maximum length of the long edge in pixels.
+    :return: The downscaled image, or the image itself if it's small enough.
+    """
+    width, height = image.size
+    scale = max_edge / max(width, height)
+    if scale >= 1:
+        return image
+    from PIL import Image
+
+    return image.resize((max(1, round(width * scale)), max(1, round(height * scale))), Image.LANCZOS)
+
+
+def _tiles(image):
+    """
+    Splits an image into overlapping tiles whose long edge is at most MAX_IMAGE_EDGE. Images that would need
+    more than MAX_TILES tiles are downscaled first.
+
+    :param image: The Pillow image.
+    :return: The tiles from left to right and top to bottom.
+    """
+    width, height = image.size
+    step = MAX_IMAGE_EDGE - TILE_OVERLAP
+
+    columns = math.ceil((width - TILE_OVERLAP) / step)
+    rows = math.ceil((height - TILE_OVERLAP) / step)
+    if columns * rows > MAX_TILES:
+        scale = math.sqrt(MAX_TILES / (columns * rows))
+        image = _downscale(image, int(max(width, height) * scale))
+        width, height = image.size
+        columns = math.ceil((width - TILE_OVERLAP) / step)
+        rows = math.ceil((height - TILE_OVERLAP) / step)
+
+    tiles = []
+    for row in range(rows):
+        for column in range(columns):
+            left = min(column * step, max(0, width - MAX_IMAGE_EDGE))
+            top = min(row * step, max(0, height - MAX_IMAGE_EDGE))
+            tiles.append(image.crop((left, top, min(width, left + MAX_IMAGE_EDGE), min(height, top + MAX_IMAGE_EDGE))))
+    return tiles
+
+
+def _encode(image):
+    """
+    Encodes an image in the smallest acceptable format. Lossless PNG is preferred for diagrams; images with
+    at most 256 colors are stored as palette PNGs without any loss. JPEG is only used for images without
+    transparency if it's much smaller, which is typically the case for photos and screenshots.
+
+    :param image: The Pillow image.
+    :return: A dict with the Converse image format and the image bytes.
+    """
+    from PIL import Image
+
+    has_alpha = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+    image = image.convert("RGBA" if has_alpha else "RGB")
+
+    candidates = [("png", _save(image, "PNG", optimize=True))]
+
+    # getcolors returns None if the image has more colors than the given maximum
+    if image.getcolors(256) is not None:
+        # Only the fast octree method supports transparency
+        method = Image.Quantize.FASTOCTREE if has_alpha else Image.Quantize.MEDIANCUT
+        palette_image = image.quantize(colors=256, method=method)
+        candidates.append(("png", _save(palette_image, "PNG", optimize=True)))
+
+    image_format, image_bytes = min(candidates, key=lambda candidate: len(candidate[1]))
+
+    if not has_alpha:
+        jpeg_bytes = _save(image, "JPEG", quality=JPEG_QUALITY, optimize=True)
+        if len(jpeg_bytes) <= JPEG_MAX_SIZE_RATIO * len(image_bytes):
+            image_format, image_bytes = "jpeg", jpeg_bytes
+
+    return {"format": image_format, "bytes": image_bytes}
+
+
+def _save(image, image_format, **options):
+    """
+    Encodes a Pillow image.
+
+    :param image: The Pillow image.
+    :param image_format: The Pillow format name.
+    :param options: The encoder options.
+    :return: The encoded bytes.
+    """
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format, **options)
+    return buffer.getvalue()
+
+
+def _read_cache(cache_dir, cache_key):
+    """
+    Reads preprocessed images from the cache.
+
+    :param cache_dir: The cache directory.
+    :param cache_key: The cache key of the image.
+    :return: The cached images, or None if they aren't cached.
+    """
+    manifest_path = os.path.join(cache_dir, f"{cache_key}.json")
+    try:
+        with open(manifest_path, "r") as f:
+            manifest = json.load(f)
+
+        images = []
+        for part in manifest["parts"]:
+            with open(os.path.join(cache_dir, part["file"]), "rb") as image_file:
+                images.append({"format": part["format"], "bytes": image_file.read()})
+        return images
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def _write_cache(cache_dir, cache_key, images):
+    """
+    Writes preprocessed images to the cache. The manifest is written last, so a partially written
+    entry is never read.
+
+    :param cache_dir: The cache directory.
+    :param cache_key: The cache key of the image.
+    :param images: The preprocessed images.
+    """
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+
+        parts = []
+        for index, image in enumerate(images):
+            file_name = f"{cache_key}-{index}.{image['format']}"
+            with open(os.path.join(cache_dir, file_name), "wb") as image_file:
+                image_file.write(image["bytes"])
+            parts.append({"format": image["format"], "file": file_name})
+
+        manifest_path = os.path.join(cache_dir, f"{cache_key}.json")
+        with open(manifest_path + ".tmp", "w") as f:
+            json.dump({"parts": parts}, f)
+        os.replace(manifest_path + ".tmp", manifest_path)
+    except OSError as e:
+        logging.warning("Couldn't write the preprocessed image to the cache: %s", e)
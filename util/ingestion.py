@@ -0,0 +1,283 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+"""
+Ingests best practices and company standards documents into an index for the local retrieval backend.
+
+Ingestion is incremental: unchanged documents aren't read again, and only chunks whose content changed are
+embedded, so re-ingesting a large corpus after an edit takes seconds rather than a full rebuild. The index is
+a directory with a manifest, the chunk texts, and the embeddings as a memory-mappable NumPy file. Each ingestion
+writes the chunk texts and embeddings of a new generation under new file names, and switches to them by replacing
+the manifest, which names them.
+
+Usage:
+    python -m util.ingestion demo/best-practices-data.md [more documents or directories] [--index-dir DIR]
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from util.local_retrieval import CHUNK_OVERLAP, CHUNK_SIZE, EMBEDDING_FUNCTIONS, chunk_markdown, index_files
+
+# The default index directory, which the local retrieval backend of the Best Practices Tool loads
+DEFAULT_INDEX_DIR = ".index/best-practices"
+
+# Increment when the index format or chunking changes, to force a full rebuild
+INDEX_VERSION = 1
+
+# The number of chunks per embedding batch, and the number of batches embedded in parallel
+EMBEDDING_BATCH_SIZE = 64
+EMBEDDING_WORKERS = 8
+
+# The file extensions of documents found in directories
+DOCUMENT_EXTENSIONS = (".md", ".markdown", ".txt")
+
+
+def ingest(document_paths, index_dir, embedding="hashed"):
+    """
+    Ingests documents into the index, reusing the chunks and embeddings of unchanged content.
+
+    :param document_paths: The paths of the documents and directories of documents to index.
+    :param index_dir: The index directory; created if it doesn't exist.
+    :param embedding: The name of the embedding function, see local_retrieval.EMBEDDING_FUNCTIONS.
+    :return: A dict with the number of documents, chunks, and newly embedded chunks.
+    """
+    started_at = time.monotonic()
+    previous = _load_previous_index(index_dir, embedding)
+
+    # Chunk the documents that changed since the last ingestion; reuse the chunks of the others
+    documents = {}
+    rows = []
+    for document_path in _expand_paths(document_paths):
+        stat = os.stat(document_path)
+        document = previous["documents"].get(document_path)
+        if document is None or document["mtime_ns"] != stat.st_mtime_ns or document["size"] != stat.st_size:
+            document = _chunk_document(document_path, stat)
+        documents[document_path] = document
+        rows.extend((document_path, chunk_hash) for chunk_hash in document["chunks"])
+
+    # Embed only the chunks whose content isn't in the previous index
+    new_hashes = sorted({chunk_hash for _, chunk_hash in rows if chunk_hash not in previous["rows_by_hash"]})
+    new_texts = {chunk_hash: None for chunk_hash in new_hashes}
+    for document_path, document in documents.items():
+        if any(chunk_hash in new_texts for chunk_hash in document["chunks"]):
+            for chunk_hash, text in zip(document["chunks"], _document_chunks(document_path, document)):
+                if chunk_hash in new_texts:
+                    new_texts[chunk_hash] = text
+    new_embeddings = embed_in_batches([new_texts[chunk_hash] for chunk_hash in new_hashes], EMBEDDING_FUNCTIONS[embedding])
+    new_rows_by_hash = {chunk_hash: row for row, chunk_hash in enumerate(new_hashes)}
+
+    # Assemble the new index from the previous and the new embeddings
+    dimensions = new_embeddings.shape[1] if len(new_hashes) else previous["dimensions"]
+    embeddings = np.zeros((len(rows), dimensions or 0), dtype=np.float32)
+    chunk_lines = []
+    for row, (document_path, chunk_hash) in enumerate(rows):
+        if chunk_hash in new_rows_by_hash:
+            embeddings[row] = new_embeddings[new_rows_by_hash[chunk_hash]]
+            text = new_texts[chunk_hash]
+        else:
+            previous_row = previous["rows_by_hash"][chunk_hash]
+            embeddings[row] = previous["embeddings"][previous_row]
+            text = previous["texts"][previous_row]
+        chunk_lines.append(json.dumps({"hash": chunk_hash, "source": document_path, "text": text}))
+
+    _write_index(index_dir, documents, chunk_lines, embeddings, embedding)
+
+    result = {
+        "documents": len(documents),
+        "chunks": len(rows),
+        "embedded_chunks": len(new_hashes),
+        "seconds": round(time.monotonic() - started_at, 3),
+    }
+    logging.info("Ingested %(documents)d documents into %(chunks)d chunks, embedded %(embedded_chunks)d "
+                 "new chunks in %(seconds)s seconds.", result)
+    return result
+
+
+def embed_in_batches(texts, embed):
+    """
+    Embeds texts in parallel batches.
+
+    :param texts: The texts.
+    :param embed: The embedding function, taking a list of texts.
+    :return: The embeddings as a float32 matrix with one row per text.
+    """
+    if not texts:
+        return np.zeros((0, 0), dtype=np.float32)
+
+    batches = [texts[start:start + EMBEDDING_BATCH_SIZE] for start in range(0, len(texts), EMBEDDING_BATCH_SIZE)]
+    with ThreadPoolExecutor(max_workers=EMBEDDING_WORKERS) as executor:
+        return np.concatenate([np.asarray(batch, dtype=np.float32) for batch in executor.map(embed, batches)])
+
+
+def chunk_hash_of(text):
+    """
+    Fingerprints a chunk by its content.
+
+    :param text: The chunk text.
+    :return: The SHA-256 hex digest of the text.
+    """
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _expand_paths(paths):
+    """
+    Expands directories into the documents they contain.
+
+    :param paths: The paths of documents and directories.
+    :return: The sorted list of document paths.
+    """
+    document_paths = set()
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, _, file_names in os.walk(path):
+                for file_name in file_names:
+                    if file_name.lower().endswith(DOCUMENT_EXTENSIONS):
+                        document_paths.add(os.path.join(directory, file_name))
+        else:
+            document_paths.add(path)
+    return sorted(document_paths)
+
+
+def _chunk_document(document_path, stat):
+    """
+    Reads and chunks a document.
+
+    :param document_path: The path of the document.
+    :param stat: The document's file status.
+    :return: The document entry of the manifest, with its chunk texts attached for this ingestion.
+    """
+    with open(document_path, "r", encoding="utf-8") as f:
+        chunks = chunk_markdown(f.read(), CHUNK_SIZE, CHUNK_OVERLAP)
+    return {
+        "mtime_ns": stat.st_mtime_ns,
+        "size": stat.st_size,
+        "chunks": [chunk_hash_of(chunk) for chunk in chunks],
+        "texts": chunks,
+    }
+
+
+def _document_chunks(document_path, document):
+    """
+    Returns the chunk texts of a document, re-chunking it if the texts aren't at hand.
+
+    :param document_path: The path of the document.
+    :param document: The document entry.
+    :return: The chunk texts.
+    """
+    if "texts" not in document:
+        document.update(_chunk_document(document_path, os.stat(document_path)))
+    return document["texts"]
+
+
+def _load_previous_index(index_dir, embedding):
+    """
+    Loads the previous index, if it's compatible with this ingestion.
+
+    :param index_dir: The index directory.
+    :param embedding: The name of the embedding function.
+    :return: A dict with the previous documents, chunk texts, memory-mapped embeddings, and rows by chunk hash.
+    """
+    empty = {"documents": {}, "texts": [], "embeddings": None, "rows_by_hash": {}, "dimensions": None}
+    try:
+        with open(os.path.join(index_dir, "manifest.json"), "r") as f:
+            manifest = json.load(f)
+        if manifest["version"] != INDEX_VERSION or manifest["embedding"] != embedding:
+            logging.info("The index format or embedding changed, rebuilding the index.")
+            return empty
+
+        chunks_path, embeddings_path = index_files(index_dir, manifest)
+        texts, rows_by_hash = [], {}
+        with open(chunks_path, "r", encoding="utf-8") as f:
+            for row, line in enumerate(f):
+                chunk = json.loads(line)
+                texts.append(chunk["text"])
+                rows_by_hash.setdefault(chunk["hash"], row)
+
+        embeddings = np.load(embeddings_path, mmap_mode="r")
+        return {
+            "documents": manifest["documents"],
+            "texts": texts,
+            "embeddings": embeddings,
+            "rows_by_hash": rows_by_hash,
+            "dimensions": embeddings.shape[1],
+        }
+    except (OSError, ValueError, KeyError):
+        return empty
+
+
+def _write_index(index_dir, documents, chunk_lines, embeddings, embedding):
+    """
+    Writes a new generation of the index. The chunks and embeddings are written to files of their own, and the
+    manifest, which names them, is replaced last in a single rename, so readers never see a partially written
+    index or pair the chunks of one generation with the embeddings of another. The files of the previous
+    generation are kept for readers that read its manifest just before the switch; older ones are deleted.
+
+    :param index_dir: The index directory.
+    :param documents: The document entries.
+    :param chunk_lines: The JSON lines of the chunks, one per embedding row.
+    :param embeddings: The embedding matrix.
+    :param embedding: The name of the embedding function.
+    """
+    os.makedirs(index_dir, exist_ok=True)
+    manifest_path = os.path.join(index_dir, "manifest.json")
+    try:
+        with open(manifest_path, "r") as f:
+            previous_manifest = json.load(f)
+    except (OSError, ValueError):
+        previous_manifest = {}
+    generation = previous_manifest.get("generation", 0) + 1
+
+    embeddings_file = f"embeddings-{generation}.npy"
+    with open(os.path.join(index_dir, embeddings_file + ".tmp"), "wb") as f:
+        np.save(f, embeddings)
+    os.replace(os.path.join(index_dir, embeddings_file + ".tmp"), os.path.join(index_dir, embeddings_file))
+
+    chunks_file = f"chunks-{generation}.jsonl"
+    with open(os.path.join(index_dir, chunks_file + ".tmp"), "w", encoding="utf-8") as f:
+        f.write("".join(line + "\n" for line in chunk_lines))
+    os.replace(os.path.join(index_dir, chunks_file + ".tmp"), os.path.join(index_dir, chunks_file))
+
+    manifest = {
+        "version": INDEX_VERSION,
+        "generation": generation,
+        "chunks_file": chunks_file,
+        "embeddings_file": embeddings_file,
+        "embedding": embedding,
+        "documents": {
+            document_path: {key: value for key, value in document.items() if key != "texts"}
+            for document_path, document in documents.items()
+        },
+    }
+    with open(manifest_path + ".tmp", "w") as f:
+        json.dump(manifest, f)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+    # Delete the files of the generations before the previous one
+    kept_files = {chunks_file, embeddings_file, *map(os.path.basename, index_files(index_dir, previous_manifest))}
+    for file_name in os.listdir(index_dir):
+        if file_name.startswith(("chunks", "embeddings")) and file_name not in kept_files:
+            try:
+                os.remove(os.path.join(index_dir, file_name))
+            except OSError as e:
+                logging.warning("Warning: Couldn't delete the old index file %s: %s", file_name, e)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    parser = argparse.ArgumentParser(description="Ingest documents into the local retrieval index.")
+    parser.add_argument("paths", nargs="+", help="The documents and directories of documents to ingest.")
+    parser.add_argument("--index-dir", default=DEFAULT_INDEX_DIR, help="The index directory.")
+    parser.add_argument("--embedding", default="hashed", choices=sorted(EMBEDDING_FUNCTIONS),
+                        help="The embedding function; 'titan' requires access to Amazon Bedrock.")
+    arguments = parser.parse_args()
+
+    ingest(arguments.paths, arguments.index_dir, arguments.embedding)
@@ -0,0 +1,325 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+"""
+An in-process hybrid retrieval engine that combines BM25 keyword search with dense vector search. It serves as
+an offline alternative to an Amazon Bedrock knowledge base, e.g. for air-gapped environments or low-latency
+lookups, and returns results in the same shape as the knowledge base's Retrieve API.
+"""
+
+import functools
+import json
+import os
+import re
+import zlib
+from collections import Counter
+
+import numpy as np
+
+from util import aws_clients
+
+# BM25 parameters: term frequency saturation and document length normalization
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# The number of dimensions of the hashed embeddings
+HASHED_EMBEDDING_DIMENSIONS = 512
+
+# The weight of the keyword score in the fused score; the dense score gets the remaining weight
+KEYWORD_WEIGHT = 0.5
+
+# The maximum number of characters per chunk when splitting documents, and the overlap of consecutive chunks
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 100
+
+TITAN_EMBEDDING_MODEL_ID = "amazon.titan-embed-text-v2:0"
+
+TOKEN = re.compile(r"\w+")
+
+
+def tokenize(text):
+    """
+    Splits a text into lowercase word tokens.
+
+    :param text: The text.
+    :return: The list of tokens.
+    """
+    return TOKEN.findall(text.lower())
+
+
+def hashed_embedding(texts):
+    """
+    Embeds texts as normalized vectors of hashed word and character trigram counts. This needs no model, so it
+    works offline; it captures spelling variants and shared word parts, but not synonyms. Use a model-based
+    embedding function, e.g. with Amazon Titan text embeddings, for semantic similarity.
+
+    :param texts: The texts.
+    :return: The embeddings as a float32 matrix with one row per text.
+    """
+    matrix = np.zeros((len(texts), HASHED_EMBEDDING_DIMENSIONS), dtype=np.float32)
+    for row, text in enumerate(texts):
+        counts = Counter(tokenize(text))
+        if counts:
+            # The text's vector is the count-weighted sum of its tokens' feature vectors
+            token_vectors = np.stack([_token_vector(token) for token in counts])
+            matrix[row] = np.fromiter(counts.values(), dtype=np.float32, count=len(counts)) @ token_vectors
+
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+
+@functools.lru_cache(maxsize=65536)
+def _token_vector(token):
+    """
+    Hashes a token and its character trigrams to embedding dimensions with a random sign.
+
+    :param token: The token.
+    :return: The token's feature vector.
+    """
+    vector = np.zeros(HASHED_EMBEDDING_DIMENSIONS, dtype=np.float32)
+    for i in range(-1, len(token)):
+        feature = token if i < 0 else f"#{token}#"[i:i + 3]
+        # crc32 is stable across processes, unlike hash()
+        feature_hash = zlib.crc32(feature.encode("utf-8"))
+        vector[feature_hash % HASHED_EMBEDDING_DIMENSIONS] += 1.0 if feature_hash & 0x80000000 else -1.0
+    return vector
+
+
+def chunk_markdown(text, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP):
+    """
+    Splits a markdown document into chunks along its headings, paragraphs and lines, in that order of preference.
+
+    :param text: The markdown text.
+    :param chunk_size: The maximum number of characters per chunk.
+    :param chunk_overlap: The number of characters that consecutive chunks share.
+    :return: The list of chunks.
+    """
+    from langchain_text_splitters import MarkdownTextSplitter
+
+    return MarkdownTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap).split_text(text)
+
+
+def embed_text_with_titan(text):
+    """
+    Computes the normalized embedding of a text with an Amazon Titan text embeddings model.
+
+    :param text: The text.
+    :return: The embedding vector as a list of floats.
+    """
+    bedrock_runtime_client = aws_clients.get_client("bedrock-runtime")
+    response = bedrock_runtime_client.invoke_model(
+        modelId=TITAN_EMBEDDING_MODEL_ID,
+        body=json.dumps({"inputText": text, "normalize": True}),
+    )
+    return json.loads(response["body"].read())["embedding"]
+
+
+def titan_embedding(texts):
+    """
+    Embeds texts with an Amazon Titan text embeddings model, which captures their meaning, including synonyms.
+
+    :param texts: The texts.
+    :return: The embeddings as a float32 matrix with one row per text.
+    """
+    return np.array([embed_text_with_titan(text) for text in texts], dtype=np.float32).reshape(len(texts), -1)
+
+
+# The embedding functions by name, as recorded in persisted indexes
+EMBEDDING_FUNCTIONS = {
+    "hashed": hashed_embedding,
+    "titan": titan_embedding,
+}
+
+
+def index_files(index_dir, manifest):
+    """
+    Returns the files of the index generation a manifest references. Each ingestion writes a new generation,
+    and switches to it by replacing the manifest, so a reader that reads the manifest first always gets
+    chunks and embeddings that belong together.
+
+    :param index_dir: The index directory.
+    :param manifest: The index manifest.
+    :return: A tuple of the paths of the chunks file and the embeddings file.
+    """
+    return (
+        os.path.join(index_dir, manifest.get("chunks_file", "chunks.jsonl")),
+        os.path.join(index_dir, manifest.get("embeddings_file", "embeddings.npy")),
+    )
+
+
+class HybridIndex:
+    """
+    A hybrid search index over text chunks: a BM25 inverted index for keyword matches, and a matrix of
+    normalized embeddings for dense matches. The scores of both are normalized per query and fused.
+    """
+
+    def __init__(self, chunks, sources, embed=hashed_embedding, embeddings=None):
+        """
+        :param chunks: The texts of the chunks.
+        :param sources: The source of each chunk, e.g. the document's path.
+        :param embed: The function that embeds a list of texts as a matrix with one normalized row per text.
+        :param embeddings: The precomputed embeddings of the chunks, or None to compute them with embed.
+        """
+        self.chunks = list(chunks)
+        self.sources = list(sources)
+        self.embed = embed
+        self.embeddings = embed(self.chunks) if embeddings is None else embeddings
+        self._build_inverted_index()
+
+    @classmethod
+    def from_documents(cls, document_paths, embed=hashed_embedding, chunk_size=CHUNK_SIZE):
+        """
+        Builds an index from markdown or text documents.
+
+        :param document_paths: The paths of the documents.
+        :param embed: The embedding function.
+        :param chunk_size: The maximum number of characters per chunk.
+        :return: The index.
+        """
+        chunks, sources = [], []
+        for document_path in document_paths:
+            with open(document_path, "r", encoding="utf-8") as f:
+                for chunk in chunk_markdown(f.read(), chunk_size):
+                    chunks.append(chunk)
+                    sources.append(document_path)
+        return cls(chunks, sources, embed)
+
+    @classmethod
+    def load(cls, index_dir):
+        """
+        Loads an index written by the ingestion pipeline, see util/ingestion.py. The embeddings are memory-mapped
+        rather than read, so loading is fast and the operating system pages in only what searches touch.
+
+        :param index_dir: The index directory.
+        :return: The index.
+        """
+        with open(os.path.join(index_dir, "manifest.json"), "r") as f:
+            manifest = json.load(f)
+        chunks_path, embeddings_path = index_files(index_dir, manifest)
+
+        chunks, sources = [], []
+        with open(chunks_path, "r", encoding="utf-8") as f:
+            for line in f:
+                chunk = json.loads(line)
+                chunks.append(chunk["text"])
+                sources.append(chunk["source"])
+
+        embeddings = np.load(embeddings_path, mmap_mode="r")
+        return cls(chunks, sources, EMBEDDING_FUNCTIONS[manifest["embedding"]], embeddings)
+
+    def _build_inverted_index(self):
+        """
+        Builds the inverted index. The postings of all terms are stored in flat arrays, term by term, together
+        with their precomputed BM25 weights, so scoring a query term is a single vectorized addition.
+        """
+        document_lengths = np.zeros(len(self.chunks), dtype=np.float32)
+        postings = {}
+        for document_id, chunk in enumerate(self.chunks):
+            tokens = tokenize(chunk)
+            document_lengths[document_id] = len(tokens)
+            for token, count in Counter(tokens).items():
+                postings.setdefault(token, []).append((document_id, count))
+
+        average_length = document_lengths.mean() if len(self.chunks) else 0.0
+        document_count = len(self.chunks)
+
+        self.term_offsets = {}
+        document_ids, weights = [], []
+        start = 0
+        for term, term_postings in postings.items():
+            ids = np.array([document_id for document_id, _ in term_postings], dtype=np.int32)
+            frequencies = np.array([count for _, count in term_postings], dtype=np.float32)
+
+            idf = np.log(1 + (document_count - len(ids) + 0.5) / (len(ids) + 0.5))
+            length_norm = BM25_K1 * (1 - BM25_B + BM25_B * document_lengths[ids] / max(average_length, 1e-9))
+
+            self.term_offsets[term] = (start, start + len(ids))
+            start += len(ids)
+            document_ids.append(ids)
+            weights.append(idf * frequencies * (BM25_K1 + 1) / (frequencies + length_norm))
+
+        self.posting_document_ids = np.concatenate(document_ids) if document_ids else np.zeros(0, dtype=np.int32)
+        self.posting_weights = np.concatenate(weights) if weights else np.zeros(0, dtype=np.float32)
+
+    def keyword_scores(self, queries):
+        """
+        Computes the BM25 scores of all chunks for each query.
+
+        :param queries: The queries.
+        :return: The scores as a matrix with one row per query.
+        """
+        scores = np.zeros((len(queries), len(self.chunks)), dtype=np.float32)
+        for row, query in enumerate(queries):
+            for term in set(tokenize(query)):
+                if term in self.term_offsets:
+                    start, end = self.term_offsets[term]
+                    # Each chunk appears at most once in a term's postings, so the indices are unique
+                    scores[row, self.posting_document_ids[start:end]] += self.posting_weights[start:end]
+        return scores
+
+    def dense_scores(self, queries):
+        """
+        Computes the cosine similarity of all chunks for each query.
+
+        :param queries: The queries.
+        :return: The scores as a matrix with one row per query.
+        """
+        return np.asarray(self.embed(list(queries)), dtype=np.float32) @ np.asarray(self.embeddings).T
+
+    def search_batch(self, queries, number_of_results):
+        """
+        Searches the index for a batch of queries at once.
+
+        :param queries: The queries.
+        :param number_of_results: The maximum number of results per query.
+        :return: A list with the results of each query, as (chunk index, score) tuples by descending score.
+        """
+        if not self.chunks or not queries:
+            return [[] for _ in queries]
+
+        fused = KEYWORD_WEIGHT * _normalize_rows(self.keyword_scores(queries))
+        fused += (1 - KEYWORD_WEIGHT) * _normalize_rows(self.dense_scores(queries))
+
+        k = min(number_of_results, len(self.chunks))
+        # argpartition finds the top k in linear time; only those k are sorted
+        top_k = np.argpartition(-fused, k - 1, axis=1)[:, :k]
+        top_k_scores = np.take_along_axis(fused, top_k, axis=1)
+        order = np.argsort(-top_k_scores, axis=1)
+
+        return [
+            [(int(index), float(score)) for index, score in zip(top_k[row, order[row]], top_k_scores[row, order[row]])]
+            for row in range(len(queries))
+        ]
+
+    def retrieve(self, query, number_of_results):
+        """
+        Searches the index, and returns the results in the shape of the knowledge base's Retrieve API response.
+
+        :param query: The query.
+        :param number_of_results: The maximum number of results.
+        :return: The response with the retrievalResults.
+        """
+        results = self.search_batch([query], number_of_results)[0]
+        return {
+            "retrievalResults": [
+                {
+                    "content": {"text": self.chunks[index]},
+                    "location": {"type": "CUSTOM", "customDocumentLocation": {"id": f"{self.sources[index]}#{index}"}},
+                    "metadata": {"source": self.sources[index]},
+                    "score": score,
+                }
+                for index, score in results
+            ]
+        }
+
+
+def _normalize_rows(scores):
+    """
+    Scales each row of scores to the range 0 to 1, so scores of different scales can be fused.
+
+    :param scores: The score matrix.
+    :return: The normalized score matrix.
+    """
+    minimum = scores.min(axis=1, keepdims=True)
+    spread = scores.max(axis=1, keepdims=True) - minimum
+    return (scores - minimum) / np.where(spread == 0, 1, spread)
@@ -0,0 +1,211 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+"""
+Picks the model for each user turn, so simple lookups like "What is the current joy count?" are answered by a
+fast, inexpensive model, and turns that need more reasoning or long output stay on a larger one.
+
+The router only uses features that are cheap to compute from the request: the words of the query, whether
+the request contains an image, and the length of the conversation. The routing policy is a JSON file:
+
+    {
+        "default_model": "CLAUDE_SONNET_35",
+        "rules": [
+            {
+                "name": "tool_lookup",
+                "model": "CLAUDE_HAIKU_35",
+                "image_model": "CLAUDE_HAIKU",
+                "when": {"query_matches": ["joy count"], "max_query_words": 25}
+            }
+        ]
+    }
+
+Models are SupportedModels names. The first rule whose conditions all hold picks the model; if none does,
+the default model is used. Rules can use these conditions:
+
+- query_matches: regular expressions, one of which must match the query (case-insensitive)
+- query_excludes: regular expressions, none of which may match the query
+- min_query_words, max_query_words: the number of words of the query
+- has_image: whether the request contains an image
+- min_history_tokens, max_history_tokens: the estimated number of tokens of the conversation
+- min_turns, max_turns: the number of user queries in the conversation, including the current one
+
+A request with an image is never routed to a model without vision: a rule uses its image_model for such
+requests, and is skipped if it has none that can see images.
+"""
+
+import json
+import logging
+import re
+
+from util.conversation_history import is_user_query
+
+# The conditions a rule can have, see the module docstring
+RULE_CONDITIONS = {
+    "query_matches",
+    "query_excludes",
+    "min_query_words",
+    "max_query_words",
+    "has_image",
+    "min_history_tokens",
+    "max_history_tokens",
+    "min_turns",
+    "max_turns",
+}
+
+
+class ModelRouter:
+    """
+    Routes each user turn to a model according to a routing policy.
+    """
+
+    def __init__(self, policy, models, vision_models, default_model_id):
+        """
+        :param policy: The routing policy, see the module docstring.
+        :param models: The model IDs by their SupportedModels names.
+        :param vision_models: The IDs of the models that accept images.
+        :param default_model_id: The model to use if the policy has no default model.
+        """
+        self.vision_models = set(vision_models)
+        self.default_model_id = (
+            _model_id(models, policy["default_model"]) if policy.get("default_model") else default_model_id
+        )
+        if self.default_model_id not in self.vision_models:
+            raise ValueError(f"The default model {self.default_model_id} of the routing policy doesn't accept images.")
+
+        self.rules = []
+        for index, rule in enumerate(policy.get("rules", [])):
+            conditions = dict(rule.get("when", {}))
+            unknown_conditions = set(conditions) - RULE_CONDITIONS
+            if unknown_conditions:
+                raise ValueError(f"Unknown conditions in routing rule {index}: {sorted(unknown_conditions)}")
+            for key in ("query_matches", "query_excludes"):
+                if key in conditions:
+                    conditions[key] = [re.compile(pattern, re.IGNORECASE) for pattern in conditions[key]]
+
+            self.rules.append(
+                {
+                    "name": rule.get("name", f"rule {index}"),
+                    "model_id": _model_id(models, rule["model"]),
+                    "image_model_id": _model_id(models, rule["image_model"]) if rule.get("image_model") else None,
+                    "when": conditions,
+                }
+            )
+
+    def model_ids(self):
+        """
+        :return: The IDs of all models the router can route to.
+        """
+        model_ids = {self.default_model_id}
+        for rule in self.rules:
+            model_ids.add(rule["model_id"])
+            if rule["image_model_id"]:
+                model_ids.add(rule["image_model_id"])
+        return model_ids
+
+    def route(self, messages, history_tokens):
+        """
+        Picks the model for a user turn, and logs the decision.
+
+        :param messages: The messages that will be sent to the model, ending with the user's query.
+        :param history_tokens: The estimated number of tokens of the messages.
+        :return: The routing decision, a dict with the model ID, the name of the rule that picked it,
+            and the features the decision was based on.
+        """
+        features = extract_features(messages, history_tokens)
+
+        model_id, rule_name = self.default_model_id, "default"
+        for rule in self.rules:
+            if not _rule_matches(rule["when"], features):
+                continue
+            candidate = rule["image_model_id"] if features["has_image"] and rule["image_model_id"] else rule["model_id"]
+            if features["has_image"] and candidate not in self.vision_models:
+                logging.debug("Skipping the routing rule %s, its model %s doesn't accept images.", rule["name"], candidate)
+                continue
+            model_id, rule_name = candidate, rule["name"]
+            break
+
+        logging.info(
+            "Routing the turn to %s (rule: %s; image: %s, query words: %d, history tokens: %d, turns: %d).",
+            model_id, rule_name, features["has_image"], features["query_words"], features["history_tokens"],
+            features["turns"],
+        )
+        return {"model_id": model_id, "rule": rule_name, "features": features}
+
+
+def extract_features(messages, history_tokens):
+    """
+    Computes the features of a request that the routing rules are based on.
+
+    :param messages: The messages that will be sent to the model, ending with the user's query.
+    :param history_tokens: The estimated number of tokens of the messages.
+    :return: A dict with the query, its number of words, whether the messages contain an image,
+        the estimated number of tokens, and the number of user queries.
+    """
+    query = ""
+    if messages:
+        # The query is the last text block; a first message with a diagram has the diagram's text before it
+        text_blocks = [block["text"] for block in messages[-1]["content"] if "text" in block]
+        query = text_blocks[-1] if text_blocks else ""
+
+    return {
+        "query": query,
+        "query_words": len(query.split()),
+        "has_image": any("image" in block for message in messages for block in message["content"]),
+        "history_tokens": history_tokens,
+        "turns": sum(1 for message in messages if is_user_query(message)),
+    }
+
+
+def load_router(policy_file, models, vision_models, default_model_id):
+    """
+    Creates a router from a routing policy file.
+
+    :param policy_file: The path to the JSON routing policy, or None or an empty string to not route.
+    :param models: The model IDs by their SupportedModels names.
+    :param vision_models: The IDs of the models that accept images.
+    :param default_model_id: The model to use if the policy has no default model.
+    :return: The model router, or None if there is no policy.
+    """
+    if not policy_file:
+        return None
+    try:
+        with open(policy_file, "r") as f:
+            policy = json.load(f)
+    except FileNotFoundError:
+        logging.warning("Warning: The routing policy %s doesn't exist, all turns use %s.", policy_file, default_model_id)
+        return None
+    return ModelRouter(policy, models, vision_models, default_model_id)
+
+
+def _rule_matches(conditions, features):
+    """
+    :param conditions: The compiled conditions of a rule.
+    :param features: The features of the request.
+    :return: True if all conditions hold.
+    """
+    query = features["query"]
+    if "query_matches" in conditions and not any(p.search(query) for p in conditions["query_matches"]):
+        return False
+    if "query_excludes" in conditions and any(p.search(query) for p in conditions["query_excludes"]):
+        return False
+    if "has_image" in conditions and conditions["has_image"] != features["has_image"]:
+        return False
+
+    for feature in ("query_words", "history_tokens", "turns"):
+        if f"min_{feature}" in conditions and features[feature] < conditions[f"min_{feature}"]:
+            return False
+        if f"max_{feature}" in conditions and features[feature] > conditions[f"max_{feature}"]:
+            return False
+    return True
+
+
+def _model_id(models, name):
+    """
+    :param models: The model IDs by their SupportedModels names.
+    :param name: A SupportedModels name from the policy.
+    :return: The model ID.
+    """
+    if name not in models:
+        raise ValueError(f"Unknown model in the routing policy: '{name}' not in {sorted(models)}")
+    return models[name]
@@ -0,0 +1,311 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+"""
+Keeps conversations going when Amazon Bedrock throttles requests or responds slowly. Calls are retried with
+jittered exponential backoff, paced by an adaptive client-side limiter that learns the model's capacity from
+throttles, and fall back to the next model in a chain when a model stays unavailable. Slow calls can be hedged
+with a second request.
+"""
+
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+# Error codes of throttled requests. Errors raised in the middle of a response stream have lower camel case codes.
+THROTTLING_ERROR_CODES = {"throttlingexception", "toomanyrequestsexception", "servicequotaexceededexception"}
+
+# Error codes of transient failures that are worth retrying
+TRANSIENT_ERROR_CODES = {
+    "serviceunavailableexception",
+    "internalserverexception",
+    "modelnotreadyexception",
+    "modeltimeoutexception",
+    "modelstreamerrorexception",
+}
+
+# Error codes of models that can't be used at all, e.g. because access to the model hasn't been granted.
+# The call falls back to the next model without retrying.
+UNAVAILABLE_MODEL_ERROR_CODES = {"accessdeniedexception", "resourcenotfoundexception"}
+
+# The defaults of the adaptive limiter, overridden by BEDROCK_MAX_CONCURRENCY and BEDROCK_MAX_REQUESTS_PER_SECOND
+DEFAULT_MAX_CONCURRENCY = 64
+DEFAULT_MAX_REQUESTS_PER_SECOND = 50
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+# Runs the requests of hedged calls
+_hedge_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="hedge")
+
+
+def error_code(error):
+    """
+    :param error: The exception raised by a call.
+    :return: The lower case error code of an AWS error, or None for other exceptions.
+    """
+    response = getattr(error, "response", None)
+    if isinstance(response, dict):
+        return (response.get("Error", {}).get("Code") or "").lower() or None
+    return None
+
+
+def is_throttling_error(error):
+    """
+    :param error: The exception raised by a call.
+    :return: True if the request was throttled.
+    """
+    return error_code(error) in THROTTLING_ERROR_CODES
+
+
+def is_retryable_error(error):
+    """
+    Checks whether a call that failed may be retried. A response stream that failed after parts of the response
+    were already shown isn't retried, since the retry would show them again.
+
+    :param error: The exception raised by a call.
+    :return: True if the call may be retried.
+    """
+    if getattr(error, "partial_response", False):
+        return False
+    code = error_code(error)
+    if code is not None:
+        return code in THROTTLING_ERROR_CODES or code in TRANSIENT_ERROR_CODES
+
+    from botocore.exceptions import ConnectionClosedError, ConnectTimeoutError, EndpointConnectionError, ReadTimeoutError
+
+    return isinstance(error, (ReadTimeoutError, ConnectTimeoutError, EndpointConnectionError, ConnectionClosedError))
+
+
+def backoff_delay(attempt, base_seconds=0.5, max_seconds=8.0):
+    """
+    Computes the delay before a retry with exponential backoff and full jitter, so clients that were throttled
+    at the same time don't retry at the same time.
+
+    :param attempt: The number of the failed attempt, starting at 0.
+    :param base_seconds: The maximum delay after the first attempt.
+    :param max_seconds: The maximum delay.
+    :return: The delay in seconds.
+    """
+    return random.uniform(0, min(max_seconds, base_seconds * 2 ** attempt))
+
+
+class AdaptiveLimiter:
+    """
+    Limits the requests to a model, both the number of concurrent requests and the request rate with a token
+    bucket. Both limits adapt to the model's capacity: they're halved on every throttled request and grow again
+    with every successful one (additive increase, multiplicative decrease), so clients back off together when
+    the model's quota is exhausted instead of amplifying the load with retries.
+    """
+
+    def __init__(self, max_concurrency=DEFAULT_MAX_CONCURRENCY, max_requests_per_second=DEFAULT_MAX_REQUESTS_PER_SECOND):
+        """
+        :param max_concurrency: The maximum number of concurrent requests, and the initial limit.
+        :param max_requests_per_second: The maximum request rate, and the initial rate.
+        """
+        self.max_concurrency = max_concurrency
+        self.max_requests_per_second = max_requests_per_second
+
+        self.concurrency_limit = float(max_concurrency)
+        self.requests_per_second = float(max_requests_per_second)
+
+        self._condition = threading.Condition()
+        self._in_flight = 0
+        self._tokens = float(max_requests_per_second)
+        self._refilled_at = time.monotonic()
+
+    def acquire(self):
+        """
+        Waits until a request may be sent.
+        """
+        with self._condition:
+            while not self._try_acquire():
+                wait_seconds = None
+                if self._tokens < 1:
+                    wait_seconds = (1 - self._tokens) / self.requests_per_second
+                self._condition.wait(timeout=wait_seconds)
+
+    def try_acquire(self):
+        """
+        :return: True if a request may be sent right away, in which case it must be released.
+        """
+        with self._condition:
+            return self._try_acquire()
+
+    def release(self, throttled=False):
+        """
+        Reports that a request has finished, and adapts the limits.
+
+        :param throttled: Whether the request was throttled.
+        """
+        with self._condition:
+            self._in_flight -= 1
+            if throttled:
+                self.concurrency_limit = max(1.0, self.concurrency_limit / 2)
+                self.requests_per_second = max(0.1, self.requests_per_second / 2)
+                logging.debug(
+                    "Throttled, reduced the limits to %.1f concurrent requests and %.1f requests per second.",
+                    self.concurrency_limit, self.requests_per_second,
+                )
+            else:
+                self.concurrency_limit = min(self.max_concurrency, self.concurrency_limit + 1 / self.concurrency_limit)
+                # Recover to the maximum rate within about 50 successful requests
+                self.requests_per_second = min(
+                    self.max_requests_per_second, self.requests_per_second + self.max_requests_per_second / 50
+                )
+            self._condition.notify_all()
+
+    def _try_acquire(self):
+        """
+        Takes a token and a concurrency slot if both are available. Must be called with the lock held.
+
+        :return: True if the request may be sent.
+        """
+        now = time.monotonic()
+        # The bucket holds up to a second's worth of requests, and at least one
+        self._tokens = min(
+            max(1.0, self.requests_per_second), self._tokens + (now - self._refilled_at) * self.requests_per_second
+        )
+        self._refilled_at = now
+
+        if self._in_flight < int(self.concurrency_limit) and self._tokens >= 1:
+            self._tokens -= 1
+            self._in_flight += 1
+            return True
+        return False
+
+
+def get_limiter(model_id):
+    """
+    Returns the process-wide limiter of a model, creating it on first use. Quotas apply per model, so all
+    sessions share the limiter of the model they use.
+
+    :param model_id: The model ID.
+    :return: The adaptive limiter.
+    """
+    with _limiters_lock:
+        limiter = _limiters.get(model_id)
+        if limiter is None:
+            limiter = AdaptiveLimiter(
+                max_concurrency=int(os.getenv('BEDROCK_MAX_CONCURRENCY', DEFAULT_MAX_CONCURRENCY)),
+                max_requests_per_second=float(
+                    os.getenv('BEDROCK_MAX_REQUESTS_PER_SECOND', DEFAULT_MAX_REQUESTS_PER_SECOND)
+                ),
+            )
+            _limiters[model_id] = limiter
+        return limiter
+
+
+class ResilientInvoker:
+    """
+    Calls a model with retries, adaptive limiting, model fallback, and optional hedging.
+    """
+
+    def __init__(self, model_ids, max_attempts=4, base_delay_seconds=0.5, max_delay_seconds=8.0, hedge_after_seconds=None):
+        """
+        :param model_ids: The fallback chain: the preferred model first, followed by the models to fall back to.
+        :param max_attempts: The maximum number of attempts per model.
+        :param base_delay_seconds: The maximum backoff delay after the first failed attempt.
+        :param max_delay_seconds: The maximum backoff delay.
+        :param hedge_after_seconds: The time after which a second request is sent if the first one hasn't returned,
+            or None to not hedge. The first response to arrive is used.
+        """
+        self.model_ids = list(dict.fromkeys(model_ids))
+        self.max_attempts = max_attempts
+        self.base_delay_seconds = base_delay_seconds
+        self.max_delay_seconds = max_delay_seconds
+        self.hedge_after_seconds = hedge_after_seconds
+
+    def invoke(self, request, hedge=False, model_ids=None):
+        """
+        Calls the models of the fallback chain until one returns a response.
+
+        :param request: A function that takes a model ID, sends the request to that model, and returns the response.
+        :param hedge: Whether the request may be hedged. Only requests without side effects, like printing
+            a streamed response, may be hedged.
+        :param model_ids: The fallback chain of this call, e.g. starting with the model a turn was routed to;
+            or None to use the invoker's chain.
+        :return: A tuple of the model ID that returned the response and the response.
+        :raises ValueError: If the fallback chain is empty, or no model was called.
+        """
+        model_ids = self.model_ids if model_ids is None else list(dict.fromkeys(model_ids))
+        last_error = None
+        for model_index, model_id in enumerate(model_ids):
+            if model_index > 0:
+                logging.warning("Warning: Falling back from %s to %s.", model_ids[model_index - 1], model_id)
+
+            limiter = get_limiter(model_id)
+            for attempt in range(self.max_attempts):
+                try:
+                    if hedge and self.hedge_after_seconds is not None:
+                        return model_id, self._invoke_hedged(request, model_id, limiter)
+                    return model_id, self._invoke_once(request, model_id, limiter)
+                except Exception as e:
+                    last_error = e
+                    if error_code(e) in UNAVAILABLE_MODEL_ERROR_CODES:
+                        logging.warning("Warning: The model %s is unavailable: %s", model_id, e)
+                        break
+                    if not is_retryable_error(e):
+                        raise
+
+                if attempt + 1 < self.max_attempts:
+                    delay = backoff_delay(attempt, self.base_delay_seconds, self.max_delay_seconds)
+                    logging.info("Retrying %s in %.1f seconds after: %s", model_id, delay, last_error)
+                    time.sleep(delay)
+
+        if last_error is None:
+            raise ValueError(f"No model was called, the fallback chain {model_ids} has no model to call.")
+        raise last_error
+
+    @staticmethod
+    def _invoke_once(request, model_id, limiter, acquired=False):
+        """
+        Sends a single request within the model's limits.
+
+        :param request: The request function.
+        :param model_id: The model ID.
+        :param limiter: The model's limiter.
+        :param acquired: Whether the limiter has already been acquired for this request.
+        :return: The response.
+        """
+        if not acquired:
+            limiter.acquire()
+        throttled = False
+        try:
+            return request(model_id)
+        except Exception as e:
+            throttled = is_throttling_error(e)
+            raise
+        finally:
+            limiter.release(throttled)
+
+    def _invoke_hedged(self, request, model_id, limiter):
+        """
+        Sends a request, and a second one if the first hasn't returned after the hedge delay. The hedge is only
+        sent if the limiter has spare capacity, so hedging never adds load to a model that is throttling.
+
+        :param request: The request function.
+        :param model_id: The model ID.
+        :param limiter: The model's limiter.
+        :return: The first successful response, or the first error if both requests fail.
+        """
+        pending = {_hedge_executor.submit(self._invoke_once, request, model_id, limiter)}
+        done, pending = wait(pending, timeout=self.hedge_after_seconds)
+
+        if not done and limiter.try_acquire():
+            logging.debug("Hedging a request to %s after %.1f seconds.", model_id, self.hedge_after_seconds)
+            pending.add(_hedge_executor.submit(self._invoke_once, request, model_id, limiter, True))
+
+        first_error = None
+        while True:
+            for future in done:
+                if future.exception() is None:
+                    # The slower request keeps running to its end, but its response is ignored
+                    return future.result()
+                first_error = first_error or future.exception()
+            if not pending:
+                raise first_error
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
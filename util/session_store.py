@@ -0,0 +1,296 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+"""
+Persists conversations on disk, so a session can be resumed after the app stops or crashes. Each session is
+a directory with three files:
+
+- session.json: the session's metadata, like its diagram; written once when the session is created
+- turns.jsonl: one JSON line per turn with the turn's messages; turns are only ever appended
+- index.jsonl: one JSON line per turn with the offset and length of the turn in turns.jsonl, and short
+  snippets of the turn's question and answer
+
+Binary values, like the bytes of the diagram, aren't embedded in the messages. They're stored once in a blob
+directory shared by all sessions, named after their SHA-256 hash, and the messages reference them with
+{"$blob": hash}.
+
+Resuming a session reads the index, and only the turns that are needed: the first turn, which has the
+diagram, and the most recent turns. The turns in between are represented by their question and answer
+snippets, which is how the history manager summarizes old turns anyway; load_turn reads them on demand.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+from util.conversation_history import SUMMARY_SNIPPET_CHARS
+
+SESSION_FORMAT_VERSION = 1
+
+# The key of the object that references a blob in a stored message
+BLOB_KEY = "$blob"
+
+
+class SessionStore:
+    """
+    Creates and opens sessions in a directory, and stores the blobs they reference.
+    """
+
+    def __init__(self, directory):
+        """
+        :param directory: The directory of the sessions; created on the first write.
+        """
+        self.directory = directory
+        self.blob_directory = os.path.join(directory, "blobs")
+        self._lock = threading.Lock()
+        self._blobs = {}
+
+    def create(self, metadata=None):
+        """
+        Creates a session.
+
+        :param metadata: The session's metadata, e.g. its diagram; JSON-serializable.
+        :return: The session.
+        """
+        session_id = uuid.uuid4().hex[:12]
+        metadata = {
+            "version": SESSION_FORMAT_VERSION,
+            "id": session_id,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            **(metadata or {}),
+        }
+        session_directory = os.path.join(self.directory, session_id)
+        os.makedirs(session_directory, exist_ok=True)
+        _write_atomically(os.path.join(session_directory, "session.json"), json.dumps(metadata, indent=2).encode("utf-8"))
+        return Session(self, session_directory, metadata, [])
+
+    def open(self, session_id):
+        """
+        Opens a session to resume it. Only the metadata and the index are read.
+
+        :param session_id: The ID of the session.
+        :return: The session.
+        :raises ValueError: If the session doesn't exist or was written by an incompatible version.
+        """
+        session_directory = os.path.join(self.directory, os.path.basename(session_id))
+        try:
+            with open(os.path.join(session_directory, "session.json"), "r", encoding="utf-8") as f:
+                metadata = json.load(f)
+        except FileNotFoundError:
+            raise ValueError(f"The session '{session_id}' does not exist.")
+        if metadata.get("version") != SESSION_FORMAT_VERSION:
+            raise ValueError(f"The session '{session_id}' has the unsupported format version {metadata.get('version')}.")
+
+        return Session(self, session_directory, metadata, _read_index(session_directory))
+
+    def put_blob(self, data):
+        """
+        Stores a blob, unless a blob with the same content is already stored.
+
+        :param data: The bytes.
+        :return: The hash of the blob.
+        """
+        blob_hash = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            if blob_hash in self._blobs:
+                return blob_hash
+
+        path = self._blob_path(blob_hash)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            _write_atomically(path, data)
+
+        with self._lock:
+            self._blobs[blob_hash] = data
+        return blob_hash
+
+    def get_blob(self, blob_hash):
+        """
+        :param blob_hash: The hash of the blob.
+        :return: The bytes. Blobs are kept in memory once read, so all messages that reference the same blob
+            share one copy.
+        """
+        with self._lock:
+            if blob_hash in self._blobs:
+                return self._blobs[blob_hash]
+
+        with open(self._blob_path(blob_hash), "rb") as f:
+            data = f.read()
+
+        with self._lock:
+            return self._blobs.setdefault(blob_hash, data)
+
+    def encode(self, value):
+        """
+        Replaces the binary values in messages with references to stored blobs.
+
+        :param value: The messages, or any value made of dicts, lists, strings, bytes, and numbers.
+        :return: The value without binary values.
+        """
+        if isinstance(value, (bytes, bytearray)):
+            return {BLOB_KEY: self.put_blob(bytes(value))}
+        if isinstance(value, dict):
+            return {key: self.encode(item) for key, item in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [self.encode(item) for item in value]
+        return value
+
+    def decode(self, value):
+        """
+        Replaces the blob references in stored messages with the blobs' bytes, see encode.
+
+        :param value: The stored value.
+        :return: The value with its binary values.
+        """
+        if isinstance(value, dict):
+            if len(value) == 1 and BLOB_KEY in value:
+                return self.get_blob(value[BLOB_KEY])
+            return {key: self.decode(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [self.decode(item) for item in value]
+        return value
+
+    def _blob_path(self, blob_hash):
+        """
+        :return: The path of a blob, in a subdirectory by the first two characters of its hash.
+        """
+        return os.path.join(self.blob_directory, blob_hash[:2], blob_hash)
+
+
+class Session:
+    """
+    A stored conversation. Turns are appended as they complete, and read one at a time.
+    """
+
+    def __init__(self, store, directory, metadata, index):
+        """
+        :param store: The session store, which stores the blobs.
+        :param directory: The directory of the session.
+        :param metadata: The session's metadata.
+        :param index: The index entries of the stored turns.
+        """
+        self.store = store
+        self.directory = directory
+        self.metadata = metadata
+        self.id = metadata["id"]
+        self._index = index
+        self._lock = threading.Lock()
+
+    @property
+    def turn_count(self):
+        """
+        :return: The number of stored turns.
+        """
+        return len(self._index)
+
+    def append_turn(self, messages):
+        """
+        Appends a turn to the session. Only the turn is written; the files of the session are never rewritten.
+        The turn is written before its index entry, so a turn that was cut off by a crash is never read.
+
+        :param messages: The messages of the turn, starting with the user's query.
+        """
+        stored_messages = self.store.encode(messages)
+        line = (json.dumps({"messages": stored_messages}, separators=(",", ":")) + "\n").encode("utf-8")
+        question = " ".join(block["text"] for block in messages[0]["content"] if "text" in block)
+        answer = " ".join(block["text"] for block in messages[-1]["content"] if "text" in block)
+
+        with self._lock:
+            try:
+                with open(os.path.join(self.directory, "turns.jsonl"), "ab") as f:
+                    offset = f.seek(0, os.SEEK_END)
+                    f.write(line)
+                    f.flush()
+                    os.fsync(f.fileno())
+
+                entry = {
+                    "offset": offset,
+                    "length": len(line),
+                    "question": question[:SUMMARY_SNIPPET_CHARS],
+                    "answer": answer[:SUMMARY_SNIPPET_CHARS] if messages[-1]["role"] == "assistant" else "",
+                }
+                with open(os.path.join(self.directory, "index.jsonl"), "a", encoding="utf-8") as f:
+                    f.write(json.dumps(entry) + "\n")
+                    f.flush()
+                    os.fsync(f.fileno())
+            except OSError as e:
+                logging.warning("Warning: Couldn't save the turn of session %s: %s", self.id, e)
+                return
+            self._index.append(entry)
+
+    def load_turn(self, turn_index):
+        """
+        Reads a turn from disk.
+
+        :param turn_index: The index of the turn, starting at 0.
+        :return: The messages of the turn.
+        """
+        entry = self._index[turn_index]
+        with open(os.path.join(self.directory, "turns.jsonl"), "rb") as f:
+            f.seek(entry["offset"])
+            record = json.loads(f.read(entry["length"]))
+        return self.store.decode(record["messages"])
+
+    def load_conversation(self, recent_turns):
+        """
+        Rebuilds the conversation to resume the session. The first turn and the most recent turns are read in
+        full; each turn in between is replaced by its question and answer snippets, in a user and an assistant
+        message, without reading it.
+
+        :param recent_turns: The number of most recent turns to read in full.
+        :return: The conversation.
+        """
+        turn_count = self.turn_count
+        conversation = []
+        for turn_index in range(turn_count):
+            if turn_index == 0 or turn_index >= turn_count - recent_turns:
+                conversation.extend(self.load_turn(turn_index))
+            else:
+                entry = self._index[turn_index]
+                conversation.append({"role": "user", "content": [{"text": entry["question"] or "(no question)"}]})
+                conversation.append({"role": "assistant", "content": [{"text": entry["answer"] or "(no answer)"}]})
+        return conversation
+
+
+def _read_index(session_directory):
+    """
+    Reads the index of a session. Entries that were cut off, or whose turn is missing from the turns file,
+    are left out.
+
+    :param session_directory: The directory of the session.
+    :return: The index entries, one per turn.
+    """
+    try:
+        turns_size = os.path.getsize(os.path.join(session_directory, "turns.jsonl"))
+        with open(os.path.join(session_directory, "index.jsonl"), "r", encoding="utf-8") as f:
+            lines = f.read().splitlines()
+    except FileNotFoundError:
+        return []
+
+    index = []
+    for line in lines:
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            break
+        if entry["offset"] + entry["length"] > turns_size:
+            break
+        index.append(entry)
+    return index
+
+
+def _write_atomically(path, data):
+    """
+    Writes a file, replacing it atomically, so readers never see a partial file.
+
+    :param path: The path of the file.
+    :param data: The bytes.
+    """
+    temporary_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(temporary_path, "wb") as f:
+        f.write(data)
+    os.replace(temporary_path, path)
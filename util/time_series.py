@@ -0,0 +1,300 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import math
+import os
+import threading
+
+import numpy as np
+
+SECONDS_PER_HOUR = 3600
+
+# The aggregates a window query can request
+AGGREGATES = ("count", "min", "max", "mean", "p50", "p90", "p95", "p99", "first", "last", "trend_per_hour")
+
+
+class TimeSeries:
+    """
+    A compact, array-backed time series of numeric samples. Samples are appended to a CSV file and kept in memory
+    in two NumPy arrays, sorted by time, so window queries are a binary search plus vectorized aggregation.
+
+    Older samples are downsampled to hourly means, and samples beyond the retention period are dropped. This
+    happens in memory when the file is read, and in the file when a sample is appended, at most once per hour.
+    """
+
+    def __init__(self, file_path, value_name, downsample_after_hours=7 * 24, retention_hours=90 * 24):
+        """
+        :param file_path: The path to the CSV file with a timestamp column and a value column.
+        :param value_name: The name of the value column.
+        :param downsample_after_hours: The age in hours after which samples are downsampled to hourly means.
+        :param retention_hours: The age in hours after which samples are dropped.
+        """
+        self.file_path = file_path
+        self.value_name = value_name
+        self.downsample_after_hours = downsample_after_hours
+        self.retention_hours = retention_hours
+
+        self._lock = threading.Lock()
+        self._mtime_ns = None
+        self._timestamps = np.zeros(0, dtype="datetime64[s]")
+        self._values = np.zeros(0, dtype=np.float64)
+        self._size = 0
+        # The end of the downsampled samples at the last compaction check; later samples are raw
+        self._compacted_until = None
+
+    def append(self, timestamp, value):
+        """
+        Appends a sample to the file and to the in-memory series.
+
+        :param timestamp: The time of the sample as a numpy.datetime64, datetime, or ISO 8601 string.
+        :param value: The value of the sample.
+        """
+        timestamp = np.datetime64(timestamp, "s")
+        self._reload_if_changed()
+
+        with self._lock:
+            write_header = not os.path.exists(self.file_path) or os.path.getsize(self.file_path) == 0
+            with open(self.file_path, "a") as f:
+                if write_header:
+                    f.write(f"timestamp,{self.value_name}\n")
+                f.write(f"{timestamp}Z,{value}\n")
+            self._mtime_ns = os.stat(self.file_path).st_mtime_ns
+            self._insert(timestamp, float(value))
+            if self._compact_if_due():
+                self._rewrite_file()
+
+    def latest(self):
+        """
+        :return: A tuple of the time and value of the most recent sample, or None if the series is empty.
+        """
+        self._reload_if_changed()
+        with self._lock:
+            if self._size == 0:
+                return None
+            return self._timestamps[self._size - 1], self._values[self._size - 1]
+
+    def aggregate(self, window_hours, aggregates=AGGREGATES, end=None):
+        """
+        Aggregates the samples in a time window.
+
+        :param window_hours: The length of the window in hours.
+        :param aggregates: The names of the aggregates to compute, see AGGREGATES.
+        :param end: The end of the window; defaults to the time of the most recent sample.
+        :return: A dict with the window's start and end and the requested aggregates. Aggregates other
+            than the count are None if the window has no samples.
+        """
+        unknown = set(aggregates) - set(AGGREGATES)
+        if unknown:
+            raise ValueError(f"Unknown aggregates {sorted(unknown)}, expected some of {list(AGGREGATES)}.")
+        if not math.isfinite(window_hours) or window_hours <= 0:
+            raise ValueError(f"The window must be a positive number of hours, got {window_hours}.")
+
+        self._reload_if_changed()
+        with self._lock:
+            timestamps = self._timestamps[:self._size]
+            values = self._values[:self._size]
+            if end is None:
+                end = timestamps[-1] if self._size else np.datetime64("now", "s")
+            end = np.datetime64(end, "s")
+            try:
+                start = end - np.timedelta64(int(window_hours * SECONDS_PER_HOUR), "s")
+            except OverflowError:
+                start = None
+            # A window beyond the range of the timestamps overflows, or wraps around past the end
+            if start is None or start >= end:
+                raise ValueError(f"The window of {window_hours} hours is too long.")
+
+            # The samples are sorted by time, so the window is a contiguous slice
+            first, last = np.searchsorted(timestamps, [start, end], side="right")
+            window_timestamps = timestamps[first:last]
+            window_values = values[first:last]
+
+        result = {"window_start": f"{start}Z", "window_end": f"{end}Z"}
+        for name in aggregates:
+            result[name] = _compute_aggregate(name, window_timestamps, window_values)
+        return result
+
+    def compact(self, now=None):
+        """
+        Downsamples old samples to hourly means and drops samples beyond the retention period, both in memory
+        and in the file.
+
+        :param now: The current time; defaults to the time of the most recent sample.
+        """
+        self._reload_if_changed()
+        with self._lock:
+            self._compact(now)
+            self._rewrite_file()
+
+    def _compact_if_due(self):
+        """
+        Compacts the samples in memory if old samples have to be downsampled or dropped. The check runs at
+        most once per hour of the series' time, so appending stays cheap. Must be called with the lock held.
+
+        :return: True if the samples were compacted.
+        """
+        if self._size == 0:
+            return False
+        now = self._timestamps[self._size - 1]
+        retention_start, downsample_end = self._compaction_bounds(now)
+        if self._compacted_until is not None and downsample_end <= self._compacted_until:
+            return False
+        self._compacted_until = downsample_end
+
+        timestamps = self._timestamps[:self._size]
+        first_kept, first_raw = np.searchsorted(timestamps, [retention_start, downsample_end], side="left")
+        old_timestamps = timestamps[first_kept:first_raw]
+        old_hours = old_timestamps.astype("datetime64[h]")
+
+        # Downsampled samples are on the hour, one per hour, so compacting them again changes nothing
+        if first_kept == 0 and np.all(old_timestamps == old_hours) and np.all(np.diff(old_hours) > np.timedelta64(0, "h")):
+            return False
+        self._compact(now)
+        return True
+
+    def _compaction_bounds(self, now):
+        """
+        :param now: The current time.
+        :return: A tuple of the start of the retention period and the end of the downsampled samples. Both are
+            on the hour, like the downsampled samples, so no hour is downsampled or dropped only in part.
+        """
+        retention_start = now - np.timedelta64(self.retention_hours * SECONDS_PER_HOUR, "s")
+        downsample_end = now - np.timedelta64(self.downsample_after_hours * SECONDS_PER_HOUR, "s")
+        return (
+            retention_start.astype("datetime64[h]").astype("datetime64[s]"),
+            downsample_end.astype("datetime64[h]").astype("datetime64[s]"),
+        )
+
+    def _compact(self, now=None):
+        """
+        Downsamples and drops old samples in memory. Must be called with the lock held.
+
+        :param now: The current time; defaults to the time of the most recent sample.
+        """
+        if self._size == 0:
+            return
+        timestamps = self._timestamps[:self._size]
+        values = self._values[:self._size]
+        now = timestamps[-1] if now is None else np.datetime64(now, "s")
+
+        retention_start, downsample_end = self._compaction_bounds(now)
+        first_kept, first_raw = np.searchsorted(timestamps, [retention_start, downsample_end], side="left")
+
+        # Average the old samples per hour, vectorized: group by hour bucket with unique and bincount
+        old_hours = timestamps[first_kept:first_raw].astype("datetime64[h]")
+        hours, bucket_of_sample = np.unique(old_hours, return_inverse=True)
+        means = np.bincount(bucket_of_sample, weights=values[first_kept:first_raw]) / np.bincount(bucket_of_sample)
+
+        self._timestamps = np.concatenate([hours.astype("datetime64[s]"), timestamps[first_raw:]])
+        self._values = np.concatenate([means, values[first_raw:]])
+        self._size = len(self._values)
+
+    def _insert(self, timestamp, value):
+        """
+        Inserts a sample in memory, keeping the samples sorted by time. Must be called with the lock held.
+        Appending in time order, the common case, is amortized constant time.
+
+        :param timestamp: The time of the sample.
+        :param value: The value of the sample.
+        """
+        if self._size == len(self._values):
+            capacity = max(16, 2 * self._size)
+            self._timestamps = np.resize(self._timestamps, capacity)
+            self._values = np.resize(self._values, capacity)
+
+        index = self._size
+        if self._size and timestamp < self._timestamps[self._size - 1]:
+            index = int(np.searchsorted(self._timestamps[:self._size], timestamp, side="right"))
+            self._timestamps[index + 1:self._size + 1] = self._timestamps[index:self._size]
+            self._values[index + 1:self._size + 1] = self._values[index:self._size]
+
+        self._timestamps[index] = timestamp
+        self._values[index] = value
+        self._size += 1
+
+    def _reload_if_changed(self):
+        """
+        Reads the file if it changed since it was last read, e.g. because another process appended samples.
+        """
+        try:
+            mtime_ns = os.stat(self.file_path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime_ns == self._mtime_ns:
+            return
+
+        timestamps, values = [], []
+        with open(self.file_path, "r") as f:
+            next(f, None)
+            for line in f:
+                timestamp, _, value = line.strip().partition(",")
+                if timestamp:
+                    timestamps.append(timestamp.rstrip("Z"))
+                    values.append(float(value))
+
+        timestamps = np.array(timestamps, dtype="datetime64[s]")
+        values = np.array(values, dtype=np.float64)
+        order = np.argsort(timestamps, kind="stable")
+
+        with self._lock:
+            self._timestamps = timestamps[order]
+            self._values = values[order]
+            self._size = len(values)
+            self._mtime_ns = mtime_ns
+            self._compacted_until = None
+            self._compact_if_due()
+
+    def _rewrite_file(self):
+        """
+        Replaces the file with the in-memory samples. Must be called with the lock held.
+        """
+        temporary_path = self.file_path + ".tmp"
+        with open(temporary_path, "w") as f:
+            f.write(f"timestamp,{self.value_name}\n")
+            for timestamp, value in zip(self._timestamps[:self._size], self._values[:self._size]):
+                f.write(f"{timestamp}Z,{_format_value(value)}\n")
+        os.replace(temporary_path, self.file_path)
+        self._mtime_ns = os.stat(self.file_path).st_mtime_ns
+
+
+def _format_value(value):
+    """
+    :param value: The value of a sample.
+    :return: The value as text, without rounding; whole numbers, like counts, without a fractional part.
+    """
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def _compute_aggregate(name, timestamps, values):
+    """
+    Computes an aggregate of the samples in a window.
+
+    :param name: The name of the aggregate.
+    :param timestamps: The times of the samples.
+    :param values: The values of the samples.
+    :return: The aggregate value.
+    """
+    if name == "count":
+        return int(len(values))
+    if len(values) == 0:
+        return None
+    if name == "min":
+        return float(values.min())
+    if name == "max":
+        return float(values.max())
+    if name == "mean":
+        return round(float(values.mean()), 2)
+    if name.startswith("p"):
+        return round(float(np.percentile(values, int(name[1:]))), 2)
+    if name == "first":
+        return float(values[0])
+    if name == "last":
+        return float(values[-1])
+    if name == "trend_per_hour":
+        if len(values) < 2:
+            return 0.0
+        # The slope of the least-squares line through the samples
+        hours = (timestamps - timestamps[0]).astype(np.float64) / SECONDS_PER_HOUR
+        return round(float(np.polyfit(hours, values, 1)[0]), 3)
+    raise ValueError(f"Unknown aggregate '{name}'.")
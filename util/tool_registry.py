@@ -0,0 +1,146 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import importlib
+import json
+import os
+import threading
+import unicodedata
+
+
+class ToolRegistry:
+    """
+    A registry of the tools the model can use. Each tool declares its specification and its handler as
+    "module:function" references, which are only resolved when they're first needed. Tool modules keep their
+    heavy dependencies out of module scope, so declaring tools at startup doesn't import them; the handler's
+    dependencies are imported on the tool's first invocation.
+    """
+
+    def __init__(self):
+        self._tools = {}
+        self._lock = threading.Lock()
+
+    def register(self, name, spec, handler, result_ttl_seconds=0, canonicalize=None):
+        """
+        Registers a tool.
+
+        :param name: The name of the tool, as in its specification.
+        :param spec: The tool specification, a function returning it, or a "module:function" reference to one.
+        :param handler: The function that takes the tool's input data and returns its response, or a
+            "module:function" reference to it.
+        :param result_ttl_seconds: How long the tool's results can be reused within a session; 0 if they can't.
+        :param canonicalize: The function that converts the tool's input data to a canonical form, so inputs
+            that mean the same have the same result; a "module:function" reference to it; or None to only
+            normalize the case and whitespace of strings.
+        """
+        with self._lock:
+            self._tools[name] = {
+                "spec": spec,
+                "handler": handler,
+                "result_ttl_seconds": result_ttl_seconds,
+                "canonicalize": canonicalize or canonicalize_input,
+            }
+
+    def __contains__(self, name):
+        return name in self._tools
+
+    def get_tool_config(self):
+        """
+        Returns the tool configuration for the Converse API.
+
+        :return: The tool configuration with the specifications of all registered tools.
+        """
+        return {"tools": [self._resolve(name, "spec") for name in self._tools]}
+
+    def invoke(self, name, input_data):
+        """
+        Invokes a tool, importing its handler on first use.
+
+        :param name: The name of the tool.
+        :param input_data: The input data for the tool.
+        :return: The tool's response.
+        """
+        return self._resolve(name, "handler")(input_data)
+
+    def result_ttl(self, name):
+        """
+        :param name: The name of the tool.
+        :return: How long the tool's results can be reused, in seconds.
+        """
+        return self._tools[name]["result_ttl_seconds"]
+
+    def result_key(self, name, input_data):
+        """
+        :param name: The name of the tool.
+        :param input_data: The input data for the tool.
+        :return: The key of the tool's result for the input, which is the same for inputs that mean the same.
+        """
+        canonical_input = self._resolve(name, "canonicalize")(input_data or {})
+        return name, json.dumps(canonical_input, sort_keys=True, separators=(",", ":"), default=str)
+
+    def _resolve(self, name, kind):
+        """
+        Resolves a tool's specification or handler, importing its module if necessary. Specifications are
+        resolved to their value, handlers to the function, and both are cached.
+
+        :param name: The name of the tool.
+        :param kind: "spec", "handler", or "canonicalize".
+        :return: The specification or function.
+        """
+        tool = self._tools[name]
+        value = tool[kind]
+        if isinstance(value, str):
+            module_name, _, attribute = value.partition(":")
+            # import_module is thread-safe; concurrent first invocations import the module once
+            value = getattr(importlib.import_module(module_name), attribute)
+        if kind == "spec" and callable(value):
+            value = value()
+        tool[kind] = value
+        return value
+
+
+def canonicalize_input(input_data):
+    """
+    The default canonical form of a tool's input: strings are case-folded, with their whitespace collapsed.
+
+    :param input_data: The input data, made of dicts, lists, strings, and numbers.
+    :return: The canonical input data.
+    """
+    if isinstance(input_data, str):
+        return " ".join(unicodedata.normalize("NFKC", input_data).casefold().split())
+    if isinstance(input_data, dict):
+        return {key: canonicalize_input(value) for key, value in input_data.items()}
+    if isinstance(input_data, list):
+        return [canonicalize_input(value) for value in input_data]
+    return input_data
+
+
+def create_default_registry():
+    """
+    Creates the registry of the demo's tools. Audit records change rarely, so their results are reused for
+    minutes; the joy count is live, so its results are only reused for seconds. The time each tool's results
+    are reused can be changed with the <TOOL>_RESULT_TTL_SECONDS environment variables.
+
+    :return: The tool registry.
+    """
+    registry = ToolRegistry()
+    registry.register(
+        "Audit_Info_Tool",
+        "audit_info_tool:get_tool_spec",
+        "audit_info_tool:fetch_audit_info_data",
+        result_ttl_seconds=float(os.getenv('AUDIT_INFO_RESULT_TTL_SECONDS', '300')),
+        canonicalize="audit_info_tool:canonicalize_input",
+    )
+    registry.register(
+        "Joy_Count_Tool",
+        "joy_count_tool:get_tool_spec",
+        "joy_count_tool:fetch_joy_count_data",
+        result_ttl_seconds=float(os.getenv('JOY_COUNT_RESULT_TTL_SECONDS', '30')),
+    )
+    registry.register(
+        "Best_Practices_Tool",
+        "best_practices_tool:get_tool_spec",
+        "best_practices_tool:fetch_best_practices_data",
+        result_ttl_seconds=float(os.getenv('BEST_PRACTICES_RESULT_TTL_SECONDS', '600')),
+    )
+    return registry
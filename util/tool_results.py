@@ -0,0 +1,146 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+"""
+Reuses tool results within a session. Results are keyed by the tool's name and its canonicalized input, and
+stay fresh for the time the tool declares in the registry, e.g. minutes for audit records but only seconds for
+the live joy count. Error results aren't reused.
+
+Results can also be fetched speculatively, before the model asks for them, e.g. the audit info of the system
+as soon as its diagram is selected. A tool call that arrives while the same result is still being fetched waits
+for it instead of invoking the tool again.
+"""
+
+import threading
+import time
+from concurrent.futures import Future
+
+
+class ToolResultCache:
+    """
+    The tool results of a session, by tool name and canonicalized input.
+    """
+
+    def __init__(self, registry, clock=time.monotonic):
+        """
+        :param registry: The tool registry, which invokes the tools and declares their freshness.
+        :param clock: The function that returns the current time in seconds.
+        """
+        self.registry = registry
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def invoke(self, name, input_data):
+        """
+        Returns the tool's result for the input: a fresh result fetched earlier, the result of a fetch that is
+        in progress, or the result of a new invocation.
+
+        :param name: The name of the tool.
+        :param input_data: The input data for the tool.
+        :return: A tuple of the tool's response and how it was obtained: "hit" for a result fetched earlier,
+            "prefetched" for a speculative result, or "miss" for a new invocation.
+        """
+        key = self.registry.result_key(name, input_data)
+        with self._lock:
+            entry = self._fresh_entry(key)
+            if entry is None:
+                entry = self._start(key, prefetched=False)
+                status = "miss"
+                self.misses += 1
+            else:
+                status = "prefetched" if entry["prefetched"] else "hit"
+                entry["prefetched"] = False
+                self.hits += 1
+
+        if status == "miss":
+            self._fetch(key, entry, name, input_data)
+
+        # A fetch that fails is passed to the callers waiting for it, but isn't reused afterwards
+        return entry["future"].result(), status
+
+    def prefetch(self, name, input_data, executor):
+        """
+        Fetches the tool's result in the background, unless a fresh result or a fetch is already there.
+
+        :param name: The name of the tool.
+        :param input_data: The input data for the tool.
+        :param executor: The executor that runs the tool.
+        :return: True if a fetch was started.
+        """
+        key = self.registry.result_key(name, input_data)
+        with self._lock:
+            if self._fresh_entry(key) is not None:
+                return False
+            entry = self._start(key, prefetched=True)
+
+        try:
+            executor.submit(self._fetch, key, entry, name, input_data)
+        except RuntimeError:
+            # The executor has been shut down with its session
+            self._discard(key, entry)
+            return False
+        return True
+
+    def _start(self, key, prefetched):
+        """
+        Registers a fetch in progress; must be called with the lock held.
+
+        :param key: The key of the result.
+        :param prefetched: Whether the fetch is speculative.
+        :return: The entry of the result.
+        """
+        entry = {"future": Future(), "fetched_at": None, "prefetched": prefetched}
+        self._entries[key] = entry
+        return entry
+
+    def _fetch(self, key, entry, name, input_data):
+        """
+        Invokes the tool, and completes the entry with its result. Errors are passed to the waiting callers,
+        but the entry is removed, so the next call invokes the tool again.
+
+        :param key: The key of the result.
+        :param entry: The entry of the result.
+        :param name: The name of the tool.
+        :param input_data: The input data for the tool.
+        """
+        try:
+            response = self.registry.invoke(name, input_data)
+        except Exception as e:
+            self._discard(key, entry)
+            entry["future"].set_exception(e)
+            return
+
+        if self.registry.result_ttl(name) <= 0 or (isinstance(response, dict) and response.get("error") == "true"):
+            self._discard(key, entry)
+        else:
+            entry["fetched_at"] = self.clock()
+        entry["future"].set_result(response)
+
+    def _discard(self, key, entry):
+        """
+        Removes an entry, unless it has been replaced in the meantime.
+        """
+        with self._lock:
+            if self._entries.get(key) is entry:
+                del self._entries[key]
+
+    def _fresh_entry(self, key):
+        """
+        Returns the entry of a fetch in progress or of a fresh result; must be called with the lock held.
+
+        :param key: The key of the result.
+        :return: The entry, or None.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry["fetched_at"] is None:
+            return entry
+        name = key[0]
+        if self.clock() - entry["fetched_at"] < self.registry.result_ttl(name):
+            return entry
+        del self._entries[key]
+        return None
@@ -0,0 +1,399 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+"""
+Structured tracing of the conversation: each user turn, each call to Amazon Bedrock, each tool invocation, and
+each knowledge base retrieval is recorded as a span with its duration and attributes like the request payload
+size, the token usage, and the stop reason. Spans of the same user turn share a trace ID, and nested spans
+reference their parent.
+
+Finished spans are passed to the exporters set with the TRACE_EXPORTERS environment variable, a comma-separated
+list of the following. Exporters with a start(span) method are also told when a span opens.
+
+- jsonl: appends each span as a JSON line to TRACE_FILE (default: traces.jsonl)
+- prometheus: aggregates the spans into Prometheus metrics, rendered in the text exposition format. The chat
+  server serves them at /metrics; with METRICS_FILE, they're also written to that file after each trace.
+- console: prints a line with the duration and attributes of each span, next to the conversation
+
+The interactive demo always has a console exporter, which prints the progress of each turn, like the calls to
+the model, and the turn's latency and tokens when it ends; the console output has no other instrumentation.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+DEFAULT_TRACE_FILE = "traces.jsonl"
+
+# The upper bounds of the span duration histogram buckets in seconds
+DURATION_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# Span attributes that become labels of the Prometheus metrics. They must have few distinct values.
+LABEL_ATTRIBUTES = ("model_id", "tool", "backend", "cache")
+
+# Span attributes with token counts, and the token type they're exported as
+TOKEN_ATTRIBUTES = {
+    "input_tokens": "input",
+    "output_tokens": "output",
+    "cache_read_input_tokens": "cache_read",
+    "cache_write_input_tokens": "cache_write",
+}
+
+# The span that's currently open in this thread or task
+_current_span = ContextVar("current_span", default=None)
+
+_tracer = None
+_tracer_lock = threading.Lock()
+
+
+class Span:
+    """
+    A timed operation with attributes.
+    """
+
+    def __init__(self, name, trace_id, parent_id=None, attributes=None):
+        """
+        :param name: The name of the operation, e.g. "bedrock_call".
+        :param trace_id: The ID of the trace the span belongs to.
+        :param parent_id: The ID of the enclosing span, or None for the root span of a trace.
+        :param attributes: The initial attributes.
+        """
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.attributes = dict(attributes or {})
+        self.status = "ok"
+        self.start_time = time.time()
+        self.duration_ms = None
+        self._started_at = time.perf_counter()
+
+    def set(self, **attributes):
+        """
+        Adds or replaces attributes of the span.
+
+        :param attributes: The attributes; None values are ignored.
+        """
+        self.attributes.update({key: value for key, value in attributes.items() if value is not None})
+
+    def end(self):
+        """
+        Records the span's duration.
+        """
+        self.duration_ms = round((time.perf_counter() - self._started_at) * 1000, 3)
+
+    def to_dict(self):
+        """
+        :return: The span as a JSON-serializable dict.
+        """
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_time": self.start_time,
+            "duration_ms": self.duration_ms,
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+
+class Tracer:
+    """
+    Creates spans and passes them to the exporters when they end.
+    """
+
+    def __init__(self, exporters=None):
+        """
+        :param exporters: The exporters, each an object with an export(span) method.
+        """
+        self.exporters = list(exporters or [])
+
+    @contextmanager
+    def span(self, name, **attributes):
+        """
+        Opens a span for the duration of a with block. The span is the child of the span that's open in the
+        current context, if any. If the block raises, the span's status is "error".
+
+        :param name: The name of the operation.
+        :param attributes: The initial attributes.
+        :return: A context manager that yields the span.
+        """
+        parent = _current_span.get()
+        span = Span(
+            name,
+            trace_id=parent.trace_id if parent is not None else uuid.uuid4().hex,
+            parent_id=parent.span_id if parent is not None else None,
+            attributes=attributes,
+        )
+        token = _current_span.set(span)
+        self._start(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.status = "error"
+            span.set(error=f"{type(e).__name__}: {e}")
+            raise
+        finally:
+            _current_span.reset(token)
+            span.end()
+            self._export(span)
+
+    def get_exporter(self, exporter_type):
+        """
+        :param exporter_type: The class of the exporter.
+        :return: The first exporter of the given class, or None.
+        """
+        return next((exporter for exporter in self.exporters if isinstance(exporter, exporter_type)), None)
+
+    def _start(self, span):
+        """
+        Tells the exporters that have a start method that a span opened. A failing exporter doesn't fail the
+        traced operation.
+
+        :param span: The span that opened.
+        """
+        for exporter in self.exporters:
+            if hasattr(exporter, "start"):
+                try:
+                    exporter.start(span)
+                except Exception as e:
+                    logging.warning("Warning: Couldn't export the start of the span %s: %s", span.name, e)
+
+    def _export(self, span):
+        """
+        Passes a finished span to all exporters. A failing exporter doesn't fail the traced operation.
+
+        :param span: The finished span.
+        """
+        for exporter in self.exporters:
+            try:
+                exporter.export(span)
+            except Exception as e:
+                logging.warning("Warning: Couldn't export the span %s: %s", span.name, e)
+
+
+class JsonLinesExporter:
+    """
+    Appends each span to a file as a JSON line.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: The path of the JSON lines file.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, span):
+        line = json.dumps(span.to_dict(), default=str) + "\n"
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+
+class PrometheusExporter:
+    """
+    Aggregates spans into Prometheus metrics: a histogram of the span durations, and counters of the tokens,
+    the request payload bytes, and the stop reasons.
+    """
+
+    def __init__(self, path=None, prefix="architecture_chat"):
+        """
+        :param path: The file the metrics are written to after each trace, e.g. for the node exporter's textfile
+            collector; or None to only render them on request.
+        :param prefix: The prefix of the metric names.
+        """
+        self.path = path
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._durations = {}
+        self._tokens = {}
+        self._payload_bytes = {}
+        self._stop_reasons = {}
+
+    def export(self, span):
+        labels = (("span", span.name), ("status", span.status)) + tuple(
+            (key, str(span.attributes[key])) for key in LABEL_ATTRIBUTES if key in span.attributes
+        )
+        model_labels = tuple(label for label in labels if label[0] in ("span", "model_id"))
+
+        with self._lock:
+            histogram = self._durations.setdefault(labels, {"buckets": [0] * len(DURATION_BUCKETS), "sum": 0.0, "count": 0})
+            duration_seconds = span.duration_ms / 1000
+            for index, upper_bound in enumerate(DURATION_BUCKETS):
+                if duration_seconds <= upper_bound:
+                    histogram["buckets"][index] += 1
+            histogram["sum"] += duration_seconds
+            histogram["count"] += 1
+
+            # Only model calls count tokens, so a turn's tokens aren't counted again for the turn's span
+            if span.name == "bedrock_call":
+                for attribute, token_type in TOKEN_ATTRIBUTES.items():
+                    if span.attributes.get(attribute):
+                        key = model_labels + (("type", token_type),)
+                        self._tokens[key] = self._tokens.get(key, 0) + span.attributes[attribute]
+                if "stop_reason" in span.attributes:
+                    key = model_labels + (("stop_reason", str(span.attributes["stop_reason"])),)
+                    self._stop_reasons[key] = self._stop_reasons.get(key, 0) + 1
+
+            if "request_bytes" in span.attributes:
+                key = (("span", span.name),)
+                self._payload_bytes[key] = self._payload_bytes.get(key, 0) + span.attributes["request_bytes"]
+
+        if self.path and span.parent_id is None:
+            self.write(self.path)
+
+    def render(self):
+        """
+        :return: The metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        with self._lock:
+            name = f"{self.prefix}_span_duration_seconds"
+            lines += [f"# HELP {name} The duration of the traced operations.", f"# TYPE {name} histogram"]
+            for labels, histogram in sorted(self._durations.items()):
+                for upper_bound, count in zip(DURATION_BUCKETS, histogram["buckets"]):
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', str(upper_bound)),))} {count}")
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {histogram['count']}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {histogram['sum']:.6f}")
+                lines.append(f"{name}_count{_format_labels(labels)} {histogram['count']}")
+
+            for name, help_text, counters in (
+                (f"{self.prefix}_tokens_total", "The tokens of the calls to Amazon Bedrock.", self._tokens),
+                (f"{self.prefix}_request_payload_bytes_total", "The size of the request payloads.", self._payload_bytes),
+                (f"{self.prefix}_stop_reasons_total", "The stop reasons of the model responses.", self._stop_reasons),
+            ):
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+                for labels, value in sorted(counters.items()):
+                    lines.append(f"{name}{_format_labels(labels)} {value}")
+
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """
+        Writes the metrics to a file. The file is replaced atomically, so scrapers never read a partial file.
+
+        :param path: The path of the metrics file.
+        """
+        temporary_path = f"{path}.tmp"
+        with open(temporary_path, "w", encoding="utf-8") as f:
+            f.write(self.render())
+        os.replace(temporary_path, path)
+
+
+class ConsoleExporter:
+    """
+    Prints the progress of each turn to the console, next to the conversation: the calls to the model, and the
+    turn's latency and tokens when it ends. Spans of background work, which have a purpose attribute, like the
+    analysis of a diagram, aren't printed as progress.
+    """
+
+    def __init__(self, all_spans=True):
+        """
+        :param all_spans: Whether to also print a line with the duration and attributes of each span.
+        """
+        self.all_spans = all_spans
+
+    def start(self, span):
+        from util import demo_print_utils
+
+        if span.name == "bedrock_call" and "purpose" not in span.attributes:
+            demo_print_utils.call_to_bedrock(span.attributes.get("input") == "tool_results")
+
+    def export(self, span):
+        from util import demo_print_utils
+
+        if self.all_spans:
+            demo_print_utils.span_finished(span.name, span.duration_ms, span.status, span.attributes)
+        if span.name == "user_turn" and "total_latency_ms" in span.attributes:
+            attributes = span.attributes
+            demo_print_utils.turn_latency(attributes.get("time_to_first_token_ms"), attributes["total_latency_ms"])
+            demo_print_utils.turn_usage(
+                attributes.get("input_tokens", 0),
+                attributes.get("output_tokens", 0),
+                attributes.get("cache_read_input_tokens", 0),
+                attributes.get("cache_write_input_tokens", 0),
+            )
+
+
+# The exporters that can be set with TRACE_EXPORTERS, by name
+EXPORTERS = {
+    "jsonl": lambda: JsonLinesExporter(os.getenv('TRACE_FILE', DEFAULT_TRACE_FILE)),
+    "prometheus": lambda: PrometheusExporter(os.getenv('METRICS_FILE') or None),
+    "console": ConsoleExporter,
+}
+
+
+def get_tracer():
+    """
+    Returns the process-wide tracer, creating it with the exporters set in TRACE_EXPORTERS on first use.
+    Without exporters, spans are still timed, but not recorded anywhere.
+
+    :return: The tracer.
+    """
+    global _tracer
+
+    with _tracer_lock:
+        if _tracer is None:
+            names = [name.strip() for name in os.getenv('TRACE_EXPORTERS', '').split(",") if name.strip()]
+            unknown_names = [name for name in names if name not in EXPORTERS]
+            if unknown_names:
+                raise ValueError(f"Unknown trace exporters {unknown_names}, expected some of {list(EXPORTERS)}.")
+            _tracer = Tracer([EXPORTERS[name]() for name in names])
+        return _tracer
+
+
+def current_span():
+    """
+    :return: The span that's open in the current context, or None.
+    """
+    return _current_span.get()
+
+
+def payload_bytes(payload):
+    """
+    Estimates the size of a request payload as it's sent in a JSON request body, with binary values, like
+    images, encoded in base64. This avoids serializing the payload, which can contain several megabytes of images.
+
+    :param payload: The payload, made of dicts, lists, strings, bytes, and numbers.
+    :return: The estimated number of bytes.
+    """
+    if isinstance(payload, (bytes, bytearray)):
+        return 4 * -(-len(payload) // 3) + 2
+    if isinstance(payload, str):
+        return len(payload.encode("utf-8")) + 2
+    if isinstance(payload, dict):
+        return 1 + sum(payload_bytes(key) + payload_bytes(value) + 2 for key, value in payload.items())
+    if isinstance(payload, (list, tuple)):
+        return 1 + sum(payload_bytes(item) + 1 for item in payload)
+    return len(json.dumps(payload, default=str))
+
+
+def token_attributes(usage):
+    """
+    :param usage: The usage field of a Converse or ConverseStream response.
+    :return: The span attributes with the token counts of the usage.
+    """
+    return {
+        "input_tokens": usage.get("inputTokens", 0),
+        "output_tokens": usage.get("outputTokens", 0),
+        "cache_read_input_tokens": usage.get("cacheReadInputTokens", 0),
+        "cache_write_input_tokens": usage.get("cacheWriteInputTokens", 0),
+    }
+
+
+def _format_labels(labels):
+    """
+    :param labels: The label names and values.
+    :return: The labels in the Prometheus text format, e.g. {span="bedrock_call"}.
+    """
+    escaped = (
+        (name, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for name, value in labels
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
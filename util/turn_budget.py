@@ -0,0 +1,73 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import time
+
+
+class TurnBudget:
+    """
+    Tracks the resources a single user turn consumes across all of its model calls and tool rounds,
+    and reports which budget, if any, has been exhausted.
+    """
+
+    def __init__(self, max_tool_rounds, max_seconds=None, max_input_tokens=None, max_output_tokens=None):
+        """
+        :param max_tool_rounds: The maximum number of tool rounds, i.e. tool results sent back to the model.
+        :param max_seconds: The maximum wall-clock time of the turn in seconds, or None for no limit.
+        :param max_input_tokens: The maximum number of input tokens across all model calls, or None for no limit.
+        :param max_output_tokens: The maximum number of output tokens across all model calls, or None for no limit.
+        """
+        self.max_tool_rounds = max_tool_rounds
+        self.max_seconds = max_seconds
+        self.max_input_tokens = max_input_tokens
+        self.max_output_tokens = max_output_tokens
+
+        self.started_at = time.monotonic()
+        self.tool_rounds = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+
+    def record_usage(self, usage):
+        """
+        Adds the token usage of a model call to the budget.
+
+        :param usage: The usage field of a Converse or ConverseStream response.
+        """
+        self.input_tokens += usage.get("inputTokens", 0)
+        self.output_tokens += usage.get("outputTokens", 0)
+
+    def record_tool_round(self):
+        """
+        Adds a tool round to the budget.
+        """
+        self.tool_rounds += 1
+
+    def elapsed_seconds(self):
+        """
+        :return: The wall-clock time since the turn started in seconds.
+        """
+        return time.monotonic() - self.started_at
+
+    def remaining_seconds(self):
+        """
+        :return: The wall-clock time left in the turn in seconds, or None if there is no time limit.
+        """
+        if self.max_seconds is None:
+            return None
+        return max(0.0, self.max_seconds - self.elapsed_seconds())
+
+    def exhausted(self):
+        """
+        Checks whether the turn may start another tool round.
+
+        :return: A description of the exhausted budget, or None if another tool round is within budget.
+        """
+        if self.tool_rounds >= self.max_tool_rounds:
+            return f"tool round limit ({self.max_tool_rounds} rounds)"
+        if self.max_seconds is not None and self.elapsed_seconds() >= self.max_seconds:
+            return f"time limit ({self.max_seconds:g} seconds)"
+        if self.max_input_tokens is not None and self.input_tokens >= self.max_input_tokens:
+            return f"input token limit ({self.max_input_tokens} tokens)"
+        if self.max_output_tokens is not None and self.output_tokens >= self.max_output_tokens:
+            return f"output token limit ({self.max_output_tokens} tokens)"
+        return None